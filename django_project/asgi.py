@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "django_project.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Gli stream SSE della disponibilità posti (/api/events/.../stream/) sono
+# serviti prima di Django; tutte le altre richieste passano all'app Django
+from tickets.streams import SeatStreamApp  # noqa: E402
+
+application = SeatStreamApp(django_application)
@@ -0,0 +1,41 @@
+"""Configurazione dei database dalle variabili d'ambiente (usata da settings.py).
+
+Ogni URL è nel formato di dj-database-url. Le connessioni restano aperte
+per ``conn_max_age`` secondi e vengono verificate prima di essere riusate;
+con ``pool`` (solo PostgreSQL con psycopg 3) ogni processo tiene invece un
+pool di connessioni e le restituisce a fine richiesta. Le repliche diventano
+gli alias ``replica_0``, ``replica_1``... usati da tickets.replicas.
+"""
+import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
+
+REPLICA_PREFIX = 'replica_'
+
+
+def _database(url, conn_max_age, pool):
+    config = dj_database_url.parse(url, conn_max_age=conn_max_age, conn_health_checks=conn_max_age > 0)
+    if pool and config['ENGINE'] == 'django.db.backends.postgresql':
+        try:
+            import psycopg_pool  # noqa: F401
+        except ImportError:
+            raise ImproperlyConfigured("DB_POOL richiede psycopg 3 con il pool: psycopg[pool]")
+        # Django non ammette il pool insieme alle connessioni persistenti
+        config['CONN_MAX_AGE'] = 0
+        config['CONN_HEALTH_CHECKS'] = False
+        config.setdefault('OPTIONS', {})['pool'] = pool
+    return config
+
+
+def database_settings(url, replica_urls=(), conn_max_age=60, pool=None):
+    """Dizionario DATABASES: 'default' da `url` più una voce per replica.
+
+    `pool` è None o il dizionario di opzioni di psycopg_pool.ConnectionPool
+    (min_size, max_size, timeout...).
+    """
+    databases = {'default': _database(url, conn_max_age, pool)}
+    for i, replica_url in enumerate(replica_urls):
+        config = _database(replica_url, conn_max_age, pool)
+        # Nei test le repliche leggono il database di test di default
+        config['TEST'] = {'MIRROR': 'default'}
+        databases[f'{REPLICA_PREFIX}{i}'] = config
+    return databases
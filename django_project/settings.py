@@ -12,7 +12,9 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
-import dj_database_url
+import sys
+
+from .database import REPLICA_PREFIX, database_settings
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,15 +50,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "tickets.middleware.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     'corsheaders.middleware.CorsMiddleware',
-    'django.middleware.common.CommonMiddleware',
     "django.middleware.common.CommonMiddleware",
+    "tickets.middleware.AdmissionQueueMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "tickets.middleware.ReplicaPinMiddleware",
 ]
 CORS_ALLOW_ALL_ORIGINS = True  # Solo per sviluppo locale!
 CORS_ALLOW_CREDENTIALS = True  # cookie/JWT
@@ -71,8 +75,14 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'x-queue-token',
+    'idempotency-key',
+    'x-profile',
 ]
 
+# Leggibili dal JavaScript delle pagine di altre origini
+CORS_EXPOSE_HEADERS = ['server-timing', 'x-profile-id']
+
 CORS_ALLOW_METHODS = [
     'DELETE',
     'GET',
@@ -106,15 +116,43 @@ WSGI_APPLICATION = "django_project.wsgi.application"
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'railway',
-        'USER': 'postgres' ,
-        'PASSWORD': 'FtacuYcytOREyUhgxYSPRELDQyouCoBT' ,
-        'HOST':'postgres.railway.internal' ,
-        'PORT':'5432'
-    }
+# DATABASE_URL: database principale (senza, il db.sqlite3 locale, usato anche
+# da manage.py test); DATABASE_REPLICA_URLS: repliche in sola lettura separate
+# da virgola (tickets.replicas). Le connessioni restano aperte
+# DB_CONN_MAX_AGE secondi (0 = una connessione per richiesta) e vengono
+# verificate prima del riuso. DB_POOL=1 usa il pool di psycopg 3 al posto
+# delle connessioni persistenti (solo PostgreSQL): DB_POOL_MAX_SIZE connessioni
+# per processo, attese al massimo DB_POOL_TIMEOUT secondi
+DATABASES = database_settings(
+    os.environ.get('DATABASE_URL', f'sqlite:///{BASE_DIR / "db.sqlite3"}'),
+    replica_urls=[url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url],
+    conn_max_age=int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+    pool={
+        'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+        'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '10')),
+        'timeout': float(os.environ.get('DB_POOL_TIMEOUT', '10')),
+    } if os.environ.get('DB_POOL') == '1' else None,
+)
+
+# manage.py test senza repliche configurate: una replica che rispecchia il
+# database di test di default, per i test dell'instradamento delle letture
+if sys.argv[1:2] == ['test'] and len(DATABASES) == 1:
+    DATABASES[f'{REPLICA_PREFIX}0'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['tickets.replicas.ReplicaRouter']
+
+# Letture sulle repliche (tickets.replicas): dopo una scrittura l'utente legge
+# dal primario per STICKY_SECONDS (cookie firmato PIN_COOKIE e voce nella
+# cache PIN_CACHE, condivisa tra i processi con REDIS_URL); le repliche in
+# ritardo di oltre MAX_LAG secondi, misurato da LAG_FUNCTION al più ogni
+# LAG_CHECK_INTERVAL secondi, vengono escluse
+REPLICAS = {
+    'STICKY_SECONDS': 5,
+    'PIN_COOKIE': 'db_pin',
+    'PIN_CACHE': 'responses',
+    'MAX_LAG': 2,
+    'LAG_CHECK_INTERVAL': 5,
+    'LAG_FUNCTION': 'tickets.replicas.replication_lag',
 }
 
 
@@ -168,9 +206,19 @@ except FileExistsError:
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 
+# JWT_STATELESS_AUTH=1: l'utente si costruisce dai claim del token invece di
+# caricarlo a ogni richiesta (users.authentication); lo stato dell'utente
+# (attivo, staff, password) resta in cache per CACHE_TTL secondi
+JWT_STATELESS_AUTH = os.environ.get('JWT_STATELESS_AUTH') == '1'
+STATELESS_AUTH = {
+    'CACHE_TTL': 30,
+    'CACHE_SIZE': 10000,
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.StatelessJWTAuthentication' if JWT_STATELESS_AUTH
+        else 'rest_framework_simplejwt.authentication.JWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -178,5 +226,179 @@ REST_FRAMEWORK = {
     ]
 }
 
+# Paginazione keyset degli endpoint di lista (?page_size= fino al massimo)
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+
+# GET di lista, dettaglio e ricerca eventi con l'ORM asincrono (tickets.async_views);
+# False le riporta sulle view DRF sincrone
+ASYNC_READ_VIEWS = os.environ.get('ASYNC_READ_VIEWS', '1') == '1'
+
+# Strumentazione delle richieste (tickets.instrumentation): metriche Prometheus
+# su /metrics (con METRICS_TOKEN come bearer token per lo scraper, altrimenti
+# solo staff), dump cProfile in PROFILE_DIR per le richieste di staff con
+# l'header PROFILE_HEADER o per una frazione PROFILE_SAMPLE_RATE delle
+# richieste e, con SERVER_TIMING=1, l'header Server-Timing su ogni risposta:
+# espone a qualunque client tempi e numero di query, solo per sviluppo e benchmark
+INSTRUMENTATION = {
+    'ENABLED': os.environ.get('INSTRUMENTATION_ENABLED', '1') == '1',
+    'SERVER_TIMING': os.environ.get('SERVER_TIMING', '0') == '1',
+    'METRICS_TOKEN': os.environ.get('METRICS_TOKEN', ''),
+    'PROFILE_HEADER': 'X-Profile',
+    'PROFILE_SAMPLE_RATE': float(os.environ.get('PROFILE_SAMPLE_RATE', '0')),
+    'PROFILE_DIR': os.environ.get('PROFILE_DIR', str(BASE_DIR / 'profiles')),
+    'PROFILE_MAX_FILES': 200,
+}
+
+# Latenza artificiale (ms) per ogni query SQL: solo per i benchmark
+SIMULATED_DB_LATENCY_MS = int(os.environ.get('SIMULATED_DB_LATENCY_MS', '0'))
+# Costo artificiale (ms) dell'apertura di ogni connessione (TCP, TLS,
+# autenticazione): solo per i benchmark
+SIMULATED_DB_CONNECT_MS = int(os.environ.get('SIMULATED_DB_CONNECT_MS', '0'))
+
 AUTH_USER_MODEL = 'users.CustomUser'  # Specifica il modello utente personalizzato
 
+# Hash delle password (users.hashers): PASSWORD_HASHER sceglie l'algoritmo
+# delle nuove password (argon2 richiede argon2-cffi); gli hash di un altro
+# algoritmo vengono riscritti al primo login riuscito. Gli hash girano su un
+# pool di HASHING['WORKERS'] thread (0 = sul thread della richiesta): oltre
+# MAX_PENDING richieste in attesa login e registrazione rispondono 503.
+# HASHING['ARGON2'] sostituisce i parametri argon2 di Django (time_cost,
+# memory_cost in KiB, parallelism) e al login gli hash esistenti vengono
+# riscritti con i nuovi valori, anche se più deboli: ARGON2_PROFILE=owasp
+# sceglie il minimo OWASP (19 MiB, 2 passate), circa un decimo del costo
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'argon2')
+_PASSWORD_HASHERS = {
+    'argon2': 'users.hashers.Argon2PasswordHasher',
+    'scrypt': 'users.hashers.ScryptPasswordHasher',
+    'pbkdf2': 'users.hashers.PBKDF2PasswordHasher',
+}
+PASSWORD_HASHERS = [
+    _PASSWORD_HASHERS[PASSWORD_HASHER],
+    *(path for name, path in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER),
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+HASHING = {
+    'WORKERS': int(os.environ.get('HASHING_WORKERS', os.cpu_count() or 1)),
+    'MAX_PENDING': 32,
+    'ARGON2': {'time_cost': 2, 'memory_cost': 19456, 'parallelism': 1}
+    if os.environ.get('ARGON2_PROFILE') == 'owasp' else {},
+}
+
+
+# Allocazione posti: retry con backoff sugli errori di contesa del database
+SEAT_ALLOCATION = {
+    'MAX_RETRIES': 5,
+    'BACKOFF_BASE': 0.01,  # secondi
+    'BACKOFF_MAX': 0.5,
+}
+
+# Coda di ammissione (virtual waiting room) per le vendite ad alta domanda.
+# Backend: tickets.admission.InMemoryBackend (singolo processo),
+# tickets.admission.SQLiteBackend (OPTIONS: {'path': ...}) o
+# tickets.admission.RedisBackend (OPTIONS: {'url': 'redis://...'})
+ADMISSION_QUEUE = {
+    'BACKEND': os.environ.get('ADMISSION_QUEUE_BACKEND', 'tickets.admission.InMemoryBackend'),
+    'OPTIONS': {'url': os.environ['REDIS_URL']} if os.environ.get('REDIS_URL') else {},
+    'TOKEN_MAX_AGE': 3600,  # secondi di validità di un token di coda
+}
+
+# Cache: 'responses' ospita le risposte pubbliche sugli eventi (Redis se
+# REDIS_URL è impostato, altrimenti locmem, valida solo nel singolo processo)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    } if os.environ.get('REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'responses',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# Cache di lista, dettaglio e ricerca eventi, invalidata dalle scritture;
+# TIMEOUT (secondi) è l'età massima di una risposta servita dalla cache
+RESPONSE_CACHE = {
+    'ENABLED': os.environ.get('RESPONSE_CACHE_ENABLED', '1') == '1',
+    'ALIAS': 'responses',
+    'TIMEOUT': 30,
+    'KEY_PREFIX': 'responses',
+}
+
+# Stream SSE della disponibilità posti (/api/events/stream/, solo sotto ASGI).
+# Con più worker serve il broker Redis: InProcessBroker raggiunge solo gli
+# stream del processo che ha scritto
+SEAT_STREAM = {
+    'BROKER': 'tickets.streams.RedisBroker' if os.environ.get('REDIS_URL') else 'tickets.streams.InProcessBroker',
+    'OPTIONS': {'url': os.environ['REDIS_URL']} if os.environ.get('REDIS_URL') else {},
+    'COALESCE_MS': 250,  # intervallo di accorpamento delle variazioni per evento
+    'KEEPALIVE': 15,     # secondi tra due commenti di keepalive
+    'MAX_EVENTS': 50,    # eventi per connessione
+}
+
+# Idempotency-Key sulle POST di prenotazioni e pagamenti: la risposta resta
+# ripetibile per TTL secondi, una richiesta in corso blocca la chiave per
+# LOCK_TTL secondi al massimo e i duplicati concorrenti ne attendono l'esito
+# per WAIT_TIMEOUT secondi. Con più worker serve lo store Redis
+IDEMPOTENCY = {
+    'BACKEND': 'tickets.idempotency.RedisStore' if os.environ.get('REDIS_URL') else 'tickets.idempotency.InMemoryStore',
+    'OPTIONS': {'url': os.environ['REDIS_URL']} if os.environ.get('REDIS_URL') else {'max_keys': 100000},
+    'TTL': 86400,
+    'LOCK_TTL': 60,
+    'WAIT_TIMEOUT': 10,
+}
+
+# Pipeline dei pagamenti (tickets.payments): GATEWAY è l'adapter verso il
+# processore (FakeGateway simula latenza ed errori), TIMEOUT la durata massima
+# di una chiamata, LEASE il tempo dopo cui un pagamento reclamato da un worker
+# morto torna in coda. Con WORKERS_IN_PROCESS il processo web avvia WORKERS
+# thread alla prima richiesta di pagamento; altrimenti (o in aggiunta) si
+# lancia il comando process_payments
+PAYMENTS = {
+    'GATEWAY': os.environ.get('PAYMENT_GATEWAY', 'tickets.payments.FakeGateway'),
+    'GATEWAY_OPTIONS': {
+        'latency_ms': int(os.environ.get('FAKE_GATEWAY_LATENCY_MS', '200')),
+        'failure_rate': float(os.environ.get('FAKE_GATEWAY_FAILURE_RATE', '0')),
+        'decline_rate': float(os.environ.get('FAKE_GATEWAY_DECLINE_RATE', '0')),
+    },
+    'TIMEOUT': 5,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_BASE': 1,   # secondi, raddoppiati a ogni tentativo
+    'BACKOFF_MAX': 60,
+    'LEASE': 60,
+    'BREAKER_THRESHOLD': 5,
+    'BREAKER_RESET': 30,
+    'WORKERS_IN_PROCESS': os.environ.get('PAYMENT_WORKERS_IN_PROCESS', '1') == '1',
+    'WORKERS': 4,
+    'BATCH_SIZE': 10,
+    'POLL_INTERVAL': 1,
+    'CALLBACK_TIMEOUT': 5,
+    # Host ammessi per callback_url (stessa sintassi di ALLOWED_HOSTS); None =
+    # qualunque host che risolve solo in indirizzi pubblici
+    'CALLBACK_HOSTS': None,
+}
+
+# Calendario della disponibilità (/api/events/availability/, tickets.availability):
+# ampiezza massima in giorni dell'intervallo richiesto, per granularità
+AVAILABILITY_CALENDAR = {
+    'MAX_DAYS': {'day': 400, 'hour': 31},
+}
+
+# Export in streaming di prenotazioni e pagamenti (tickets.exports): righe lette
+# dal cursore per ogni giro e righe accorpate in ogni scrittura della risposta
+EXPORTS = {
+    'CHUNK_SIZE': 2000,
+    'ROWS_PER_WRITE': 500,
+}
+
+# Prenotazioni in attesa di pagamento: scadono dopo TTL secondi e i posti
+# vengono rilasciati dalla sweep (comando sweep_holds o thread in-process)
+RESERVATION_HOLDS = {
+    'TTL': 600,
+    'SWEEP_BATCH_SIZE': 1000,
+    'SWEEP_IN_PROCESS': os.environ.get('HOLD_SWEEP_IN_PROCESS') == '1',
+    'SWEEP_INTERVAL': 30,
+}
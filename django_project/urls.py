@@ -21,6 +21,7 @@ from django.views.generic import TemplateView
 from rest_framework_simplejwt.views  import (
     TokenRefreshView,
 )
+from tickets.views import MetricsView
 
 urlpatterns = [
     # Admin panel
@@ -35,4 +36,7 @@ urlpatterns = [
     # JWT Token Refresh
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 
+    # Metriche Prometheus (tickets.instrumentation)
+    path('metrics', MetricsView.as_view(), name='metrics'),
+
 ]
\ No newline at end of file
@@ -0,0 +1,311 @@
+"""Coda di ammissione (virtual waiting room) per le vendite ad alta domanda.
+
+Quando la coda di un evento è aperta, ogni client ottiene un token firmato che
+contiene l'id dell'evento e il proprio numero d'ordine. Lo stato della coda per
+evento sono solo quattro numeri: la tariffa di ammissione (persone/secondo),
+la coda (`tail`, prossimo numero da assegnare), la testa (`head`, fin dove si è
+ammessi) e l'istante dell'ultimo avanzamento. La testa avanza in modo pigro a
+ogni lettura, quindi non serve un processo scheduler separato.
+
+Lo stato non vive mai su Postgres: il backend è configurabile tramite
+``settings.ADMISSION_QUEUE['BACKEND']`` (memoria di processo, file SQLite o un
+server compatibile Redis).
+"""
+import math
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+TOKEN_SALT = 'tickets.admission'
+
+
+def _config(key, default=None):
+    return getattr(settings, 'ADMISSION_QUEUE', {}).get(key, default)
+
+
+def _advance(rate, tail, head, last, now):
+    """Nuova testa della coda: avanza di `rate` ammissioni al secondo, mai oltre `tail`.
+
+    A coda vuota la testa non accumula credito, così un evento rimasto
+    inattivo non ammette tutti insieme i client che arrivano dopo.
+    """
+    if head < tail:
+        head = min(tail, head + rate * (now - last))
+    return head
+
+
+class BaseAdmissionBackend:
+    """Interfaccia dei backend della coda di ammissione"""
+
+    def open(self, event_id, rate):
+        raise NotImplementedError
+
+    def close(self, event_id):
+        raise NotImplementedError
+
+    def enqueue(self, event_id):
+        """Assegna il prossimo numero d'ordine, None se la coda è chiusa"""
+        raise NotImplementedError
+
+    def state(self, event_id):
+        """(rate, tail, head) dopo l'avanzamento, None se la coda è chiusa"""
+        raise NotImplementedError
+
+    def claim(self, event_id, seq):
+        """Segna il token come usato; False se lo era già"""
+        raise NotImplementedError
+
+    def release(self, event_id, seq):
+        raise NotImplementedError
+
+
+class InMemoryBackend(BaseAdmissionBackend):
+    """Backend in memoria di processo: adatto a test e a un singolo worker"""
+
+    def __init__(self, **options):
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._claims = set()
+
+    def open(self, event_id, rate):
+        with self._lock:
+            queue = self._queues.setdefault(event_id, {'tail': 0, 'head': 0.0})
+            queue.update(rate=float(rate), last=time.time())
+
+    def close(self, event_id):
+        with self._lock:
+            self._queues.pop(event_id, None)
+            self._claims = {c for c in self._claims if c[0] != event_id}
+
+    def enqueue(self, event_id):
+        with self._lock:
+            queue = self._queues.get(event_id)
+            if queue is None:
+                return None
+            seq = queue['tail']
+            queue['tail'] += 1
+            return seq
+
+    def state(self, event_id):
+        now = time.time()
+        with self._lock:
+            queue = self._queues.get(event_id)
+            if queue is None:
+                return None
+            queue['head'] = _advance(queue['rate'], queue['tail'], queue['head'], queue['last'], now)
+            queue['last'] = now
+            return queue['rate'], queue['tail'], queue['head']
+
+    def claim(self, event_id, seq):
+        with self._lock:
+            if (event_id, seq) in self._claims:
+                return False
+            self._claims.add((event_id, seq))
+            return True
+
+    def release(self, event_id, seq):
+        with self._lock:
+            self._claims.discard((event_id, seq))
+
+
+class SQLiteBackend(BaseAdmissionBackend):
+    """Backend su file SQLite locale, condiviso tra i worker della stessa macchina"""
+
+    def __init__(self, path=':memory:', **options):
+        self.path = path
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS admission_queue ("
+                "event_id INTEGER PRIMARY KEY, rate REAL, tail INTEGER, head REAL, last REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS admission_claim ("
+                "event_id INTEGER, seq INTEGER, PRIMARY KEY (event_id, seq))"
+            )
+
+    def _transaction(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # ':memory:' condiviso tra i thread del processo tramite URI
+            target = 'file:admission?mode=memory&cache=shared' if self.path == ':memory:' else self.path
+            conn = sqlite3.connect(target, uri=self.path == ':memory:', timeout=5,
+                                   isolation_level=None, check_same_thread=False)
+            self._local.conn = conn
+        return _Transaction(conn)
+
+    def open(self, event_id, rate):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO admission_queue VALUES (?, ?, 0, 0, ?) "
+                "ON CONFLICT(event_id) DO UPDATE SET rate = excluded.rate, last = excluded.last",
+                (event_id, float(rate), time.time())
+            )
+
+    def close(self, event_id):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM admission_queue WHERE event_id = ?", (event_id,))
+            conn.execute("DELETE FROM admission_claim WHERE event_id = ?", (event_id,))
+
+    def enqueue(self, event_id):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "UPDATE admission_queue SET tail = tail + 1 WHERE event_id = ? RETURNING tail",
+                (event_id,)
+            ).fetchone()
+        return row[0] - 1 if row else None
+
+    def state(self, event_id):
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT rate, tail, head, last FROM admission_queue WHERE event_id = ?",
+                (event_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            rate, tail, head, last = row
+            head = _advance(rate, tail, head, last, now)
+            conn.execute(
+                "UPDATE admission_queue SET head = ?, last = ? WHERE event_id = ?",
+                (head, now, event_id)
+            )
+        return rate, tail, head
+
+    def claim(self, event_id, seq):
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO admission_claim VALUES (?, ?)", (event_id, seq)
+            )
+        return cursor.rowcount == 1
+
+    def release(self, event_id, seq):
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM admission_claim WHERE event_id = ? AND seq = ?", (event_id, seq)
+            )
+
+
+class _Transaction:
+    """Transazione SQLite `BEGIN IMMEDIATE`: serializza gli avanzamenti della coda"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class RedisBackend(BaseAdmissionBackend):
+    """Backend su un server compatibile Redis, condiviso da tutti i worker"""
+
+    ADVANCE_SCRIPT = """
+    local rate = tonumber(redis.call('HGET', KEYS[1], 'rate'))
+    if not rate then return nil end
+    local now = tonumber(ARGV[1])
+    local tail = tonumber(redis.call('HGET', KEYS[1], 'tail') or '0')
+    local head = tonumber(redis.call('HGET', KEYS[1], 'head') or '0')
+    local last = tonumber(redis.call('HGET', KEYS[1], 'last') or ARGV[1])
+    if head < tail then head = math.min(tail, head + rate * (now - last)) end
+    redis.call('HSET', KEYS[1], 'head', tostring(head), 'last', ARGV[1])
+    return {tostring(rate), tostring(tail), tostring(head)}
+    """
+    ENQUEUE_SCRIPT = """
+    if redis.call('HEXISTS', KEYS[1], 'rate') == 0 then return nil end
+    return redis.call('HINCRBY', KEYS[1], 'tail', 1) - 1
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='admission', claim_ttl=3600, **options):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured("RedisBackend richiede il pacchetto 'redis'")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.claim_ttl = claim_ttl
+        self._advance = self.client.register_script(self.ADVANCE_SCRIPT)
+        self._enqueue = self.client.register_script(self.ENQUEUE_SCRIPT)
+
+    def _key(self, event_id):
+        return f'{self.prefix}:{event_id}'
+
+    def open(self, event_id, rate):
+        self.client.hset(self._key(event_id), mapping={'rate': float(rate), 'last': time.time()})
+
+    def close(self, event_id):
+        self.client.delete(self._key(event_id))
+
+    def enqueue(self, event_id):
+        return self._enqueue(keys=[self._key(event_id)])
+
+    def state(self, event_id):
+        result = self._advance(keys=[self._key(event_id)], args=[time.time()])
+        if result is None:
+            return None
+        rate, tail, head = (float(value) for value in result)
+        return rate, int(tail), head
+
+    def claim(self, event_id, seq):
+        return bool(self.client.set(f'{self._key(event_id)}:claim:{seq}', 1, nx=True, ex=self.claim_ttl))
+
+    def release(self, event_id, seq):
+        self.client.delete(f'{self._key(event_id)}:claim:{seq}')
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend_class = import_string(_config('BACKEND', 'tickets.admission.InMemoryBackend'))
+                _backend = backend_class(**_config('OPTIONS', {}))
+    return _backend
+
+
+def make_token(event_id, seq):
+    return signing.dumps([event_id, seq], salt=TOKEN_SALT, compress=True)
+
+
+def read_token(token):
+    """(event_id, seq) dal token; solleva ``signing.BadSignature`` se non valido o scaduto"""
+    event_id, seq = signing.loads(token, salt=TOKEN_SALT, max_age=_config('TOKEN_MAX_AGE', 3600))
+    return event_id, seq
+
+
+def join(event_id):
+    """Mette in coda un client; None se la coda dell'evento non è attiva"""
+    seq = get_backend().enqueue(event_id)
+    if seq is None:
+        return None
+    return {'token': make_token(event_id, seq), **position(event_id, seq)}
+
+
+def position(event_id, seq):
+    """Posizione del token in coda: `position` 0 significa ammesso"""
+    state = get_backend().state(event_id)
+    if state is None:
+        return {'active': False, 'position': 0, 'retry_after': 0}
+    rate, tail, head = state
+    ahead = max(0, math.floor(seq - head) + 1)
+    return {
+        'active': True,
+        'position': ahead,
+        'retry_after': math.ceil(ahead / rate) if ahead and rate else 0,
+    }
+
+
+def is_active(event_id):
+    return get_backend().state(event_id) is not None
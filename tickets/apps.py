@@ -1,6 +1,60 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class TicketsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tickets'
+
+    def ready(self):
+        from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
+        from . import availability, response_cache, sales, search, services, streams
+        from .models import Event
+
+        # Mantiene l'indice di ricerca in memoria (usato fuori da PostgreSQL)
+        post_save.connect(search.event_saved, sender=Event, dispatch_uid='tickets.search.saved')
+        post_delete.connect(search.event_deleted, sender=Event, dispatch_uid='tickets.search.deleted')
+
+        # Invalida le risposte in cache quando cambia un evento o i suoi posti
+        post_save.connect(response_cache.event_changed, sender=Event,
+                          dispatch_uid='tickets.response_cache.saved')
+        post_delete.connect(response_cache.event_changed, sender=Event,
+                            dispatch_uid='tickets.response_cache.deleted')
+        services.seats_changed.connect(response_cache.seats_changed,
+                                       dispatch_uid='tickets.response_cache.seats')
+
+        # Aggiornamento incrementale del calendario della disponibilità
+        pre_save.connect(availability.event_saving, sender=Event, dispatch_uid='tickets.availability.saving')
+        post_save.connect(availability.event_saved, sender=Event, dispatch_uid='tickets.availability.saved')
+        pre_delete.connect(availability.event_deleting, sender=Event,
+                           dispatch_uid='tickets.availability.deleting')
+        services.seats_changed.connect(availability.seats_changed, dispatch_uid='tickets.availability.seats')
+
+        # Righe delle statistiche di vendita per gli eventi creati ed eliminati
+        post_save.connect(sales.event_created, sender=Event, dispatch_uid='tickets.sales.created')
+        pre_delete.connect(sales.event_deleting, sender=Event, dispatch_uid='tickets.sales.deleting')
+
+        # Pubblica le variazioni dei posti agli stream SSE
+        services.seats_changed.connect(streams.seats_changed, dispatch_uid='tickets.streams.seats')
+
+        # Query SQL e serializer delle richieste strumentate (InstrumentationMiddleware)
+        from django.db.backends.signals import connection_created
+        from . import instrumentation
+        connection_created.connect(instrumentation.connection_created,
+                                   dispatch_uid='tickets.instrumentation.queries')
+        instrumentation.instrument_serializers()
+
+        if getattr(settings, 'SIMULATED_DB_LATENCY_MS', 0):
+            from django.db.backends.signals import connection_created
+            from .bench import simulate_db_latency
+            connection_created.connect(simulate_db_latency, dispatch_uid='tickets.bench.latency')
+
+        if getattr(settings, 'SIMULATED_DB_CONNECT_MS', 0):
+            from django.db.backends.signals import connection_created
+            from .bench import simulate_connect_latency
+            connection_created.connect(simulate_connect_latency, dispatch_uid='tickets.bench.connect')
+
+        holds = getattr(settings, 'RESERVATION_HOLDS', {})
+        if holds.get('SWEEP_IN_PROCESS'):
+            from .sweeper import start_sweeper
+            start_sweeper(holds.get('SWEEP_INTERVAL', 30))
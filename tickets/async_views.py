@@ -0,0 +1,134 @@
+"""Percorso asincrono per le GET pubbliche sugli eventi (lista, dettaglio, ricerca).
+
+DRF è solo sincrono: sotto ASGI una GET sulle view generiche occupa un thread
+per tutta la richiesta, attese sul database comprese. Queste view rispondono
+alle GET con l'ORM asincrono di Django riusando la configurazione delle view
+DRF corrispondenti (queryset, serializer, paginazione keyset, cache delle
+risposte, GET condizionali); gli altri metodi passano alla view DRF.
+Con ``settings.ASYNC_READ_VIEWS = False`` anche le GET tornano a DRF.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.renderers import JSONRenderer
+
+from . import conditional, response_cache, views
+from . import replicas
+from .models import Event
+
+
+def _render(data, status=200, headers=None):
+    response = HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+    for name, value in (headers or {}).items():
+        response[name] = value
+    return response
+
+
+class AsyncReadView:
+    """GET asincrona sopra la view DRF `view_class`.
+
+    Le sottoclassi implementano `build(view)` -> (dati, righe per l'ETag o
+    None) e, se la view supporta i GET condizionali, `stamp_rows(view)`.
+    """
+    view_class = None
+
+    @classmethod
+    def as_view(cls):
+        handler = cls()
+        sync_view = cls.view_class.as_view()
+
+        async def view(request, *args, **kwargs):
+            if request.method != 'GET' or not getattr(settings, 'ASYNC_READ_VIEWS', True):
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+            return await handler.dispatch(request, *args, **kwargs)
+
+        # Come le view DRF: la verifica CSRF la fa l'autenticazione di sessione
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        view = self.view_class(args=args, kwargs=kwargs, format_kwarg=None)
+        # Gli autenticatori della view: choose_replica deve vedere l'utente per il
+        # vincolo al primario dopo una scrittura
+        request = view.request = view.initialize_request(request, *args, **kwargs)
+        try:
+            alias = None
+            if getattr(view, 'read_from_replica', False) and replicas.replica_aliases():
+                # Autenticazione (per il vincolo al primario) e misura del ritardo
+                # delle repliche usano l'ORM sincrono
+                alias = await sync_to_async(replicas.choose_replica)(request)
+            with replicas.reading_from(alias):
+                return await self.get(request, view)
+        except APIException as exc:
+            return _render({'detail': exc.detail}, status=exc.status_code)
+
+    async def get(self, request, view):
+        if conditional.is_conditional(request):
+            rows = await self.stamp_rows(view)
+            if rows is not None:
+                response = conditional.not_modified(request, rows, view.stamp_last_modified)
+                if response is not None:
+                    return response
+
+        cached = response_cache.enabled()
+        if cached:
+            key = await response_cache.aresponse_key(request, view.cache_scope, view.kwargs.get('pk'))
+            entry = await response_cache.alookup(key)
+            if entry is not None:
+                status, data, headers = entry
+                response = _render(data, status, headers)
+                response['X-Cache'] = 'HIT'
+                return response
+
+        data, rows = await self.build(view)
+        response = _render(data)
+        if rows is not None:
+            conditional.set_stamp(response, rows, view.stamp_last_modified)
+        if cached:
+            await response_cache.astore(key, response, data)
+            response['X-Cache'] = 'MISS'
+        return response
+
+    async def stamp_rows(self, view):
+        return None
+
+    async def build(self, view):
+        raise NotImplementedError
+
+
+class AsyncEventListView(AsyncReadView):
+    view_class = views.EventListCreateView
+
+    async def stamp_rows(self, view):
+        return await view.paginator.apaginate_queryset(view.get_stamp_queryset(), view.request)
+
+    async def build(self, view):
+        rows = await view.paginator.apaginate_queryset(view.get_queryset(), view.request)
+        serializer = view.get_serializer(rows, many=True)
+        return view.paginator.get_paginated_response(serializer.data).data, rows
+
+
+class AsyncEventDetailView(AsyncReadView):
+    view_class = views.EventRetrieveUpdateDestroyView
+
+    async def stamp_rows(self, view):
+        return [row async for row in view.get_stamp_queryset()] or None
+
+    async def build(self, view):
+        try:
+            instance = await view.get_queryset().aget(pk=view.kwargs['pk'])
+        except Event.DoesNotExist:
+            raise NotFound(f"No {Event._meta.object_name} matches the given query.")
+        return view.get_serializer(instance).data, [instance]
+
+
+class AsyncEventSearchView(AsyncReadView):
+    view_class = views.EventSearchView
+
+    async def build(self, view):
+        # L'indice in memoria si costruisce con l'ORM sincrono alla prima ricerca
+        results = await sync_to_async(view.get_queryset)()
+        rows = await view.paginator.apaginate_queryset(results, view.request)
+        serializer = view.get_serializer(rows, many=True)
+        return view.paginator.get_paginated_response(serializer.data).data, None
@@ -0,0 +1,187 @@
+"""Calendario della disponibilità: aggregati per giorno e per ora.
+
+``AvailabilityRollup`` tiene, per ogni giorno e ogni ora (con inizio nel fuso
+di ``settings.TIME_ZONE``), il numero di eventi, i posti totali e i posti
+residui. ``/api/events/availability/`` legge un intervallo di righe
+dall'indice unico (granularity, bucket) invece di aggregare gli eventi: un
+anno intero sono al massimo 366 righe.
+
+Le righe si aggiornano con incrementi (UPDATE con F()) a ogni variazione:
+le prenotazioni, le cancellazioni, la sweep e i cambi di capienza arrivano da
+``services.seats_changed``; creazione, cambio di data o di capienza ed
+eliminazione di un evento dai segnali del modello.
+
+Gli incrementi si applicano dopo il commit, in una transazione propria: la
+riga di un giorno è condivisa da tutti i suoi eventi e bloccarla dentro la
+transazione della prenotazione serializzerebbe le vendite dell'intero giorno.
+In cambio, un crash tra il commit e l'incremento lascia una differenza, che
+``rebuild_availability`` corregge ricalcolando tutto. Le scritture che non
+passano dai segnali (``bulk_create``, ``loaddata``, ``QuerySet.update`` sui
+posti) devono chiamare `add_events` o essere seguite da un rebuild.
+"""
+import random
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import AvailabilityRollup, Event
+
+FIELDS = ('events', 'total_seats', 'remaining_seats')
+
+
+def _config(key, default=None):
+    return getattr(settings, 'AVAILABILITY_CALENDAR', {}).get(key, default)
+
+
+def max_days(granularity):
+    """Ampiezza massima, in giorni, di un intervallo del calendario"""
+    return _config('MAX_DAYS', {'day': 400, 'hour': 31})[granularity]
+
+
+def buckets(date):
+    """Inizio del giorno e dell'ora di `date` nel fuso di default"""
+    hour = timezone.localtime(date, timezone.get_default_timezone()).replace(
+        minute=0, second=0, microsecond=0
+    )
+    return {'day': hour.replace(hour=0), 'hour': hour}
+
+
+def _collect(rows):
+    """Variazioni per (granularity, bucket) da righe (data, eventi, posti totali, residui)"""
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for date, *values in rows:
+        for key in buckets(date).items():
+            delta = deltas[key]
+            for i, value in enumerate(values):
+                delta[i] += value or 0
+    return {key: dict(zip(FIELDS, delta)) for key, delta in deltas.items() if any(delta)}
+
+
+def _apply(deltas, attempts=5):
+    for attempt in range(attempts):
+        try:
+            return _increment(deltas)
+        except OperationalError:
+            # Contesa sul lock (database is locked su SQLite): nulla è stato applicato
+            if attempt == attempts - 1:
+                raise
+            time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+
+
+def _increment(deltas):
+    # Ordine fisso delle righe: due applicazioni concorrenti non vanno in deadlock
+    with transaction.atomic():
+        for (granularity, bucket), changes in sorted(deltas.items()):
+            rows = AvailabilityRollup.objects.filter(granularity=granularity, bucket=bucket)
+            increments = {field: F(field) + value for field, value in changes.items() if value}
+            if rows.update(**increments):
+                continue
+            try:
+                with transaction.atomic():
+                    AvailabilityRollup.objects.create(granularity=granularity, bucket=bucket, **changes)
+            except IntegrityError:
+                # Creata nel frattempo da un'altra transazione
+                rows.update(**increments)
+
+
+def _schedule(deltas):
+    if deltas:
+        # robust: il calendario non deve far fallire chi ha già fatto commit
+        transaction.on_commit(lambda: _apply(deltas), robust=True)
+
+
+def add(date, events=0, total_seats=0, remaining_seats=0):
+    """Variazione degli aggregati della data `date`, applicata dopo il commit"""
+    _schedule(_collect([(date, events, total_seats, remaining_seats)]))
+
+
+def add_events(events):
+    """Aggiunge eventi creati senza segnali (``bulk_create``) con i loro posti correnti"""
+    _schedule(_collect((event.date, 1, event.total_seats, event.remaining_seats) for event in events))
+
+
+@transaction.atomic
+def rebuild():
+    """Ricalcola tutte le righe dagli eventi; restituisce il numero di righe.
+
+    Gli incrementi delle transazioni concluse durante il ricalcolo possono
+    essere contati due volte: va eseguito a traffico basso.
+    """
+    rows = Event.objects.with_availability().values_list(
+        'date', 'total_seats', 'current_available_seats'
+    ).iterator(chunk_size=2000)
+    deltas = _collect((date, 1, total, remaining) for date, total, remaining in rows)
+    AvailabilityRollup.objects.all().delete()
+    AvailabilityRollup.objects.bulk_create(
+        (AvailabilityRollup(granularity=granularity, bucket=bucket, **changes)
+         for (granularity, bucket), changes in deltas.items()),
+        batch_size=1000
+    )
+    return len(deltas)
+
+
+def calendar(date_from, date_to, granularity='day'):
+    """Righe con almeno un evento dal giorno (o dall'ora) di `date_from` a `date_to`"""
+    return AvailabilityRollup.objects.filter(
+        granularity=granularity, bucket__gte=buckets(date_from)[granularity],
+        bucket__lte=date_to, events__gt=0,
+    ).order_by('bucket')
+
+
+def _stored(instance, using):
+    """(data, posti totali, posti residui) dell'evento come sono nel database"""
+    return Event.objects.using(using).with_availability().filter(pk=instance.pk).values_list(
+        'date', 'total_seats', 'current_available_seats'
+    ).first()
+
+
+def seats_changed(sender, deltas, **kwargs):
+    changed = {pk: delta for pk, delta in deltas.items() if delta}
+    if not changed:
+        return
+    # Data letta nella transazione della variazione, prima di eventuali spostamenti
+    for pk, date in Event.objects.filter(pk__in=list(changed)).values_list('pk', 'date'):
+        add(date, remaining_seats=changed[pk])
+
+
+def event_saving(sender, instance, raw=False, using=None, update_fields=None, **kwargs):
+    """Ricorda data e capienza salvate: `event_saved` sposta o corregge gli aggregati"""
+    instance._availability_previous = None
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not {'date', 'total_seats'} & set(update_fields):
+        return
+    instance._availability_previous = Event.objects.using(using).filter(
+        pk=instance.pk
+    ).values_list('date', 'total_seats').first()
+
+
+def event_saved(sender, instance, created, raw=False, using=None, **kwargs):
+    if raw:
+        return
+    if created:
+        add(instance.date, 1, instance.total_seats, instance.remaining_seats)
+        return
+    previous, instance._availability_previous = getattr(instance, '_availability_previous', None), None
+    if previous is None:
+        return
+    date, total_seats = previous
+    if date != instance.date:
+        remaining = _stored(instance, using)[2]
+        add(date, -1, -total_seats, -remaining)
+        add(instance.date, 1, instance.total_seats, remaining)
+    elif total_seats != instance.total_seats:
+        # I posti residui arrivano da services.adjust_capacity (seats_changed)
+        add(instance.date, total_seats=instance.total_seats - total_seats)
+
+
+def event_deleting(sender, instance, using=None, **kwargs):
+    # L'istanza da eliminare può essere stata letta prima delle ultime prenotazioni
+    stored = _stored(instance, using)
+    if stored is not None:
+        date, total_seats, remaining = stored
+        add(date, -1, -total_seats, -remaining)
@@ -0,0 +1,168 @@
+"""Utility condivise dai comandi di benchmark e load test"""
+import asyncio
+import itertools
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.db import connections
+from django.utils import timezone
+
+from .models import Event, Reservation
+from .services import allocate_seats, set_shard_count, SeatsUnavailable, AllocationFailed
+
+
+def simulate_db_latency(sender, connection, **kwargs):
+    """Ricevitore di ``connection_created``: ogni query attende
+    ``settings.SIMULATED_DB_LATENCY_MS`` prima di essere eseguita"""
+    from django.conf import settings
+
+    delay = settings.SIMULATED_DB_LATENCY_MS / 1000
+
+    def slow(execute, sql, params, many, context):
+        time.sleep(delay)
+        return execute(sql, params, many, context)
+
+    connection.execute_wrappers.append(slow)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def http_get(port, path):
+    """GET HTTP/1.1 con connessione dedicata; restituisce lo status"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        await reader.read()
+        return status
+    finally:
+        writer.close()
+
+
+def wait_ready(port, server, path, timeout=30):
+    """Attende che il server avviato come processo `server` risponda 200 su `path`"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Il server è terminato all'avvio (codice {server.returncode})")
+        try:
+            if asyncio.run(http_get(port, path)) == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Il server non risponde")
+
+
+def simulate_connect_latency(sender, connection, **kwargs):
+    """Ricevitore di ``connection_created``: l'apertura della connessione costa
+    ``settings.SIMULATED_DB_CONNECT_MS`` (handshake TCP/TLS e autenticazione)"""
+    from django.conf import settings
+
+    time.sleep(settings.SIMULATED_DB_CONNECT_MS / 1000)
+
+
+def rss_bytes():
+    """Memoria residente attuale del processo (Linux), o il picco dove /proc manca"""
+    try:
+        with open('/proc/self/statm') as stream:
+            return int(stream.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, pct):
+    """Percentile con interpolazione lineare (pct in 0-100)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    low = int(k)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+
+def run_concurrently(task, total, concurrency):
+    """Esegue `task(i)` `total` volte su `concurrency` thread.
+
+    Restituisce (risultati, latenze in secondi, durata complessiva).
+    `task` deve gestire da sé le proprie eccezioni; ogni thread chiude la
+    propria connessione al database alla fine.
+    """
+    outcomes = [None] * total
+    counter = itertools.count()
+    barrier = threading.Barrier(concurrency)
+
+    def worker():
+        barrier.wait()
+        try:
+            while True:
+                i = next(counter)
+                if i >= total:
+                    break
+                start = time.perf_counter()
+                result = task(i)
+                outcomes[i] = (result, time.perf_counter() - start)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return [r for r, _ in outcomes], [t for _, t in outcomes], elapsed
+
+
+def summarize(latencies, elapsed):
+    """Statistiche sintetiche di una serie di latenze"""
+    return {
+        'requests': len(latencies),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def create_bench_event(organizer, seats, shards=0, title='Benchmark'):
+    """Crea un evento futuro per i benchmark, opzionalmente in modalità sharded"""
+    event = Event.objects.create(
+        title=title, description='Evento generato dal benchmark',
+        date=timezone.now() + timedelta(days=30), location='Benchmark',
+        total_seats=seats, available_seats=seats, organizer=organizer,
+    )
+    if shards:
+        event = set_shard_count(event, shards)
+    return event
+
+
+def reservation_storm(event, buyer, total, concurrency, per_request=1):
+    """Lancia `total` prenotazioni concorrenti su `event` tramite il servizio di allocazione.
+
+    Restituisce (esiti 'ok'/'rejected'/'failed', latenze, durata).
+    """
+    def reserve(i):
+        try:
+            allocate_seats(event, per_request, commit=lambda: Reservation.objects.create(
+                user=buyer, event=event, seats=per_request, is_confirmed=True
+            ))
+            return 'ok'
+        except SeatsUnavailable:
+            return 'rejected'
+        except AllocationFailed:
+            return 'failed'
+
+    return run_concurrently(reserve, total, concurrency)
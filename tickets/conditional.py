@@ -0,0 +1,75 @@
+"""GET condizionali (ETag / Last-Modified) su lista e dettaglio eventi.
+
+L'ETag deriva da ``Event.version`` (più la somma delle versioni degli shard
+per gli eventi sharded) delle righe restituite. Con ``If-None-Match`` o
+``If-Modified-Since`` la view legge solo id e versioni con una query sulla
+chiave primaria o sull'indice della lista e risponde 304 senza caricare né
+serializzare gli eventi.
+
+Le liste hanno solo l'ETag: il massimo ``updated_at`` della pagina non cambia
+quando un evento viene eliminato o esce dal filtro, mentre l'ETag (che
+contiene gli id) sì. Un ``If-Modified-Since`` da solo non produce mai un 304.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+STAMP_FIELDS = ('id', 'date', 'version', 'updated_at', 'seat_shard_count')
+
+
+def stamp(rows):
+    """(etag, last_modified) di eventi annotati con ``with_version()``"""
+    token = ','.join(f'{row.pk}:{row.version}.{row.shard_version}' for row in rows)
+    etag = '"%s"' % hashlib.md5(token.encode()).hexdigest()
+    last_modified = max((row.last_modified for row in rows), default=None)
+    return etag, int(last_modified.timestamp()) if last_modified else None
+
+
+def is_conditional(request):
+    return 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers
+
+
+def not_modified(request, rows, last_modified=True):
+    """Risposta 304 se la copia del client corrisponde a `rows`, altrimenti None"""
+    etag, modified = stamp(rows)
+    last_modified = modified if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        response['ETag'] = etag
+    return response
+
+
+def set_stamp(response, rows, last_modified=True):
+    etag, modified = stamp(rows)
+    last_modified = modified if last_modified else None
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+class ConditionalGetMixin:
+    """Risponde 304 alle GET condizionali e aggiunge ETag/Last-Modified alle risposte.
+
+    Le view implementano `get_stamp_rows()` (gli eventi della risposta, letti
+    con ``STAMP_FIELDS`` e ``with_version()``; None se non esiste) e chiamano
+    `set_stamp()` sulla risposta completa. Le liste mettono
+    `stamp_last_modified` a False (solo ETag).
+    """
+    stamp_last_modified = True
+
+    def get_stamp_rows(self):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        if is_conditional(request):
+            rows = self.get_stamp_rows()
+            if rows is not None:
+                response = not_modified(request, rows, self.stamp_last_modified)
+                if response is not None:
+                    return response
+        return super().get(request, *args, **kwargs)
+
+    def set_stamp(self, response, rows):
+        return set_stamp(response, rows, self.stamp_last_modified)
@@ -0,0 +1,284 @@
+"""Header ``Idempotency-Key`` sulle POST di prenotazioni e pagamenti.
+
+I client mobili ripetono le POST andate in timeout. Con una chiave di
+idempotenza la prima richiesta viene eseguita e la sua risposta (status,
+header di ``REPLAYED_HEADERS`` e corpo JSON già renderizzato) resta nello
+store per ``TTL`` secondi; le ripetizioni ricevono la risposta salvata senza
+rieseguire validazione e allocazione dei posti. Un duplicato che arriva
+mentre la prima è ancora in corso ne attende l'esito (al massimo
+``WAIT_TIMEOUT`` secondi, poi 409). Riusare la chiave con un corpo diverso
+restituisce 422.
+
+Le chiavi valgono per utente e per endpoint. Gli esiti 5xx e le eccezioni
+non gestite non vengono salvati: la ripetizione riesegue la richiesta. Lo
+store è configurabile tramite ``settings.IDEMPOTENCY['BACKEND']`` (memoria
+di processo o server compatibile Redis).
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import JsonResponse, HttpResponse
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+FINGERPRINT_SIZE = 16
+# Header della risposta salvati e restituiti nelle ripetizioni
+REPLAYED_HEADERS = ('Location', 'Content-Type', 'Retry-After')
+
+
+def _config(key, default=None):
+    return getattr(settings, 'IDEMPOTENCY', {}).get(key, default)
+
+
+class BaseIdempotencyStore:
+    """Interfaccia degli store delle chiavi di idempotenza.
+
+    Un record è (fingerprint, status, body); status None indica una
+    richiesta ancora in corso. `body` contiene header e corpo (vedi `pack`).
+    """
+
+    def acquire(self, key, fingerprint):
+        """Riserva `key` per l'esecuzione: None se riuscito, altrimenti il record esistente"""
+        raise NotImplementedError
+
+    def wait(self, key, timeout):
+        """Attende (al massimo `timeout` secondi) che `key` non sia più in corso"""
+        raise NotImplementedError
+
+    def complete(self, key, fingerprint, status, body):
+        raise NotImplementedError
+
+    def release(self, key):
+        """Libera una chiave in corso senza salvare la risposta"""
+        raise NotImplementedError
+
+
+class InMemoryStore(BaseIdempotencyStore):
+    """Store in memoria di processo: adatto a test e a un singolo worker.
+
+    Le voci sono tuple (scadenza, fingerprint, status, body) in un dizionario
+    ordinato per inserimento; le risposte hanno tutte lo stesso TTL, quindi le
+    scadute si tolgono dalla testa a ogni acquisizione. `max_keys` limita la
+    memoria scartando le voci più vecchie.
+    """
+
+    def __init__(self, ttl=86400, lock_ttl=60, max_keys=100000, **options):
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.max_keys = max_keys
+        self._entries = OrderedDict()
+        self._cond = threading.Condition()
+
+    def _evict(self, now):
+        entries = self._entries
+        while entries:
+            expires = next(iter(entries.values()))[0]
+            if expires > now and len(entries) < self.max_keys:
+                break
+            entries.popitem(last=False)
+
+    def _get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= now:
+            del self._entries[key]
+            return None
+        return entry
+
+    def acquire(self, key, fingerprint):
+        now = time.monotonic()
+        with self._cond:
+            entry = self._get(key, now)
+            if entry is not None:
+                return entry[1:]
+            self._evict(now)
+            self._entries[key] = (now + self.lock_ttl, fingerprint, None, None)
+            return None
+
+    def wait(self, key, timeout):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                entry = self._get(key, now)
+                if entry is None or entry[2] is not None or now >= deadline:
+                    return
+                self._cond.wait(min(deadline, entry[0]) - now)
+
+    def complete(self, key, fingerprint, status, body):
+        with self._cond:
+            self._entries[key] = (time.monotonic() + self.ttl, fingerprint, status, body)
+            self._entries.move_to_end(key)
+            self._cond.notify_all()
+
+    def release(self, key):
+        with self._cond:
+            self._entries.pop(key, None)
+            self._cond.notify_all()
+
+
+class RedisStore(BaseIdempotencyStore):
+    """Store su un server compatibile Redis, condiviso da tutti i worker.
+
+    Il valore è il fingerprint (richiesta in corso, con scadenza `lock_ttl`)
+    seguito, a esecuzione completata, da 2 byte di status e dalla risposta
+    salvata da `pack`.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='idempotency', ttl=86400,
+                 lock_ttl=60, poll_interval=0.05, **options):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured("RedisStore richiede il pacchetto 'redis'")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+
+    def _key(self, key):
+        return f'{self.prefix}:{key}'
+
+    @staticmethod
+    def _decode(value):
+        if len(value) == FINGERPRINT_SIZE:
+            return value, None, None
+        fingerprint, status = value[:FINGERPRINT_SIZE], value[FINGERPRINT_SIZE:FINGERPRINT_SIZE + 2]
+        return fingerprint, int.from_bytes(status, 'big'), value[FINGERPRINT_SIZE + 2:]
+
+    def acquire(self, key, fingerprint):
+        name = self._key(key)
+        while True:
+            if self.client.set(name, fingerprint, nx=True, ex=self.lock_ttl):
+                return None
+            value = self.client.get(name)
+            # None: la chiave è scaduta tra SET e GET, si riprova
+            if value is not None:
+                return self._decode(value)
+
+    def wait(self, key, timeout):
+        deadline = time.monotonic() + timeout
+        name = self._key(key)
+        while time.monotonic() < deadline:
+            value = self.client.get(name)
+            if value is None or len(value) > FINGERPRINT_SIZE:
+                return
+            time.sleep(self.poll_interval)
+
+    def complete(self, key, fingerprint, status, body):
+        self.client.set(self._key(key), fingerprint + status.to_bytes(2, 'big') + body, ex=self.ttl)
+
+    def release(self, key):
+        self.client.delete(self._key(key))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store_class = import_string(_config('BACKEND', 'tickets.idempotency.InMemoryStore'))
+                _store = store_class(
+                    ttl=_config('TTL', 86400), lock_ttl=_config('LOCK_TTL', 60),
+                    **_config('OPTIONS', {})
+                )
+    return _store
+
+
+def fingerprint(request):
+    """Digest del corpo già interpretato: formattazione e ordine delle chiavi non contano"""
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps(data, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(payload, digest_size=FINGERPRINT_SIZE).digest()
+
+
+def pack(response, body):
+    """Header di ``REPLAYED_HEADERS`` (una riga JSON) seguiti dal corpo"""
+    headers = {name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)}
+    # Prima della finalizzazione Content-Type è il default di Django, non quello
+    # del renderer: vale quello esplicito della view, altrimenti JSON come il corpo
+    headers['Content-Type'] = getattr(response, 'content_type', None) or 'application/json'
+    return json.dumps(headers).encode() + b'\n' + body
+
+
+def replay(status, value):
+    headers, newline, body = value.partition(b'\n')
+    if not newline:
+        # Risposta salvata prima che si salvassero gli header
+        headers, body = b'{}', value
+    response = HttpResponse(body, status=status, content_type='application/json')
+    for name, header in json.loads(headers).items():
+        response[name] = header
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+class IdempotentMixin:
+    """POST idempotenti con l'header ``Idempotency-Key``.
+
+    Le view dichiarano `idempotency_scope`; l'autenticazione e i permessi
+    restano quelli della view e vengono eseguiti anche sulle ripetizioni.
+    """
+    idempotency_scope = None
+
+    def post(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return super().post(request, *args, **kwargs)
+        if not 0 < len(key) <= MAX_KEY_LENGTH:
+            raise ValidationError({HEADER: f"La chiave deve avere da 1 a {MAX_KEY_LENGTH} caratteri"})
+
+        store = get_store()
+        scoped = f'{request.user.pk}:{self.idempotency_scope}:{key}'
+        digest = fingerprint(request)
+        deadline = time.monotonic() + _config('WAIT_TIMEOUT', 10)
+        while (record := store.acquire(scoped, digest)) is not None:
+            stored, status, body = record
+            if stored != digest:
+                return JsonResponse(
+                    {"error": "Idempotency-Key già usata per una richiesta diversa"}, status=422
+                )
+            if status is not None:
+                return replay(status, body)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return JsonResponse(
+                    {"error": "Richiesta con la stessa Idempotency-Key ancora in corso, riprova"},
+                    status=409
+                )
+            store.wait(scoped, remaining)
+
+        if getattr(request, 'queue_token_used', False):
+            # Token di coda già speso e nessuna risposta da ripetere: la chiave
+            # non deve diventare un modo per saltare la coda
+            store.release(scoped)
+            return JsonResponse({'detail': "Token di coda già utilizzato"}, status=429)
+
+        response = None
+        try:
+            try:
+                response = super().post(request, *args, **kwargs)
+            except Exception as exc:
+                response = self.handle_exception(exc)
+        finally:
+            if response is None or response.status_code >= 500:
+                store.release(scoped)
+        if response.status_code < 500:
+            data = getattr(response, 'data', None)
+            body = JSONRenderer().render(data) if data is not None else b''
+            store.complete(scoped, digest, response.status_code, pack(response, body))
+        return response
@@ -0,0 +1,285 @@
+"""Strumentazione delle richieste: tempi, query SQL, metriche e profili.
+
+``InstrumentationMiddleware`` misura per ogni richiesta il tempo totale, il
+tempo e il numero delle query SQL (con le istruzioni ripetute, tipiche delle
+N+1), il tempo dei serializer DRF e la dimensione della risposta. I valori
+finiscono:
+
+- con ``SERVER_TIMING`` (spento di default: i tempi e il numero di query
+  arriverebbero a qualunque client), nell'header ``Server-Timing`` della
+  risposta, visibile negli strumenti per sviluppatori del browser;
+- nei contatori per view del processo, esposti in formato Prometheus da
+  ``/metrics`` (ogni worker ha i propri: Prometheus li somma);
+- con l'header ``X-Profile`` di un utente staff, o a campione con
+  ``PROFILE_SAMPLE_RATE``, in un dump cProfile in ``PROFILE_DIR``
+  (leggibile con ``python -m pstats``). Solo sotto WSGI: sotto ASGI il
+  profiler vedrebbe le altre coroutine del loop.
+
+Le query si contano con un execute wrapper installato su ogni connessione
+e i serializer avvolgendo ``BaseSerializer.data``; fuori da una richiesta
+strumentata entrambi costano una lettura di ContextVar.
+"""
+import cProfile
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+
+# Limiti superiori (secondi) degli intervalli dell'istogramma delle durate
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+_current = ContextVar('request_timings', default=None)
+
+
+def _config(key, default=None):
+    return getattr(settings, 'INSTRUMENTATION', {}).get(key, default)
+
+
+def enabled():
+    return _config('ENABLED', True)
+
+
+class RequestTimings:
+    """Misure della richiesta in corso"""
+    __slots__ = ('start', 'db_time', 'queries', 'statements', 'serializer_time', 'serializer_depth')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_time = 0.0
+        self.queries = 0
+        self.statements = set()
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    @property
+    def duplicates(self):
+        """Esecuzioni ripetute della stessa istruzione SQL (parametri a parte)"""
+        return self.queries - len(self.statements)
+
+
+def activate(timings):
+    return _current.set(timings)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper che accumula le query nella richiesta strumentata in corso"""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db_time += time.perf_counter() - start
+        timings.queries += 1
+        timings.statements.add(sql)
+
+
+def connection_created(sender, connection, **kwargs):
+    """Ricevitore di ``connection_created``: installa `record_query`"""
+    # Le connessioni persistenti riaperte mantengono il wrapper già installato
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def instrument_serializers():
+    """Avvolge ``BaseSerializer.data`` per misurare la serializzazione.
+
+    Conta solo il serializer più esterno: quelli annidati o richiamati dentro
+    un altro serializer sono già compresi nel suo tempo.
+    """
+    from rest_framework.serializers import BaseSerializer
+
+    original = BaseSerializer.data.fget
+    if getattr(original, 'instrumented', False):
+        return
+
+    def data(self):
+        timings = _current.get()
+        if timings is None or timings.serializer_depth:
+            return original(self)
+        timings.serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return original(self)
+        finally:
+            timings.serializer_time += time.perf_counter() - start
+            timings.serializer_depth -= 1
+
+    data.instrumented = True
+    BaseSerializer.data = property(data)
+
+
+class ViewMetrics:
+    """Contatori per view del processo, in formato Prometheus"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+
+    def record(self, view, method, status, timings, duration, size):
+        with self._lock:
+            entry = self._views.get(view)
+            if entry is None:
+                entry = self._views[view] = {
+                    'statuses': {}, 'buckets': [0] * len(BUCKETS), 'count': 0, 'duration': 0.0,
+                    'db_time': 0.0, 'queries': 0, 'duplicates': 0, 'serializer_time': 0.0, 'bytes': 0,
+                }
+            key = (method, f'{status // 100}xx')
+            entry['statuses'][key] = entry['statuses'].get(key, 0) + 1
+            for i, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    entry['buckets'][i] += 1
+                    break
+            entry['count'] += 1
+            entry['duration'] += duration
+            entry['db_time'] += timings.db_time
+            entry['queries'] += timings.queries
+            entry['duplicates'] += timings.duplicates
+            entry['serializer_time'] += timings.serializer_time
+            entry['bytes'] += size
+
+    def snapshot(self):
+        with self._lock:
+            return {view: {**entry, 'statuses': dict(entry['statuses']), 'buckets': list(entry['buckets'])}
+                    for view, entry in self._views.items()}
+
+
+view_metrics = ViewMetrics()
+
+# Totali per view: (nome della metrica, campo, descrizione)
+VIEW_TOTALS = (
+    ('tickets_http_db_seconds_total', 'db_time', "Tempo speso nelle query SQL"),
+    ('tickets_http_queries_total', 'queries', "Query SQL eseguite"),
+    ('tickets_http_duplicate_queries_total', 'duplicates', "Esecuzioni ripetute della stessa istruzione SQL"),
+    ('tickets_http_serializer_seconds_total', 'serializer_time', "Tempo speso nei serializer DRF"),
+    ('tickets_http_response_bytes_total', 'bytes', "Byte dei corpi delle risposte"),
+)
+
+
+def _stats_sources():
+    """Contatori dei servizi esposti anche in /metrics: nome -> snapshot()"""
+    from . import payments, replicas, response_cache, services
+    return {
+        'allocation': services.allocation_stats,
+        'holds': services.hold_stats,
+        'payments': payments.payment_stats,
+        'response_cache': response_cache.cache_stats,
+        'replicas': replicas.replica_stats,
+    }
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics():
+    """Testo in formato di esposizione Prometheus 0.0.4"""
+    views = view_metrics.snapshot()
+    lines = [
+        '# HELP tickets_http_requests_total Richieste per view, metodo e classe di status',
+        '# TYPE tickets_http_requests_total counter',
+    ]
+    for view, entry in sorted(views.items()):
+        for (method, status), count in sorted(entry['statuses'].items()):
+            lines.append(f'tickets_http_requests_total{{view="{_label(view)}",method="{method}",'
+                         f'status="{status}"}} {count}')
+
+    lines += ['# HELP tickets_http_request_duration_seconds Durata delle richieste per view',
+              '# TYPE tickets_http_request_duration_seconds histogram']
+    for view, entry in sorted(views.items()):
+        label = _label(view)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, entry['buckets']):
+            cumulative += count
+            lines.append(f'tickets_http_request_duration_seconds_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'tickets_http_request_duration_seconds_bucket{{view="{label}",le="+Inf"}} {entry["count"]}')
+        lines.append(f'tickets_http_request_duration_seconds_sum{{view="{label}"}} {entry["duration"]:.6f}')
+        lines.append(f'tickets_http_request_duration_seconds_count{{view="{label}"}} {entry["count"]}')
+
+    for name, field, description in VIEW_TOTALS:
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+        for view, entry in sorted(views.items()):
+            lines.append(f'{name}{{view="{_label(view)}"}} {entry[field]:g}')
+
+    for source, stats in _stats_sources().items():
+        for field, value in sorted(stats.snapshot().items()):
+            lines.append(f'tickets_{source}_{field} {value:g}')
+    return '\n'.join(lines) + '\n'
+
+
+def is_staff(request):
+    """Autentica la richiesta con le classi di DRF (prima della view) e verifica lo staff"""
+    from rest_framework.exceptions import APIException
+    from rest_framework.request import Request
+    from rest_framework.settings import api_settings
+
+    drf_request = Request(request, authenticators=[cls() for cls in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        return bool(drf_request.user and drf_request.user.is_staff)
+    except APIException:
+        return False
+
+
+def profiler_for(request):
+    """(profiler o None, True se richiesto con l'header e va segnalato nella risposta)"""
+    if request.headers.get(_config('PROFILE_HEADER', 'X-Profile')):
+        if is_staff(request):
+            return cProfile.Profile(), True
+        return None, False
+    rate = _config('PROFILE_SAMPLE_RATE', 0)
+    if rate and random.random() < rate:
+        return cProfile.Profile(), False
+    return None, False
+
+
+def dump_profile(profiler, view):
+    """Salva il profilo in PROFILE_DIR e restituisce il nome del file"""
+    directory = Path(_config('PROFILE_DIR', 'profiles'))
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f'{time.time_ns() // 1000000}-{os.getpid()}-{view.replace("/", "_")}.prof'
+    profiler.dump_stats(directory / name)
+    dumps = sorted(directory.glob('*.prof'), key=lambda path: path.stat().st_mtime)
+    for old in dumps[:-_config('PROFILE_MAX_FILES', 200)]:
+        old.unlink(missing_ok=True)
+    return name
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.route
+
+
+def finish(request, response, timings, profiler=None, announce=False):
+    """Registra le misure della richiesta conclusa e le aggiunge alla risposta"""
+    duration = time.perf_counter() - timings.start
+    view = view_name(request)
+    size = 0 if response.streaming else len(response.content)
+    view_metrics.record(view, request.method, response.status_code, timings, duration, size)
+
+    if _config('SERVER_TIMING', False):
+        response['Server-Timing'] = (
+            f'app;dur={duration * 1000:.1f}, '
+            f'db;dur={timings.db_time * 1000:.1f};desc="{timings.queries} query, '
+            f'{timings.duplicates} ripetute", '
+            f'ser;dur={timings.serializer_time * 1000:.1f}'
+        )
+    if profiler is not None:
+        name = dump_profile(profiler, view)
+        if announce:
+            response['X-Profile-Id'] = name
+    return response
@@ -0,0 +1,290 @@
+"""Traffico realistico per i load test: scenari, replay di log JSONL e report.
+
+Una richiesta è un dizionario, una riga dei log JSONL:
+
+    {"method": "POST", "path": "/api/reservations/", "user": "seed-user-42",
+     "body": {"event": 7, "seats": 1}, "headers": {"Idempotency-Key": "abc"}}
+
+`user` è lo username con cui autenticarsi (assente o null: anonimo), `body`
+il corpo JSON. Gli scenari generano richieste sui dati creati da
+``seed_data``; ``replay`` le esegue in-process con il test client di DRF su
+più thread e misura latenza, status e query SQL di ciascuna. Il report
+raggruppa per endpoint (metodo e nome della rotta) e ha chiavi ordinate;
+revisione e data stanno in ``meta``. Due report di commit diversi si
+confrontano con ``diff`` o con ``compare``.
+"""
+import json
+import subprocess
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.urls import Resolver404, resolve, reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import sales
+from .bench import percentile, run_concurrently
+from .models import Event, Reservation
+
+SEED_PREFIX = 'seed'
+CITIES = ('Roma', 'Milano', 'Napoli', 'Torino', 'Bologna', 'Firenze', 'Verona', 'Bari')
+GENRES = ('Concerto', 'Festival', 'Teatro', 'Opera', 'Jazz', 'Rock', 'Balletto', 'Cabaret')
+WORDS = ('estate', 'notte', 'acustico', 'sinfonica', 'tour', 'live', 'classica', 'elettronica',
+         'tributo', 'anniversario', 'gala', 'piazza', 'arena', 'teatro', 'quartetto', 'orchestra')
+
+
+def seed_usernames(prefix=SEED_PREFIX):
+    return list(get_user_model().objects.filter(
+        username__startswith=f'{prefix}-user-'
+    ).order_by('pk').values_list('username', flat=True))
+
+
+def seed_events(prefix=SEED_PREFIX):
+    return list(Event.objects.filter(
+        organizer__username__startswith=f'{prefix}-user-', date__gte=timezone.now()
+    ).order_by('pk').values_list('pk', flat=True))
+
+
+def _request(method, path, user=None, body=None):
+    entry = {'method': method, 'path': path}
+    if user is not None:
+        entry['user'] = user
+    if body is not None:
+        entry['body'] = body
+    return entry
+
+
+def browse(rng, size, created, prefix=SEED_PREFIX):
+    """Navigazione: prima pagina della lista (anche per città), dettagli, prenotazioni proprie"""
+    users, events = seed_usernames(prefix), seed_events(prefix)
+    requests = []
+    for _ in range(size):
+        roll = rng.random()
+        if roll < 0.3:
+            requests.append(_request('GET', reverse('event-list') + '?page_size=20'))
+        elif roll < 0.4:
+            location = rng.choice(CITIES)
+            requests.append(_request('GET', reverse('event-list') + f'?page_size=20&location={location}'))
+        elif roll < 0.8:
+            requests.append(_request('GET', reverse('event-detail', args=[rng.choice(events)])))
+        else:
+            requests.append(_request('GET', reverse('my-reservations'), user=rng.choice(users)))
+    return requests
+
+
+def search(rng, size, created, prefix=SEED_PREFIX):
+    """Ricerca full-text con una o due parole, seguita a volte dall'apertura di un evento"""
+    events = seed_events(prefix)
+    vocabulary = GENRES + WORDS + CITIES
+    requests = []
+    for _ in range(size):
+        if rng.random() < 0.8:
+            term = ' '.join(rng.sample(vocabulary, rng.choice((1, 1, 2))))
+            requests.append(_request('GET', reverse('event-search') + f'?search={term.replace(" ", "+")}'))
+        else:
+            requests.append(_request('GET', reverse('event-detail', args=[rng.choice(events)])))
+    return requests
+
+
+def onsale(rng, size, created, prefix=SEED_PREFIX):
+    """Apertura delle vendite: un evento con posti per metà delle richieste, prenotazioni
+    da utenti diversi e letture del dettaglio; la seconda metà trova l'evento esaurito"""
+    users = seed_usernames(prefix)
+    event = _scenario_event(users[0], max(1, size // 2), 'Apertura vendite')
+    created.append(event)
+    detail = reverse('event-detail', args=[event.pk])
+    requests = []
+    for _ in range(size):
+        if rng.random() < 0.85:
+            requests.append(_request('POST', reverse('reservation-create'), user=rng.choice(users),
+                                     body={'event': event.pk, 'seats': 1}))
+        else:
+            requests.append(_request('GET', detail))
+    return requests
+
+
+def cancel_storm(rng, size, created, prefix=SEED_PREFIX):
+    """Ondata di cancellazioni (per esempio dopo un cambio di data) con letture della disponibilità"""
+    User = get_user_model()
+    users = list(User.objects.filter(username__in=seed_usernames(prefix)).only('pk', 'username'))
+    # Evento già esaurito: le prenotazioni si creano in blocco senza toccare i posti
+    event = _scenario_event(users[0].username, size, 'Cancellazioni', available=0)
+    created.append(event)
+    owners = [rng.choice(users) for _ in range(size)]
+    with transaction.atomic():
+        reservations = Reservation.objects.bulk_create(
+            Reservation(user=owner, event=event, seats=1, is_confirmed=True) for owner in owners
+        )
+        sales.reserved(reservations)
+    detail = reverse('event-detail', args=[event.pk])
+    requests = []
+    for owner, reservation in zip(owners, reservations):
+        requests.append(_request('DELETE', reverse('reservation-cancel', args=[reservation.pk]),
+                                 user=owner.username))
+        if rng.random() < 0.2:
+            requests.append(_request('GET', detail))
+    return requests
+
+
+SCENARIOS = {
+    'browse': browse,
+    'search': search,
+    'onsale': onsale,
+    'cancel-storm': cancel_storm,
+}
+
+
+def _scenario_event(organizer_username, seats, title, available=None):
+    organizer = get_user_model().objects.get(username=organizer_username)
+    return Event.objects.create(
+        title=title, description='Evento generato dal load test', location=CITIES[0],
+        date=timezone.now() + timedelta(days=60), total_seats=seats,
+        available_seats=seats if available is None else available,
+        organizer=organizer,
+    )
+
+
+def read_log(lines):
+    """Richieste da un log JSONL (righe vuote e commenti # ignorati)"""
+    requests = []
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError as exc:
+            raise ValueError(f"Riga {number}: JSON non valido ({exc})")
+        if not isinstance(entry, dict) or 'method' not in entry or 'path' not in entry:
+            raise ValueError(f"Riga {number}: servono almeno 'method' e 'path'")
+        requests.append(entry)
+    return requests
+
+
+def write_log(requests, stream):
+    for entry in requests:
+        stream.write(json.dumps(entry, sort_keys=True) + '\n')
+
+
+def endpoint(entry):
+    """Chiave del report: metodo e nome della rotta (gli id nel path non contano)"""
+    path = urlsplit(entry['path']).path
+    try:
+        name = resolve(path).url_name or path
+    except Resolver404:
+        name = path
+    return f"{entry['method'].upper()} {name}"
+
+
+class QueryCounter:
+    """Conta le query eseguite dal thread corrente su tutti gli alias"""
+
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def counting(self):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+
+def replay(requests, concurrency):
+    """Esegue le richieste su `concurrency` thread: (endpoint, status, query) e latenze"""
+    usernames = {entry['user'] for entry in requests if entry.get('user')}
+    users = {user.username: user for user in get_user_model().objects.filter(username__in=usernames)}
+    missing = usernames - users.keys()
+    if missing:
+        raise ValueError(f"Utenti non trovati: {', '.join(sorted(missing)[:5])}")
+
+    def task(i):
+        entry = requests[i]
+        client = APIClient(raise_request_exception=False)
+        if entry.get('user'):
+            client.force_authenticate(users[entry['user']])
+        headers = {f"HTTP_{name.upper().replace('-', '_')}": value
+                   for name, value in (entry.get('headers') or {}).items()}
+        body = entry.get('body')
+        counter = QueryCounter()
+        try:
+            with counter.counting():
+                response = client.generic(
+                    entry['method'].upper(), entry['path'],
+                    json.dumps(body) if body is not None else '', content_type='application/json',
+                    **headers
+                )
+            status = response.status_code
+        except Exception:
+            status = None
+        return endpoint(entry), status, counter.queries
+
+    return run_concurrently(task, len(requests), concurrency)
+
+
+def _stats(latencies, queries, statuses, elapsed):
+    return {
+        'requests': len(latencies),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'queries_mean': round(sum(queries) / len(queries), 2) if queries else 0.0,
+        'queries_max': max(queries, default=0),
+        'statuses': dict(sorted(Counter(str(status) for status in statuses).items())),
+        'errors': sum(1 for status in statuses if status is None or status >= 500),
+    }
+
+
+def build_report(results, latencies, elapsed):
+    """Statistiche complessive e per endpoint di un'esecuzione di `replay`"""
+    groups = defaultdict(lambda: ([], [], []))
+    for (name, status, queries), latency in zip(results, latencies):
+        group = groups[name]
+        group[0].append(latency)
+        group[1].append(queries)
+        group[2].append(status)
+    report = _stats(latencies, [r[2] for r in results], [r[1] for r in results], elapsed)
+    report['elapsed_s'] = round(elapsed, 3)
+    report['endpoints'] = {name: _stats(*groups[name], elapsed) for name in sorted(groups)}
+    return report
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+COMPARED = (('p95_ms', 'p95'), ('throughput_rps', 'req/s'), ('queries_mean', 'query'))
+
+
+def compare(report, baseline):
+    """Righe di testo con le variazioni per scenario ed endpoint rispetto a `baseline`"""
+    lines = []
+    for scenario, current in sorted(report['scenarios'].items()):
+        previous = baseline.get('scenarios', {}).get(scenario)
+        if previous is None:
+            lines.append(f"{scenario}: assente nel riferimento")
+            continue
+        for name in sorted(current['endpoints'].keys() | previous['endpoints'].keys()):
+            now, before = current['endpoints'].get(name), previous['endpoints'].get(name)
+            if now is None or before is None:
+                lines.append(f"{scenario} {name}: {'rimosso' if now is None else 'nuovo'}")
+                continue
+            changes = []
+            for key, label in COMPARED:
+                delta = now[key] - before[key]
+                percent = f" ({delta / before[key]:+.0%})" if before[key] else ''
+                changes.append(f"{label} {before[key]} -> {now[key]}{percent}")
+            lines.append(f"{scenario} {name}: {', '.join(changes)}")
+    return lines
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tickets import admission
+
+
+class Command(BaseCommand):
+    help = ("Apre, chiude o mostra la coda di ammissione di un evento "
+            "(con InMemoryBackend usare invece PUT/DELETE su /api/events/<id>/queue/)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['open', 'close', 'status'])
+        parser.add_argument('event_id', type=int)
+        parser.add_argument('--rate', type=float, default=10,
+                            help="Ammissioni al secondo (solo per 'open')")
+
+    def handle(self, *args, **options):
+        backend = admission.get_backend()
+        event_id = options['event_id']
+        if options['action'] == 'open':
+            if options['rate'] <= 0:
+                raise CommandError("La tariffa di ammissione deve essere positiva")
+            backend.open(event_id, options['rate'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Coda aperta per l'evento {event_id}: {options['rate']} ammissioni/s"
+            ))
+        elif options['action'] == 'close':
+            backend.close(event_id)
+            self.stdout.write(self.style.SUCCESS(f"Coda chiusa per l'evento {event_id}"))
+        else:
+            state = backend.state(event_id)
+            if state is None:
+                self.stdout.write(f"Nessuna coda attiva per l'evento {event_id}")
+            else:
+                rate, tail, head = state
+                self.stdout.write(
+                    f"Evento {event_id}: {rate} ammissioni/s, {tail} in coda, {int(head)} ammessi"
+                )
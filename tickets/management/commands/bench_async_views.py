@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from tickets.bench import create_bench_event, free_port, http_get, summarize, wait_ready
+
+# (nome, comando, variabili d'ambiente) dei server da confrontare
+SERVERS = (
+    ('gunicorn-sync', ['gunicorn', 'django_project.wsgi:application', '--workers', '{workers}',
+                       '--bind', '127.0.0.1:{port}'], {}),
+    ('uvicorn-drf', ['uvicorn', 'django_project.asgi:application', '--workers', '{workers}',
+                     '--port', '{port}', '--log-level', 'warning'], {'ASYNC_READ_VIEWS': '0'}),
+    ('uvicorn-async', ['uvicorn', 'django_project.asgi:application', '--workers', '{workers}',
+                       '--port', '{port}', '--log-level', 'warning'], {'ASYNC_READ_VIEWS': '1'}),
+)
+
+
+async def _timed_get(port, path, timeout):
+    return await asyncio.wait_for(http_get(port, path), timeout)
+
+
+class Command(BaseCommand):
+    help = ("Confronta gunicorn con worker sincroni e uvicorn (view DRF e view "
+            "asincrone) sulle GET degli eventi, ad alta concorrenza e con una "
+            "latenza artificiale su ogni query SQL (SIMULATED_DB_LATENCY_MS).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=600)
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument('--timeout', type=float, default=30,
+                            help="Secondi oltre i quali una richiesta conta come errore")
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--db-latency-ms', type=int, default=50)
+        parser.add_argument('--servers', default=','.join(name for name, _, _ in SERVERS))
+
+    def handle(self, *args, **options):
+        selected = options['servers'].split(',')
+        for name, command, _ in SERVERS:
+            if name in selected and shutil.which(command[0]) is None:
+                raise CommandError(f"{command[0]} non è installato (richiesto da {name})")
+
+        User = get_user_model()
+        organizer, _ = User.objects.get_or_create(
+            username='bench-async', defaults={'email': 'bench-async@example.com'}
+        )
+        events = [create_bench_event(organizer, 100, title=f'Concerto async {i}') for i in range(30)]
+        paths = ['/api/events/?page_size=20', f'/api/events/{events[0].pk}/',
+                 '/api/events/search/?search=concerto']
+        rows = []
+        try:
+            for name, command, env in SERVERS:
+                if name not in selected:
+                    continue
+                report = self._run_server(name, command, env, paths, options)
+                rows.append(report)
+                self.stderr.write(
+                    f"{name:>14}: {report['throughput_rps']} req/s, p50 {report['p50_ms']} ms, "
+                    f"p99 {report['p99_ms']} ms, errori {report['errors']}"
+                )
+        finally:
+            for event in events:
+                event.delete()
+        self.stdout.write(json.dumps(rows, indent=2))
+
+    def _run_server(self, name, command, env, paths, options):
+        port = free_port()
+        args = [part.format(port=port, workers=options['workers']) for part in command]
+        environment = {
+            **os.environ, **env,
+            'SIMULATED_DB_LATENCY_MS': str(options['db_latency_ms']),
+            # Si misura il percorso completo, non la cache delle risposte
+            'RESPONSE_CACHE_ENABLED': '0',
+            'PYTHONPATH': os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')])),
+        }
+        server = subprocess.Popen(args, env=environment, stdout=subprocess.DEVNULL, stderr=sys.stderr)
+        try:
+            try:
+                wait_ready(port, server, '/api/events/?page_size=1')
+            except RuntimeError as exc:
+                raise CommandError(str(exc))
+            statuses, latencies, elapsed = asyncio.run(
+                self._load(port, paths, options['requests'], options['concurrency'], options['timeout'])
+            )
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+        report = {'server': name, 'workers': options['workers'],
+                  'concurrency': options['concurrency'], 'db_latency_ms': options['db_latency_ms']}
+        report.update(summarize(latencies, elapsed))
+        report['errors'] = sum(1 for status in statuses if status != 200)
+        return report
+
+    @staticmethod
+    async def _load(port, paths, total, concurrency, timeout):
+        statuses, latencies = [], []
+        counter = iter(range(total))
+
+        async def client():
+            for i in counter:
+                start = time.perf_counter()
+                try:
+                    statuses.append(await _timed_get(port, paths[i % len(paths)], timeout))
+                except (OSError, ValueError, IndexError, asyncio.TimeoutError):
+                    statuses.append(None)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return statuses, latencies, time.perf_counter() - start
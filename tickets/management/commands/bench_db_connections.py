@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from tickets.bench import create_bench_event, free_port, http_get, summarize, wait_ready
+
+# (nome, variabili d'ambiente) delle configurazioni da confrontare
+CONFIGS = (
+    ('per-request', {'DB_CONN_MAX_AGE': '0'}),
+    ('persistent', {'DB_CONN_MAX_AGE': '60'}),
+    ('pool', {'DB_POOL': '1'}),
+)
+
+
+class Command(BaseCommand):
+    help = ("Richieste al secondo sulla lista eventi servita da gunicorn con una "
+            "connessione al database per richiesta, con connessioni persistenti e "
+            "con il pool di psycopg 3 (solo PostgreSQL). Con SQLite o un PostgreSQL "
+            "locale il costo dell'handshake si simula con --connect-ms.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'),
+                            help="Database dei server (default: DATABASE_URL), già migrato")
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--connect-ms', type=int, default=20,
+                            help="Costo simulato dell'apertura di una connessione (0 con un database remoto)")
+        parser.add_argument('--configs', default=','.join(name for name, _ in CONFIGS))
+
+    def handle(self, *args, **options):
+        if not options['database_url']:
+            raise CommandError("Indica il database con --database-url o DATABASE_URL")
+        if shutil.which('gunicorn') is None:
+            raise CommandError("gunicorn non è installato")
+
+        User = get_user_model()
+        organizer, _ = User.objects.get_or_create(
+            username='bench-db', defaults={'email': 'bench-db@example.com'}
+        )
+        events = [create_bench_event(organizer, 50, title=f'Concerto db {i}') for i in range(20)]
+        selected = options['configs'].split(',')
+        rows = []
+        try:
+            for name, env in CONFIGS:
+                if name not in selected:
+                    continue
+                if name == 'pool' and not options['database_url'].startswith(('postgres', 'postgis')):
+                    self.stderr.write(f"{name:>12}: saltato, il pool richiede PostgreSQL")
+                    continue
+                report = self._run_server(name, env, options)
+                rows.append(report)
+                self.stderr.write(
+                    f"{name:>12}: {report['throughput_rps']} req/s, p50 {report['p50_ms']} ms, "
+                    f"p99 {report['p99_ms']} ms, errori {report['errors']}"
+                )
+        finally:
+            for event in events:
+                event.delete()
+        self.stdout.write(json.dumps(rows, indent=2))
+
+    def _run_server(self, name, env, options):
+        port = free_port()
+        environment = {
+            **os.environ, **env,
+            'DATABASE_URL': options['database_url'],
+            'SIMULATED_DB_CONNECT_MS': str(options['connect_ms']),
+            # Si misura il percorso sincrono completo, non la cache delle risposte
+            'ASYNC_READ_VIEWS': '0',
+            'RESPONSE_CACHE_ENABLED': '0',
+            'PYTHONPATH': os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')])),
+        }
+        server = subprocess.Popen(
+            ['gunicorn', 'django_project.wsgi:application', '--workers', str(options['workers']),
+             '--bind', f'127.0.0.1:{port}'],
+            env=environment, stdout=subprocess.DEVNULL, stderr=sys.stderr
+        )
+        try:
+            try:
+                wait_ready(port, server, '/api/events/?page_size=1')
+            except RuntimeError as exc:
+                raise CommandError(f"{name}: {exc}")
+            statuses, latencies, elapsed = asyncio.run(
+                self._load(port, options['requests'], options['concurrency'])
+            )
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+        report = {'config': name, 'workers': options['workers'],
+                  'concurrency': options['concurrency'], 'connect_ms': options['connect_ms']}
+        report.update(summarize(latencies, elapsed))
+        report['errors'] = sum(1 for status in statuses if status != 200)
+        return report
+
+    @staticmethod
+    async def _load(port, total, concurrency):
+        statuses, latencies = [], []
+        counter = iter(range(total))
+
+        async def client():
+            for _ in counter:
+                start = time.perf_counter()
+                try:
+                    statuses.append(await http_get(port, '/api/events/?page_size=20'))
+                except (OSError, ValueError, IndexError):
+                    statuses.append(None)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return statuses, latencies, time.perf_counter() - start
@@ -0,0 +1,84 @@
+import json
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from tickets.bench import create_bench_event, rss_bytes
+from tickets.models import Reservation
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Memoria dell'export in streaming delle prenotazioni: per ogni dimensione "
+            "scarica l'export CSV e NDJSON e misura righe/s e la crescita della memoria "
+            "residente (RSS) durante lo scaricamento, che deve restare costante. "
+            "I dati vengono generati in una transazione annullata alla fine.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100000,1000000,5000000')
+        parser.add_argument('--outputs', default='csv,ndjson')
+        parser.add_argument('--chunk', type=int, default=10000, help="Righe per bulk_create")
+
+    def handle(self, *args, **options):
+        rows = []
+        try:
+            with transaction.atomic():
+                User = get_user_model()
+                staff = User.objects.create_user('bench-exports', 'bench-exports@example.com', is_staff=True)
+                event = create_bench_event(staff, 10, title='Benchmark export')
+                client = APIClient()
+                client.force_authenticate(staff)
+                seeded = 0
+                for size in sorted(int(s) for s in options['sizes'].split(',')):
+                    self._seed(staff, event, seeded, size, options['chunk'])
+                    seeded = size
+                    for output in options['outputs'].split(','):
+                        rows.append(self._measure(client, event, size, output))
+                        self.stderr.write(json.dumps(rows[-1]))
+                raise _Rollback
+        except _Rollback:
+            pass
+        self.stdout.write(json.dumps(rows, indent=2))
+
+    def _seed(self, user, event, start, end, chunk):
+        created_at = timezone.now() - timedelta(days=1)
+        for offset in range(start, end, chunk):
+            Reservation.objects.bulk_create(
+                Reservation(user=user, event=event, seats=1, is_confirmed=True, created_at=created_at)
+                for _ in range(offset, min(offset + chunk, end))
+            )
+            self.stderr.write(f"  generate {min(offset + chunk, end)}/{end} prenotazioni", ending='\r')
+        self.stderr.write('')
+
+    def _measure(self, client, event, size, output):
+        url = reverse('reservation-export') + f'?event={event.pk}&output={output}'
+        baseline = peak = rss_bytes()
+        lines = size_bytes = 0
+        start = time.perf_counter()
+        response = client.get(url)
+        for i, chunk in enumerate(response.streaming_content):
+            lines += chunk.count(b'\n')
+            size_bytes += len(chunk)
+            if i % 50 == 0:
+                peak = max(peak, rss_bytes())
+        elapsed = time.perf_counter() - start
+        peak = max(peak, rss_bytes())
+        return {
+            'rows': size,
+            'output': output,
+            'lines': lines,
+            'mb': round(size_bytes / 2 ** 20, 1),
+            'elapsed_s': round(elapsed, 2),
+            'rows_per_s': round(size / elapsed) if elapsed else 0,
+            'rss_baseline_mb': round(baseline / 2 ** 20, 1),
+            'rss_growth_mb': round((peak - baseline) / 2 ** 20, 1),
+        }
@@ -0,0 +1,60 @@
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from tickets.bench import create_bench_event, percentile
+
+
+class Command(BaseCommand):
+    help = ("Costo di InstrumentationMiddleware: alterna blocchi di richieste con la "
+            "strumentazione attiva e spenta (stesso processo, stessi dati) e confronta "
+            "i tempi mediani per richiesta")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=10)
+        parser.add_argument('--requests', type=int, default=50, help="Richieste per blocco")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        organizer, _ = User.objects.get_or_create(
+            username='bench-instrumentation', defaults={'email': 'bench-instrumentation@example.com'}
+        )
+        events = [create_bench_event(organizer, 100, title=f'Concerto strumentato {i}') for i in range(20)]
+        paths = ['/api/events/?page_size=20', f'/api/events/{events[0].pk}/',
+                 '/api/events/search/?search=strumentato']
+        client = APIClient()
+        timings = {True: [], False: []}
+        try:
+            # Si misura il percorso completo, non la cache delle risposte
+            with override_settings(RESPONSE_CACHE={**settings.RESPONSE_CACHE, 'ENABLED': False}):
+                self._block(client, paths, options['requests'], True)  # riscaldamento
+                for _ in range(options['rounds']):
+                    for enabled in (False, True):
+                        timings[enabled].extend(self._block(client, paths, options['requests'], enabled))
+        finally:
+            for event in events:
+                event.delete()
+
+        off, on = percentile(timings[False], 50), percentile(timings[True], 50)
+        report = {
+            'requests': len(timings[True]),
+            'p50_off_ms': round(off * 1000, 3),
+            'p50_on_ms': round(on * 1000, 3),
+            'overhead_pct': round((on - off) / off * 100, 2) if off else 0.0,
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+
+    @staticmethod
+    def _block(client, paths, total, enabled):
+        latencies = []
+        with override_settings(INSTRUMENTATION={**settings.INSTRUMENTATION, 'ENABLED': enabled}):
+            for i in range(total):
+                start = time.perf_counter()
+                client.get(paths[i % len(paths)])
+                latencies.append(time.perf_counter() - start)
+        return latencies
@@ -0,0 +1,100 @@
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from tickets.bench import percentile
+from tickets.models import Event
+from tickets.pagination import EventKeysetPagination
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Misura la latenza di una pagina di /api/events/ a diverse profondità, "
+            "con paginazione keyset e, per confronto, con LIMIT/OFFSET. "
+            "I dati vengono generati in una transazione annullata alla fine.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000')
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--samples', type=int, default=20)
+        parser.add_argument('--chunk', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rows = []
+        try:
+            # Si misura il percorso senza cache delle risposte
+            with override_settings(RESPONSE_CACHE={**settings.RESPONSE_CACHE, 'ENABLED': False}), \
+                    transaction.atomic():
+                organizer = get_user_model().objects.create_user(
+                    'bench-pagination', 'bench-pagination@example.com'
+                )
+                seeded = 0
+                for size in sorted(int(s) for s in options['sizes'].split(',')):
+                    self._seed(organizer, seeded, size, options['chunk'])
+                    seeded = size
+                    rows.extend(self._measure(size, options['page_size'], options['samples']))
+                raise _Rollback
+        except _Rollback:
+            pass
+        self.stdout.write(json.dumps(rows, indent=2))
+
+    def _seed(self, organizer, start, end, chunk):
+        base = timezone.now() + timedelta(days=1)
+        for offset in range(start, end, chunk):
+            Event.objects.bulk_create(
+                Event(title=f'Evento {i}', description='Benchmark paginazione',
+                      date=base + timedelta(minutes=i % 500000), location='Benchmark',
+                      total_seats=100, available_seats=100, organizer=organizer)
+                for i in range(offset, min(offset + chunk, end))
+            )
+            self.stderr.write(f"  generati {min(offset + chunk, end)}/{end} eventi", ending='\r')
+        self.stderr.write('')
+
+    def _measure(self, size, page_size, samples):
+        client = APIClient()
+        url = reverse('event-list')
+        paginator = EventKeysetPagination()
+        upcoming = Event.objects.filter(date__gte=timezone.now()).order_by('date', 'id')
+        results = []
+        for depth in (0, size // 2, size - page_size - 1):
+            cursor = None
+            if depth:
+                row = upcoming.values_list('date', 'id')[depth]
+                cursor = paginator.encode_cursor(list(row), reverse=False)
+            params = {'page_size': page_size, **({'cursor': cursor} if cursor else {})}
+
+            keyset = []
+            for _ in range(samples):
+                start = time.perf_counter()
+                client.get(url, params)
+                keyset.append(time.perf_counter() - start)
+
+            offset = []
+            for _ in range(samples):
+                start = time.perf_counter()
+                list(upcoming.select_related('organizer')[depth:depth + page_size])
+                offset.append(time.perf_counter() - start)
+
+            results.append({
+                'events': size, 'depth': depth,
+                'keyset_p50_ms': round(percentile(keyset, 50) * 1000, 2),
+                'keyset_p95_ms': round(percentile(keyset, 95) * 1000, 2),
+                'offset_query_p50_ms': round(percentile(offset, 50) * 1000, 2),
+            })
+            self.stderr.write(
+                f"{size:>8} eventi, profondità {depth:>8}: keyset {results[-1]['keyset_p50_ms']} ms, "
+                f"offset (solo query) {results[-1]['offset_query_p50_ms']} ms"
+            )
+        return results
@@ -0,0 +1,104 @@
+import json
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from tickets.bench import create_bench_event, percentile
+from tickets.models import Payment, Reservation
+from tickets.payments import CircuitBreaker, FakeGateway, PaymentWorkerPool, payment_stats
+
+
+class Command(BaseCommand):
+    help = ("Throughput della pipeline dei pagamenti: accoda N pagamenti tramite l'API "
+            "(latenza della risposta 202) e misura lo svuotamento della coda con un "
+            "numero crescente di worker contro il FakeGateway")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=200)
+        parser.add_argument('--workers', default='1,4,16',
+                            help="Numeri di worker da confrontare, separati da virgola")
+        parser.add_argument('--latency-ms', type=int, default=200)
+        parser.add_argument('--jitter-ms', type=int, default=50)
+        parser.add_argument('--failure-rate', type=float, default=0.05)
+        parser.add_argument('--decline-rate', type=float, default=0.02)
+        parser.add_argument('--timeout', type=float, default=1,
+                            help="Timeout della chiamata al gateway (secondi)")
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        buyer, _ = User.objects.get_or_create(
+            username='bench-payments', defaults={'email': 'bench-payments@example.com'}
+        )
+        client = APIClient()
+        client.force_authenticate(buyer)
+
+        # Retry ravvicinati: la misura riguarda la pipeline, non le attese di backoff.
+        # I worker in-process restano spenti, la coda la svuota solo il pool misurato
+        with override_settings(PAYMENTS={
+            'TIMEOUT': options['timeout'], 'MAX_ATTEMPTS': 5, 'BACKOFF_BASE': 0.05,
+            'BACKOFF_MAX': 0.5, 'LEASE': 30, 'POLL_INTERVAL': 0.05, 'WORKERS_IN_PROCESS': False,
+        }):
+            rows = [self._run(client, buyer, int(workers), options)
+                    for workers in options['workers'].split(',')]
+        self.stdout.write(json.dumps(rows, indent=2))
+
+    def _run(self, client, buyer, workers, options):
+        total = options['payments']
+        event = create_bench_event(buyer, total, title='Benchmark pagamenti')
+        try:
+            expires = timezone.now() + timedelta(hours=1)
+            Reservation.objects.bulk_create(
+                Reservation(user=buyer, event=event, seats=1, expires_at=expires) for _ in range(total)
+            )
+            reservations = list(Reservation.objects.filter(event=event).values_list('pk', flat=True))
+
+            payment_stats.reset()
+            request_latencies = []
+            for pk in reservations:
+                start = time.perf_counter()
+                response = client.post('/api/payments/', {'reservation': pk}, format='json')
+                request_latencies.append(time.perf_counter() - start)
+                assert response.status_code == 202, response.content
+
+            gateway = FakeGateway(options['latency_ms'], options['jitter_ms'],
+                                  options['failure_rate'], options['decline_rate'], seed=options['seed'])
+            pool = PaymentWorkerPool(workers, batch_size=1, poll_interval=0.05,
+                                     gateway=gateway, breaker=CircuitBreaker(threshold=20, reset_timeout=1))
+            payments = Payment.objects.filter(reservation__event=event)
+            start = time.perf_counter()
+            pool.start()
+            try:
+                while payments.filter(status='pending').exists():
+                    time.sleep(0.05)
+                elapsed = time.perf_counter() - start
+            finally:
+                pool.stop()
+
+            # Dalla risposta 202 all'esito definitivo
+            settle = [(p.updated_at - p.payment_date).total_seconds()
+                      for p in payments.only('payment_date', 'updated_at')]
+            report = {
+                'workers': workers,
+                'payments': total,
+                'gateway_latency_ms': options['latency_ms'],
+                'drain_s': round(elapsed, 3),
+                'throughput_pps': round(total / elapsed, 1),
+                'enqueue_p50_ms': round(percentile(request_latencies, 50) * 1000, 2),
+                'enqueue_p99_ms': round(percentile(request_latencies, 99) * 1000, 2),
+                'settle_p50_ms': round(percentile(settle, 50) * 1000, 2),
+                'settle_p99_ms': round(percentile(settle, 99) * 1000, 2),
+                'status': dict(payments.values_list('status').annotate(n=Count('pk'))),
+                'stats': payment_stats.snapshot(),
+            }
+            self.stderr.write(f"{workers:>3} worker: {report['throughput_pps']} pagamenti/s, "
+                              f"coda svuotata in {report['drain_s']} s")
+            return report
+        finally:
+            event.delete()
@@ -0,0 +1,101 @@
+import json
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from tickets import search
+from tickets.bench import percentile
+from tickets.models import Event
+from tickets.pagination import EventSearchPagination
+
+WORDS = ('concerto', 'teatro', 'festival', 'jazz', 'rock', 'opera', 'mostra', 'danza',
+         'cinema', 'stand', 'comedy', 'sinfonia', 'piano', 'notte', 'estate', 'live')
+CITIES = ('Roma', 'Milano', 'Napoli', 'Torino', 'Bologna', 'Firenze', 'Bari', 'Verona')
+QUERIES = ('concerto', 'jazz roma', 'fest', 'opera milano', 'sinfonia piano', 'teat')
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Confronta la ricerca eventi con icontains (com'era prima) e il backend "
+            "full-text su un catalogo generato in una transazione annullata alla fine.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=500000)
+        parser.add_argument('--samples', type=int, default=10)
+        parser.add_argument('--chunk', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rows = []
+        try:
+            with transaction.atomic():
+                self._seed(options['events'], options['chunk'])
+                if connection.vendor == 'postgresql':
+                    with connection.cursor() as cursor:
+                        cursor.execute('ANALYZE tickets_event')
+                rows = self._measure(options['samples'])
+                raise _Rollback
+        except _Rollback:
+            pass
+        self.stdout.write(json.dumps(rows, indent=2))
+
+    def _seed(self, size, chunk):
+        organizer = get_user_model().objects.create_user('bench-search', 'bench-search@example.com')
+        base = timezone.now() + timedelta(days=1)
+        rng = random.Random(42)
+        for offset in range(0, size, chunk):
+            Event.objects.bulk_create(
+                Event(title=' '.join(rng.sample(WORDS, 2)).capitalize(),
+                      description=' '.join(rng.choices(WORDS, k=12)),
+                      location=rng.choice(CITIES), date=base + timedelta(minutes=i),
+                      total_seats=100, available_seats=100, organizer=organizer)
+                for i in range(offset, min(offset + chunk, size))
+            )
+            self.stderr.write(f"  generati {min(offset + chunk, size)}/{size} eventi", ending='\r')
+        self.stderr.write('')
+
+    def _icontains(self, queryset, term):
+        condition = Q()
+        for word in search.tokenize(term):
+            condition &= Q(title__icontains=word) | Q(description__icontains=word) | Q(location__icontains=word)
+        return list(queryset.filter(condition).order_by('date', 'id')[:EventSearchPagination.page_size])
+
+    def _measure(self, samples):
+        now = timezone.now()
+        queryset = Event.objects.with_availability().filter(date__gte=now).select_related('organizer')
+        backend = search.get_backend()
+        # Caricamento dell'indice in memoria escluso dalle misure
+        backend.search(queryset, 'warmup', since=now)
+        results = []
+        for term in QUERIES:
+            baseline, fulltext = [], []
+            for _ in range(samples):
+                start = time.perf_counter()
+                self._icontains(queryset, term)
+                baseline.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                backend.search(queryset, term, since=now).page(
+                    None, False, EventSearchPagination.page_size + 1
+                )
+                fulltext.append(time.perf_counter() - start)
+            results.append({
+                'query': term, 'backend': type(backend).__name__,
+                'icontains_p50_ms': round(percentile(baseline, 50) * 1000, 2),
+                'icontains_p95_ms': round(percentile(baseline, 95) * 1000, 2),
+                'fulltext_p50_ms': round(percentile(fulltext, 50) * 1000, 2),
+                'fulltext_p95_ms': round(percentile(fulltext, 95) * 1000, 2),
+            })
+            self.stderr.write(
+                f"{term!r:>18}: icontains {results[-1]['icontains_p50_ms']} ms, "
+                f"full-text {results[-1]['fulltext_p50_ms']} ms"
+            )
+        return results
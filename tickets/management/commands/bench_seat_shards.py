@@ -0,0 +1,43 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from tickets.bench import create_bench_event, reservation_storm, summarize
+
+
+class Command(BaseCommand):
+    help = "Confronta il throughput delle prenotazioni con contatore unico e con inventario sharded"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', default='50,200,1000',
+                            help="Livelli di concorrenza separati da virgola")
+        parser.add_argument('--requests', type=int, default=2000,
+                            help="Prenotazioni per ogni livello")
+        parser.add_argument('--shards', type=int, default=16)
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        buyer, _ = User.objects.get_or_create(
+            username='loadtest', defaults={'email': 'loadtest@example.com'}
+        )
+        total = options['requests']
+        rows = []
+        for buyers in [int(b) for b in options['buyers'].split(',')]:
+            for shards in (0, options['shards']):
+                # Capienza pari alle richieste: si misura la contesa, non i rifiuti
+                event = create_bench_event(buyer, total, shards)
+                try:
+                    results, latencies, elapsed = reservation_storm(event, buyer, total, buyers)
+                finally:
+                    event.delete()
+                row = {'buyers': buyers, 'mode': 'sharded' if shards else 'single-row',
+                       'shards': shards, 'accepted': results.count('ok'),
+                       'failed': results.count('failed')}
+                row.update(summarize(latencies, elapsed))
+                rows.append(row)
+                self.stderr.write(
+                    f"{buyers:>5} buyers {row['mode']:>10}: {row['throughput_rps']} req/s, "
+                    f"p99 {row['p99_ms']} ms"
+                )
+        self.stdout.write(json.dumps(rows, indent=2))
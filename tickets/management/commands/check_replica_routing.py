@@ -0,0 +1,132 @@
+import sqlite3
+from contextlib import ExitStack
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from tickets import replicas
+from tickets.models import Event
+
+
+def lagging_replica(alias):
+    """LAG_FUNCTION che dichiara ogni replica in ritardo"""
+    return 3600.0
+
+
+class Command(BaseCommand):
+    help = ("Verifica l'instradamento delle letture con repliche SQLite di prova: "
+            "DATABASE_URL=sqlite:///primary.sqlite3 "
+            "DATABASE_REPLICA_URLS=sqlite:///replica1.sqlite3,sqlite:///replica2.sqlite3. "
+            "Copia il primario sulle repliche, scrive solo sul primario (le repliche "
+            "restano indietro) e controlla letture sulle repliche, vincolo al primario "
+            "dopo una scrittura e ripiego sul primario con repliche in ritardo.")
+
+    def handle(self, *args, **options):
+        aliases = replicas.replica_aliases()
+        if not aliases:
+            raise CommandError("Nessuna replica configurata (DATABASE_REPLICA_URLS)")
+        if any(connections[alias].vendor != 'sqlite' for alias in [DEFAULT_DB_ALIAS, *aliases]):
+            raise CommandError("Il controllo usa copie di file SQLite come repliche")
+
+        User = get_user_model()
+        buyer, _ = User.objects.get_or_create(
+            username='replica-buyer', defaults={'email': 'replica-buyer@example.com'}
+        )
+        other, _ = User.objects.get_or_create(
+            username='replica-other', defaults={'email': 'replica-other@example.com'}
+        )
+        event = Event.objects.create(
+            title='Evento repliche', description='Repliche', location='Repliche',
+            date=timezone.now() + timedelta(days=10), total_seats=10, available_seats=10,
+            organizer=other,
+        )
+        self._replicate(aliases)
+        failures = []
+        try:
+            with override_settings(
+                ASYNC_READ_VIEWS=False,
+                RESPONSE_CACHE={**settings.RESPONSE_CACHE, 'ENABLED': False},
+                REPLICAS={**settings.REPLICAS, 'STICKY_SECONDS': 60},
+            ):
+                replicas.lag_monitor.reset()
+                client = APIClient()
+                client.force_authenticate(buyer)
+                response = client.post(reverse('reservation-create'), {'event': event.pk, 'seats': 1},
+                                       format='json')
+                if response.status_code != 201:
+                    raise CommandError(f"Prenotazione non creata: {response.status_code} {response.data}")
+
+                checks = [
+                    ('lista eventi anonima sulle repliche', APIClient(), 'event-list', True, None),
+                    ('prenotazioni dopo la scrittura sul primario', client, 'my-reservations', False, 1),
+                    ('prenotazioni di un altro utente sulle repliche',
+                     self._client(other), 'my-reservations', True, 0),
+                ]
+                failures += [self._check(*check) for check in checks]
+
+                # A vincolo scaduto si torna sulle repliche, che non hanno ancora
+                # la prenotazione
+                with override_settings(REPLICAS={**settings.REPLICAS, 'STICKY_SECONDS': 0}):
+                    failures.append(self._check('prenotazioni a vincolo scaduto dalle repliche',
+                                                client, 'my-reservations', True, 0))
+
+                with override_settings(REPLICAS={
+                    **settings.REPLICAS,
+                    'LAG_FUNCTION': 'tickets.management.commands.check_replica_routing.lagging_replica',
+                }):
+                    replicas.lag_monitor.reset()
+                    failures.append(self._check('repliche in ritardo: lista eventi dal primario',
+                                                APIClient(), 'event-list', False, None))
+                replicas.lag_monitor.reset()
+        finally:
+            event.delete()
+            self._replicate(aliases)
+
+        failures = [failure for failure in failures if failure]
+        self.stdout.write(str(replicas.metrics()))
+        if failures:
+            raise CommandError("Instradamento errato:\n" + "\n".join(failures))
+        self.stdout.write(self.style.SUCCESS("Instradamento delle letture corretto"))
+
+    @staticmethod
+    def _client(user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def _check(self, name, client, url_name, on_replica, expected_count):
+        aliases = [DEFAULT_DB_ALIAS, *replicas.replica_aliases()]
+        # Le misure del ritardo non vanno contate tra le query della richiesta
+        replicas.lag_monitor.available()
+        with ExitStack() as stack:
+            captured = {alias: stack.enter_context(CaptureQueriesContext(connections[alias]))
+                        for alias in aliases}
+            response = client.get(reverse(url_name))
+        counts = {alias: len(queries) for alias, queries in captured.items()}
+        used_replica = sum(counts[alias] for alias in aliases[1:]) > 0
+        self.stdout.write(f"{name}: status {response.status_code}, query {counts}")
+        if response.status_code != 200 or used_replica != on_replica:
+            return f"{name}: query {counts}"
+        if expected_count is not None and len(response.data['results']) != expected_count:
+            return f"{name}: {len(response.data['results'])} risultati invece di {expected_count}"
+        return None
+
+    @staticmethod
+    def _replicate(aliases):
+        """Copia il file del primario su ogni replica (replica allineata)"""
+        for alias in aliases:
+            connections[alias].close()
+            source = sqlite3.connect(settings.DATABASES[DEFAULT_DB_ALIAS]['NAME'])
+            target = sqlite3.connect(settings.DATABASES[alias]['NAME'])
+            try:
+                source.backup(target)
+            finally:
+                source.close()
+                target.close()
@@ -0,0 +1,113 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from tickets import views
+from tickets.models import Event, Reservation
+from tickets.pagination import EventKeysetPagination, ReservationKeysetPagination
+from tickets.search import QuerySetResults
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Stampa i piani EXPLAIN delle query di ogni view su un dataset generato "
+            "(in una transazione annullata alla fine) o sui dati esistenti con --seed 0")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=20000,
+                            help="Eventi da generare (0 = usa i dati esistenti)")
+        parser.add_argument('--analyze', action='store_true',
+                            help="EXPLAIN ANALYZE (solo PostgreSQL)")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['seed']:
+                    self._seed(options['seed'])
+                    if connection.vendor == 'postgresql':
+                        with connection.cursor() as cursor:
+                            cursor.execute('ANALYZE')
+                for name, queryset in self._hot_queries():
+                    self.stdout.write(self.style.MIGRATE_HEADING(f"== {name}"))
+                    self.stdout.write(str(queryset.query))
+                    explain = {'analyze': True} if options['analyze'] and connection.vendor == 'postgresql' else {}
+                    self.stdout.write(queryset.explain(**explain))
+                    self.stdout.write('')
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _seed(self, size):
+        User = get_user_model()
+        organizers = [
+            User.objects.create_user(f'explain-org-{i}', f'explain-org-{i}@example.com')
+            for i in range(20)
+        ]
+        buyer = User.objects.create_user('explain-buyer', 'explain-buyer@example.com')
+        now = timezone.now()
+        # Un terzo degli eventi nel passato, come in un catalogo reale
+        events = Event.objects.bulk_create(
+            Event(title=f'Concerto {i}', description=f'Descrizione evento {i}',
+                  date=now + timedelta(hours=i - size // 3), location=f'Città {i % 50}',
+                  total_seats=100, available_seats=90, organizer=organizers[i % 20])
+            for i in range(size)
+        )
+        Reservation.objects.bulk_create(
+            Reservation(user=buyer if i % 10 == 0 else organizers[i % 20], event=event,
+                        seats=2, is_confirmed=i % 3 != 0,
+                        expires_at=None if i % 3 else now + timedelta(minutes=i % 20 - 10))
+            for i, event in enumerate(events)
+        )
+
+    def _view_queryset(self, view_class, path, user=None, **kwargs):
+        request = Request(APIRequestFactory().get(path))
+        if user is not None:
+            request.user = user
+        view = view_class(request=request, kwargs=kwargs, format_kwarg=None)
+        return view.get_queryset()
+
+    def _hot_queries(self):
+        User = get_user_model()
+        user = User.objects.filter(reservation__isnull=False).first() or User.objects.first()
+        middle = Event.objects.filter(date__gte=timezone.now()).order_by('date', 'id').values_list(
+            'date', 'id')[Event.objects.count() // 2:][:1]
+        events = EventKeysetPagination()
+        page = events.page_size + 1
+
+        upcoming = self._view_queryset(views.EventListCreateView, '/api/events/')
+        yield 'event-list (prima pagina)', upcoming.order_by(*events.ordering)[:page]
+        if middle:
+            yield 'event-list (pagina profonda, keyset)', upcoming.filter(
+                events._after(list(middle[0]), reverse=False)
+            ).order_by(*events.ordering)[:page]
+        if user is not None:
+            yield 'event-list (filtro organizer)', upcoming.filter(organizer=user).order_by(
+                *events.ordering)[:page]
+        yield 'event-list (filtro location)', upcoming.filter(location='Città 7').order_by(
+            *events.ordering)[:page]
+        results = self._view_queryset(views.EventSearchView, '/api/events/search/?search=Concerto')
+        if isinstance(results, QuerySetResults):
+            yield 'event-search', results.queryset.order_by('-rank', 'id')[:page]
+        else:
+            # Indice in memoria: in SQL resta solo il caricamento della pagina per id
+            ids = [pk for _, pk in results.keys[:page]]
+            yield 'event-search (pagina per id)', results.queryset.filter(pk__in=ids)
+        yield 'event-detail', Event.objects.with_availability().select_related('organizer').filter(
+            pk=Event.objects.values_list('pk', flat=True).first() or 0
+        )
+        if user is not None:
+            reservations = ReservationKeysetPagination()
+            yield 'my-reservations', self._view_queryset(
+                views.UserReservationsListView, '/api/reservations/my/', user=user
+            ).order_by(*reservations.ordering)[:page]
+        yield 'sweep prenotazioni scadute', Reservation.objects.filter(
+            is_confirmed=False, expires_at__lte=timezone.now()
+        ).values_list('event_id', flat=True).distinct()
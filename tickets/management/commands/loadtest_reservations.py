@@ -0,0 +1,66 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+
+from tickets.bench import create_bench_event, reservation_storm, summarize
+from tickets.models import Reservation
+from tickets.services import allocation_stats
+
+
+class Command(BaseCommand):
+    help = ("Load test dell'allocazione posti: lancia migliaia di prenotazioni "
+            "concorrenti su un singolo evento e verifica l'assenza di overbooking")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--seats', type=int, default=500,
+                            help="Posti totali dell'evento di test")
+        parser.add_argument('--per-request', type=int, default=1,
+                            help="Posti richiesti da ogni prenotazione")
+        parser.add_argument('--shards', type=int, default=0,
+                            help="Numero di shard dell'inventario (0 = contatore unico)")
+        parser.add_argument('--keep', action='store_true',
+                            help="Non eliminare l'evento di test alla fine")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        buyer, _ = User.objects.get_or_create(
+            username='loadtest', defaults={'email': 'loadtest@example.com'}
+        )
+        event = create_bench_event(buyer, options['seats'], options['shards'], title='Load test')
+        allocation_stats.reset()
+
+        try:
+            results, latencies, elapsed = reservation_storm(
+                event, buyer, options['requests'], options['concurrency'], options['per_request']
+            )
+            event.refresh_from_db()
+            remaining = event.remaining_seats
+            reserved = Reservation.objects.filter(event=event).aggregate(
+                total=Sum('seats'))['total'] or 0
+
+            report = summarize(latencies, elapsed)
+            report.update({
+                'concurrency': options['concurrency'],
+                'shards': options['shards'],
+                'accepted': results.count('ok'),
+                'rejected': results.count('rejected'),
+                'failed': results.count('failed'),
+                'seats_reserved': reserved,
+                'available_seats': remaining,
+                'allocation_stats': allocation_stats.snapshot(),
+            })
+            self.stdout.write(json.dumps(report, indent=2))
+
+            if reserved > event.total_seats or reserved + remaining != event.total_seats:
+                raise CommandError(
+                    f"Overbooking rilevato: {reserved} posti prenotati, "
+                    f"{remaining} disponibili su {event.total_seats}"
+                )
+            self.stdout.write(self.style.SUCCESS("Nessun overbooking rilevato"))
+        finally:
+            if not options['keep']:
+                event.delete()
@@ -0,0 +1,167 @@
+import asyncio
+import gc
+import json
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from tickets import streams
+from tickets.bench import create_bench_event, percentile
+from tickets.services import allocate_seats
+
+
+def _rss_kb():
+    """RSS corrente del processo in kB (solo Linux), None altrove"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+class _Client:
+    """Client ASGI minimale: nessuna rete, solo i messaggi dell'app"""
+
+    __slots__ = ('closed', 'status', 'snapshots', 'updates', 'received_at')
+
+    def __init__(self, loop):
+        self.closed = loop.create_future()
+        self.status = None
+        self.snapshots = self.updates = 0
+        self.received_at = 0.0
+
+    async def receive(self):
+        if self.status is None:
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.closed
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+        elif message['type'] == 'http.response.body':
+            body = message.get('body', b'')
+            self.snapshots += body.count(b'event: snapshot')
+            if b'event: seats' in body:
+                self.updates += 1
+                self.received_at = time.perf_counter()
+
+
+class Command(BaseCommand):
+    help = ("Load test degli stream SSE della disponibilità posti: apre N connessioni "
+            "sull'app ASGI nello stesso processo, misura la memoria per connessione "
+            "e la latenza di consegna delle variazioni (prenotazione -> tutti gli iscritti)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=10000)
+        parser.add_argument('--events', type=int, default=10,
+                            help="Eventi su cui distribuire le connessioni")
+        parser.add_argument('--rounds', type=int, default=20,
+                            help="Prenotazioni di cui misurare la consegna")
+        parser.add_argument('--batch', type=int, default=500,
+                            help="Connessioni aperte in parallelo")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        buyer, _ = User.objects.get_or_create(
+            username='loadtest', defaults={'email': 'loadtest@example.com'}
+        )
+        events = [
+            create_bench_event(buyer, options['rounds'] + 1, title=f'Stream load test {i}')
+            for i in range(options['events'])
+        ]
+        try:
+            report = asyncio.run(self._run(events, buyer, options))
+        finally:
+            for event in events:
+                event.delete()
+        self.stdout.write(json.dumps(report, indent=2))
+        if report['leaked_subscribers']:
+            raise CommandError(f"{report['leaked_subscribers']} iscritti non rimossi alla disconnessione")
+
+    async def _run(self, events, buyer, options):
+        from django_project.asgi import application
+
+        loop = asyncio.get_running_loop()
+        total = options['connections']
+        hub = streams.get_hub()
+
+        # Memoria del solo client di prova, da sottrarre alla misura
+        gc.collect()
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        clients = [_Client(loop) for _ in range(total)]
+        client_bytes = tracemalloc.get_traced_memory()[0] - base
+
+        gc.collect()
+        base, rss_before = tracemalloc.get_traced_memory()[0], _rss_kb()
+        tasks = []
+        start = time.perf_counter()
+        for offset in range(0, total, options['batch']):
+            chunk = range(offset, min(offset + options['batch'], total))
+            for i in chunk:
+                pk = events[i % len(events)].pk
+                tasks.append(loop.create_task(application(self._scope(pk), clients[i].receive, clients[i].send)))
+            while any(not clients[i].snapshots for i in chunk):
+                if any(tasks[i].done() for i in chunk):
+                    raise CommandError("Una connessione si è chiusa prima dell'istantanea")
+                await asyncio.sleep(0.01)
+        connect_s = time.perf_counter() - start
+        gc.collect()
+        stream_bytes = tracemalloc.get_traced_memory()[0] - base - client_bytes
+        rss_after = _rss_kb()
+        tracemalloc.stop()
+
+        # Consegna: dalla prenotazione all'ultimo iscritto dell'evento
+        latencies = []
+        for round_ in range(options['rounds']):
+            event = events[round_ % len(events)]
+            audience = [c for i, c in enumerate(clients) if i % len(events) == round_ % len(events)]
+            before = [c.updates for c in audience]
+            start = time.perf_counter()
+            await asyncio.to_thread(self._reserve, event)
+            deadline = start + 10
+            while any(c.updates == b for c, b in zip(audience, before)):
+                if time.perf_counter() > deadline:
+                    raise CommandError("Variazione non consegnata entro 10 secondi")
+                await asyncio.sleep(0.001)
+            latencies.append(max(c.received_at for c in audience) - start)
+
+        for client in clients:
+            client.closed.set_result(None)
+        await asyncio.gather(*tasks)
+
+        return {
+            'connections': total,
+            'events': len(events),
+            'connect_s': round(connect_s, 2),
+            'bytes_per_connection': round(stream_bytes / total),
+            'rss_kb_per_connection': round((rss_after - rss_before) / total, 2) if rss_before else None,
+            'coalesce_ms': round(hub.interval * 1000),
+            'delivery_p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'delivery_p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'delivery_max_ms': round(max(latencies) * 1000, 2),
+            'leaked_subscribers': hub.subscriber_count,
+        }
+
+    @staticmethod
+    def _reserve(event):
+        try:
+            allocate_seats(event, 1)
+        finally:
+            connections.close_all()
+
+    @staticmethod
+    def _scope(pk):
+        path = f'/api/events/{pk}/stream/'
+        return {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': b'', 'root_path': '', 'headers': [(b'host', b'localhost')],
+            'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        }
@@ -0,0 +1,115 @@
+import json
+import random
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from tickets import loadtest
+
+
+class Command(BaseCommand):
+    help = ("Load test dell'API con traffico realistico: esegue gli scenari (browse, "
+            "search, onsale, cancel-storm) sui dati di seed_data oppure ripete un log "
+            "JSONL di richieste, e scrive un report JSON con latenze p50/p95/p99, "
+            "throughput, status e query SQL per endpoint. Con --baseline stampa le "
+            "variazioni rispetto al report di un altro commit.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', default=','.join(loadtest.SCENARIOS),
+                            help="Scenari da eseguire, separati da virgola")
+        parser.add_argument('--replay', metavar='JSONL',
+                            help="Log di richieste da ripetere al posto degli scenari ('-' = stdin)")
+        parser.add_argument('--requests', type=int, default=500, help="Richieste per scenario")
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default=loadtest.SEED_PREFIX, help="Prefisso dei dati di seed_data")
+        parser.add_argument('--output', help="File del report (default: stdout)")
+        parser.add_argument('--baseline', help="Report di riferimento da confrontare")
+        parser.add_argument('--dump', metavar='JSONL',
+                            help="Scrive le richieste generate dagli scenari senza eseguirle")
+        parser.add_argument('--no-response-cache', action='store_true')
+        parser.add_argument('--keep', action='store_true',
+                            help="Non eliminare gli eventi creati dagli scenari")
+
+    def handle(self, *args, **options):
+        if options['replay']:
+            runs = [('replay', lambda rng, created: self._read(options['replay']))]
+        else:
+            names = options['scenarios'].split(',')
+            unknown = set(names) - loadtest.SCENARIOS.keys()
+            if unknown:
+                raise CommandError(f"Scenari sconosciuti: {', '.join(sorted(unknown))}")
+            if not loadtest.seed_events(options['prefix']):
+                raise CommandError(f"Nessun dato con prefisso '{options['prefix']}': esegui seed_data")
+            runs = [(name, lambda rng, created, scenario=loadtest.SCENARIOS[name]: scenario(
+                rng, options['requests'], created, options['prefix'])) for name in names]
+
+        overrides = {}
+        if options['no_response_cache']:
+            overrides['RESPONSE_CACHE'] = {**settings.RESPONSE_CACHE, 'ENABLED': False}
+        rng = random.Random(options['seed'])
+        created = []
+        report = {
+            'meta': {
+                'git_revision': loadtest.git_revision(),
+                'created_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'concurrency': options['concurrency'],
+                'seed': options['seed'],
+                'response_cache': not options['no_response_cache'],
+            },
+            'scenarios': {},
+        }
+        try:
+            with override_settings(**overrides):
+                for name, generate in runs:
+                    requests = generate(rng, created)
+                    if options['dump']:
+                        with open(options['dump'], 'a') as stream:
+                            loadtest.write_log(requests, stream)
+                        continue
+                    try:
+                        results, latencies, elapsed = loadtest.replay(requests, options['concurrency'])
+                    except ValueError as exc:
+                        raise CommandError(str(exc))
+                    report['scenarios'][name] = loadtest.build_report(results, latencies, elapsed)
+                    summary = report['scenarios'][name]
+                    self.stderr.write(
+                        f"{name:>14}: {summary['throughput_rps']} req/s, p50 {summary['p50_ms']} ms, "
+                        f"p99 {summary['p99_ms']} ms, {summary['queries_mean']} query/richiesta, "
+                        f"errori {summary['errors']}"
+                    )
+        finally:
+            # Un log scritto con --dump fa riferimento agli eventi degli scenari
+            if not options['keep'] and not options['dump']:
+                for event in created:
+                    event.delete()
+        if options['dump']:
+            self.stderr.write(f"Richieste scritte in {options['dump']}")
+            return
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                stream.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if options['baseline']:
+            with open(options['baseline']) as stream:
+                baseline = json.load(stream)
+            for line in loadtest.compare(report, baseline):
+                self.stderr.write(line)
+
+    @staticmethod
+    def _read(path):
+        try:
+            if path == '-':
+                return loadtest.read_log(sys.stdin)
+            with open(path) as stream:
+                return loadtest.read_log(stream)
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
@@ -0,0 +1,31 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from tickets.payments import PaymentWorkerPool, metrics
+
+
+class Command(BaseCommand):
+    help = ("Elabora la coda dei pagamenti con un pool di worker; più processi "
+            "possono girare in parallelo sulla stessa coda")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=10,
+                            help="Pagamenti reclamati da un worker per volta")
+        parser.add_argument('--poll-interval', type=float, default=1,
+                            help="Secondi di attesa a coda vuota")
+        parser.add_argument('--report-interval', type=float, default=30)
+
+    def handle(self, *args, **options):
+        pool = PaymentWorkerPool(options['workers'], options['batch_size'], options['poll_interval'])
+        signal.signal(signal.SIGTERM, lambda *_: pool.stopped.set())
+        pool.start()
+        self.stdout.write(f"{options['workers']} worker avviati")
+        try:
+            while not pool.stopped.wait(options['report_interval']):
+                self.stdout.write(str(metrics()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            pool.stop()
@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tickets.availability import rebuild
+
+
+class Command(BaseCommand):
+    help = ("Ricalcola da zero il calendario della disponibilità (AvailabilityRollup) "
+            "dagli eventi: corregge le differenze lasciate da incrementi persi o da "
+            "scritture che non passano dai segnali (loaddata, bulk_create)")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        rows = rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"{rows} righe ricalcolate in {time.perf_counter() - start:.1f} s"
+        ))
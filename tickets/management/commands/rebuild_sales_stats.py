@@ -0,0 +1,57 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from tickets import sales
+from tickets.models import Event
+
+
+def _chunks(queryset, field, size):
+    """Valori distinti di `field` in ordine crescente, a blocchi di `size` (keyset)"""
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(**{f'{field}__gt': last})
+        values = list(page.order_by(field).values_list(field, flat=True).distinct()[:size])
+        if not values:
+            return
+        yield values
+        last = values[-1]
+
+
+class Command(BaseCommand):
+    help = ("Ricalcola a blocchi le statistiche di vendita (EventSales, OrganizerSales) "
+            "dalle prenotazioni e dai pagamenti: correzione delle differenze lasciate da "
+            "crash o da scritture senza segnali (il backfill iniziale è nella migrazione 0011). "
+            "Ogni blocco è una transazione che blocca solo le proprie righe; da eseguire a traffico basso.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--organizer', type=int, action='append',
+                            help="Solo gli eventi di questo organizzatore (ripetibile)")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        size = options['chunk_size']
+        events = Event.objects.all()
+        if options['organizer']:
+            events = events.filter(organizer_id__in=options['organizer'])
+
+        total = 0
+        for event_ids in _chunks(events, 'pk', size):
+            total += sales.rebuild_events(event_ids)
+            self.stderr.write(f"  {total} eventi", ending='\r')
+        self.stderr.write('')
+
+        if options['organizer']:
+            organizer_chunks = [options['organizer']]
+        else:
+            # Anche gli organizzatori senza più eventi, da azzerare
+            organizer_chunks = _chunks(get_user_model().objects.filter(
+                Q(event__isnull=False) | Q(sales__isnull=False)
+            ), 'pk', size)
+        organizers = sum(sales.rebuild_organizers(chunk) for chunk in organizer_chunks)
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} eventi e {organizers} organizzatori ricalcolati in {time.perf_counter() - start:.1f} s"
+        ))
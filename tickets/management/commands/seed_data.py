@@ -0,0 +1,96 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from tickets import availability, sales
+from tickets.loadtest import CITIES, GENRES, SEED_PREFIX, WORDS
+from tickets.models import Event, Reservation
+
+# Quota degli utenti che organizzano eventi
+ORGANIZER_SHARE = 0.05
+
+
+class Command(BaseCommand):
+    help = ("Genera dati di prova per i load test: utenti, eventi futuri e prenotazioni "
+            "confermate coerenti con i posti disponibili. Con lo stesso --seed i dati "
+            "sono identici; gli utenti si chiamano <prefix>-user-N e hanno tutti la "
+            "password --password.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--events', type=int, default=200)
+        parser.add_argument('--reservations', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default=SEED_PREFIX)
+        parser.add_argument('--password', default='loadtest-password')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--clear', action='store_true',
+                            help="Elimina prima i dati generati con lo stesso prefisso")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix, batch_size = options['prefix'], options['batch_size']
+        User = get_user_model()
+        start = time.perf_counter()
+
+        if options['clear']:
+            deleted, _ = User.objects.filter(username__startswith=f'{prefix}-user-').delete()
+            self.stderr.write(f"Eliminati {deleted} oggetti")
+
+        # Un solo hash per tutti: hashare migliaia di password richiederebbe minuti
+        password = make_password(options['password'])
+        User.objects.bulk_create(
+            (User(username=f'{prefix}-user-{i}', email=f'{prefix}-user-{i}@example.com',
+                  password=password) for i in range(options['users'])),
+            batch_size=batch_size, ignore_conflicts=True
+        )
+        users = list(User.objects.filter(username__startswith=f'{prefix}-user-').order_by('pk'))
+        organizers = users[:max(1, int(len(users) * ORGANIZER_SHARE))]
+
+        now = timezone.now()
+        with transaction.atomic():
+            events = Event.objects.bulk_create(
+                (self._event(rng, i, now, rng.choice(organizers)) for i in range(options['events'])),
+                batch_size=batch_size
+            )
+            reservations = []
+            for _ in range(options['reservations']):
+                event = rng.choice(events)
+                seats = min(rng.randint(1, 4), event.available_seats)
+                if not seats:
+                    continue
+                event.available_seats -= seats
+                reservations.append(Reservation(
+                    user=rng.choice(users), event=event, seats=seats, is_confirmed=True
+                ))
+            Reservation.objects.bulk_create(reservations, batch_size=batch_size)
+            Event.objects.bulk_update(events, ['available_seats'], batch_size=batch_size)
+            # bulk_create non invia segnali: calendario e statistiche vanno aggiornati a parte
+            availability.add_events(events)
+            for offset in range(0, len(events), batch_size):
+                sales.rebuild_events([event.pk for event in events[offset:offset + batch_size]])
+            sales.rebuild_organizers([organizer.pk for organizer in organizers])
+
+        self.stdout.write(
+            f"Utenti {len(users)}, eventi {len(events)}, prenotazioni {len(reservations)} "
+            f"in {time.perf_counter() - start:.1f} s"
+        )
+
+    @staticmethod
+    def _event(rng, i, now, organizer):
+        city = rng.choice(CITIES)
+        title = f"{rng.choice(GENRES)} {' '.join(rng.sample(WORDS, 2))} {city}"
+        seats = rng.randint(50, 500)
+        return Event(
+            title=title, location=city, organizer=organizer,
+            description=f"{title}: {' '.join(rng.sample(WORDS, 6))}",
+            date=now + timedelta(days=rng.randint(1, 120), hours=rng.randint(0, 23)),
+            total_seats=seats, available_seats=seats,
+            price=rng.choice((0, 15, 25, 40, 60, 90)),
+        )
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tickets.models import Event
+from tickets.services import set_shard_count
+
+
+class Command(BaseCommand):
+    help = "Attiva o disattiva l'inventario sharded dei posti per un evento"
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_id', type=int)
+        parser.add_argument('--shards', type=int, required=True,
+                            help="Numero di shard (0 per tornare al contatore unico)")
+
+    def handle(self, *args, **options):
+        try:
+            event = Event.objects.get(pk=options['event_id'])
+        except Event.DoesNotExist:
+            raise CommandError(f"Evento {options['event_id']} inesistente")
+        event = set_shard_count(event, options['shards'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Evento {event.pk}: {event.seat_shard_count} shard, "
+            f"{event.remaining_seats} posti disponibili"
+        ))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tickets.services import sweep_expired_holds, hold_metrics
+
+
+class Command(BaseCommand):
+    help = "Rilascia i posti delle prenotazioni non pagate entro la scadenza"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help="Ripete la sweep ogni --interval secondi")
+        parser.add_argument('--interval', type=float, default=30)
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Prenotazioni massime per evento a ogni sweep")
+
+    def handle(self, *args, **options):
+        while True:
+            holds, seats = sweep_expired_holds(options['batch_size'])
+            metrics = hold_metrics()
+            self.stdout.write(
+                f"{holds} prenotazioni scadute, {seats} posti recuperati; "
+                f"{metrics['active_holds']} prenotazioni attive ({metrics['held_seats']} posti)"
+            )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
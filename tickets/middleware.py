@@ -0,0 +1,225 @@
+import json
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.core import signing
+from django.http import JsonResponse
+from django.urls import reverse
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import IntegerField
+from rest_framework.utils.html import parse_html_list
+
+from . import admission, instrumentation, replicas
+
+# Conversione dell'id evento come nei serializer delle prenotazioni
+_EVENT_ID = IntegerField()
+
+
+class InstrumentationMiddleware:
+    """Tempi, query SQL, Server-Timing, metriche e profili di ogni richiesta
+    (vedi tickets.instrumentation). Va per primo in MIDDLEWARE per misurare
+    anche gli altri middleware."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not instrumentation.enabled():
+            return self.get_response(request)
+
+        profiler, announce = instrumentation.profiler_for(request)
+        timings = instrumentation.RequestTimings()
+        token = instrumentation.activate(timings)
+        try:
+            if profiler is not None:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+        finally:
+            instrumentation.deactivate(token)
+        return instrumentation.finish(request, response, timings, profiler, announce)
+
+    async def __acall__(self, request):
+        if not instrumentation.enabled():
+            return await self.get_response(request)
+
+        timings = instrumentation.RequestTimings()
+        token = instrumentation.activate(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            instrumentation.deactivate(token)
+        return instrumentation.finish(request, response, timings)
+
+
+class AdmissionQueueMiddleware:
+    """Filtra le richieste di prenotazione per gli eventi con coda di ammissione attiva.
+
+    Vale per la prenotazione singola e per il batch: un batch deve portare in
+    ``X-Queue-Token`` (separati da virgole) un token ammesso per ogni evento
+    in coda tra i suoi elementi. Le richieste senza vengono respinte con 429
+    prima dell'autenticazione JWT e senza alcuna query al database. Supporta
+    anche la catena asincrona: sotto ASGI le altre richieste la attraversano
+    senza passare da un thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self._paths = None
+
+    @property
+    def paths(self):
+        if self._paths is None:
+            self._paths = {reverse('reservation-create'): False, reverse('reservation-batch'): True}
+        return self._paths
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if request.method != 'POST' or request.path not in self.paths:
+            return self.get_response(request)
+
+        rejection, claims = self._admit(request)
+        if rejection is not None:
+            return rejection
+        response = self.get_response(request)
+        self._settle(response, claims)
+        return response
+
+    async def __acall__(self, request):
+        if request.method != 'POST' or request.path not in self.paths:
+            return await self.get_response(request)
+
+        rejection, claims = await sync_to_async(self._admit)(request)
+        if rejection is not None:
+            return rejection
+        response = await self.get_response(request)
+        if claims:
+            await sync_to_async(self._settle)(response, claims)
+        return response
+
+    def _admit(self, request):
+        """(risposta di rifiuto o None, token reclamati [(event_id, seq), ...])"""
+        event_ids = self._event_ids(request, batch=self.paths[request.path])
+        if not event_ids:
+            return None, []
+
+        tokens = {}
+        for token in filter(None, (t.strip() for t in request.headers.get('X-Queue-Token', '').split(','))):
+            try:
+                token_event_id, seq = admission.read_token(token)
+            except signing.BadSignature:
+                return self._reject("Token di coda non valido o scaduto"), []
+            if token_event_id not in event_ids:
+                return self._reject("Il token di coda non è valido per questo evento"), []
+            tokens[token_event_id] = seq
+
+        claims = []
+        for event_id in sorted(event_ids):
+            rejection, claim = self._admit_event(request, event_id, tokens.get(event_id))
+            if rejection is not None:
+                # Un evento respinto respinge tutta la richiesta: i token già reclamati restano spendibili
+                for claimed in claims:
+                    admission.get_backend().release(*claimed)
+                return rejection, []
+            if claim is not None:
+                claims.append(claim)
+        return None, claims
+
+    def _admit_event(self, request, event_id, seq):
+        """(risposta di rifiuto o None, token reclamato (event_id, seq) o None)"""
+        if seq is None:
+            if not admission.is_active(event_id):
+                return None, None
+            return self._reject(
+                "Evento in coda: ottieni un token di ammissione",
+                {'queue': reverse('event-queue', args=[event_id])}
+            ), None
+
+        status = admission.position(event_id, seq)
+        if not status['active']:
+            return None, None
+        if status['position']:
+            return self._reject("Non ancora ammesso", status, retry_after=status['retry_after']), None
+
+        if not admission.get_backend().claim(event_id, seq):
+            if request.headers.get('Idempotency-Key'):
+                # Ripetizione di una prenotazione: la view risponde solo con
+                # l'esito salvato per la chiave (vedi tickets.idempotency)
+                request.queue_token_used = True
+                return None, None
+            return self._reject("Token di coda già utilizzato"), None
+        return None, (event_id, seq)
+
+    @staticmethod
+    def _settle(response, claims):
+        if claims and response.status_code >= 400:
+            # Prenotazione non riuscita: i token restano spendibili
+            for claim in claims:
+                admission.get_backend().release(*claim)
+
+    @staticmethod
+    def _event_ids(request, batch=False):
+        """Id degli eventi nominati dalla richiesta (`event` o `event` di ogni elemento di `items`)"""
+        try:
+            if request.content_type == 'application/json':
+                data = json.loads(request.body or b'{}')
+                values = [item.get('event') for item in data['items']] if batch else [data.get('event')]
+            elif batch:
+                values = [item.get('event') for item in parse_html_list(request.POST, prefix='items')]
+            else:
+                values = [request.POST.get('event')]
+        except (ValueError, TypeError, AttributeError, KeyError):
+            return set()
+        event_ids = set()
+        for value in values:
+            # Stessa conversione del serializer: nessun id accettato dalla view sfugge alla coda
+            try:
+                event_ids.add(_EVENT_ID.to_internal_value(value))
+            except ValidationError:
+                continue
+        return event_ids
+
+    @staticmethod
+    def _reject(detail, extra=None, retry_after=None):
+        response = JsonResponse({'detail': detail, **(extra or {})}, status=429)
+        if retry_after:
+            response['Retry-After'] = str(retry_after)
+        return response
+
+
+class ReplicaPinMiddleware:
+    """Dopo una scrittura riuscita le letture dell'utente restano sul primario
+    per ``REPLICAS['STICKY_SECONDS']`` (vedi tickets.replicas)"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        replicas.pin(request, response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if request.method not in replicas.SAFE_METHODS:
+            await sync_to_async(replicas.pin)(request, response)
+        return response
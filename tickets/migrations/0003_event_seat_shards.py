@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='seat_shard_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='EventSeatShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('available_seats', models.PositiveIntegerField()),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seat_shards', to='tickets.event')),
+            ],
+            options={
+                'unique_together': {('event', 'index')},
+            },
+        ),
+    ]
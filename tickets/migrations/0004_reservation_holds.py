@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0003_event_seat_shards'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('is_confirmed', False)), fields=['expires_at'], name='reservation_hold_expiry_idx'),
+        ),
+    ]
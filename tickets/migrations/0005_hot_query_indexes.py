@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0004_reservation_holds'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['date', 'id'], name='event_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['organizer', 'date'], name='event_organizer_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['location', 'date'], name='event_location_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='eventseatshard',
+            index=models.Index(condition=models.Q(('available_seats__gt', 0)), fields=['event'], name='seatshard_in_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='reservation_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['user', 'event'], name='reservation_user_event_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:25
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_VECTOR = """
+    setweight(to_tsvector('simple', coalesce({row}title, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce({row}location, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce({row}description, '')), 'C')
+"""
+
+
+def create_search_trigger(apps, schema_editor):
+    # Trigger e indice GIN esistono solo su PostgreSQL; altrove si usa
+    # l'indice invertito in memoria di tickets.search
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f"""
+        CREATE OR REPLACE FUNCTION tickets_event_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := {SEARCH_VECTOR.format(row='NEW.')};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    schema_editor.execute("""
+        CREATE TRIGGER tickets_event_search_vector_trigger
+        BEFORE INSERT OR UPDATE OF title, location, description ON tickets_event
+        FOR EACH ROW EXECUTE FUNCTION tickets_event_search_vector_update()
+    """)
+    schema_editor.execute(f"UPDATE tickets_event SET search_vector = {SEARCH_VECTOR.format(row='')}")
+    schema_editor.execute(
+        "CREATE INDEX event_search_vector_gin ON tickets_event USING gin (search_vector)"
+    )
+
+
+def drop_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS event_search_vector_gin")
+    schema_editor.execute("DROP TRIGGER IF EXISTS tickets_event_search_vector_trigger ON tickets_event")
+    schema_editor.execute("DROP FUNCTION IF EXISTS tickets_event_search_vector_update()")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0005_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_trigger, drop_search_trigger),
+    ]
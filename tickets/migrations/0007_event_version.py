@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0006_event_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='version',
+            field=models.PositiveBigIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='eventseatshard',
+            name='version',
+            field=models.PositiveBigIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='eventseatshard',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0007_event_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='last_error',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='callback_url',
+            field=models.URLField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['next_attempt_at'], name='payment_pending_due_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:19
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Sum
+from django.utils import timezone
+
+
+def populate_rollup(apps, schema_editor):
+    # Come tickets.availability.rebuild, sui modelli storici
+    Event = apps.get_model('tickets', 'Event')
+    EventSeatShard = apps.get_model('tickets', 'EventSeatShard')
+    AvailabilityRollup = apps.get_model('tickets', 'AvailabilityRollup')
+    shards = dict(EventSeatShard.objects.values('event').annotate(
+        total=Sum('available_seats')).values_list('event', 'total'))
+    rows = defaultdict(lambda: [0, 0, 0])
+    for pk, date, total, available, sharded in Event.objects.values_list(
+            'pk', 'date', 'total_seats', 'available_seats', 'seat_shard_count').iterator():
+        hour = timezone.localtime(date, timezone.get_default_timezone()).replace(
+            minute=0, second=0, microsecond=0)
+        remaining = shards.get(pk, 0) if sharded else available
+        for key in (('day', hour.replace(hour=0)), ('hour', hour)):
+            row = rows[key]
+            row[0] += 1
+            row[1] += total
+            row[2] += remaining
+    AvailabilityRollup.objects.bulk_create(
+        (AvailabilityRollup(granularity=granularity, bucket=bucket, events=events,
+                            total_seats=total, remaining_seats=remaining)
+         for (granularity, bucket), (events, total, remaining) in rows.items()),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0008_payment_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvailabilityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('day', 'Giorno'), ('hour', 'Ora')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('events', models.IntegerField(default=0)),
+                ('total_seats', models.BigIntegerField(default=0)),
+                ('remaining_seats', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'bucket'), name='availability_rollup_bucket_uniq')],
+            },
+        ),
+        migrations.RunPython(populate_rollup, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0009_availability_rollup'),
+        ('users', '0002_case_insensitive_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventSales',
+            fields=[
+                ('reservations', models.IntegerField(default=0)),
+                ('seats_reserved', models.BigIntegerField(default=0)),
+                ('seats_sold', models.BigIntegerField(default=0)),
+                ('payments_pending', models.IntegerField(default=0)),
+                ('payments_completed', models.IntegerField(default=0)),
+                ('payments_failed', models.IntegerField(default=0)),
+                ('payments_refunded', models.IntegerField(default=0)),
+                ('amount_pending', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('amount_refunded', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('event', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sales', serialize=False, to='tickets.event')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='OrganizerSales',
+            fields=[
+                ('reservations', models.IntegerField(default=0)),
+                ('seats_reserved', models.BigIntegerField(default=0)),
+                ('seats_sold', models.BigIntegerField(default=0)),
+                ('payments_pending', models.IntegerField(default=0)),
+                ('payments_completed', models.IntegerField(default=0)),
+                ('payments_failed', models.IntegerField(default=0)),
+                ('payments_refunded', models.IntegerField(default=0)),
+                ('amount_pending', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('amount_refunded', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('organizer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sales', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('events', models.IntegerField(default=0)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+from collections import defaultdict
+
+from django.db import migrations
+from django.db.models import Count, Q, Sum
+
+# Come tickets.sales.AMOUNTS: importo di ogni stato del pagamento
+AMOUNTS = {'pending': 'amount_pending', 'completed': 'revenue', 'refunded': 'amount_refunded'}
+
+
+def populate_sales(apps, schema_editor):
+    # Come rebuild_sales_stats, sui modelli storici; sostituisce le righe già calcolate
+    clear_sales(apps, schema_editor)
+    Event = apps.get_model('tickets', 'Event')
+    Reservation = apps.get_model('tickets', 'Reservation')
+    Payment = apps.get_model('tickets', 'Payment')
+    EventSales = apps.get_model('tickets', 'EventSales')
+    OrganizerSales = apps.get_model('tickets', 'OrganizerSales')
+    events = {pk: {} for pk in Event.objects.values_list('pk', flat=True).iterator()}
+    for values in Reservation.objects.values('event_id').annotate(
+        reservations=Count('pk'), seats_reserved=Sum('seats'),
+        seats_sold=Sum('seats', filter=Q(is_confirmed=True)),
+    ):
+        events[values.pop('event_id')].update({field: value or 0 for field, value in values.items()})
+    for event_id, status, count, amount in Payment.objects.values('reservation__event_id', 'status').annotate(
+        count=Count('pk'), amount=Sum('amount')
+    ).values_list('reservation__event_id', 'status', 'count', 'amount'):
+        events[event_id][f'payments_{status}'] = count
+        if status in AMOUNTS:
+            events[event_id][AMOUNTS[status]] = amount or 0
+    EventSales.objects.bulk_create(
+        (EventSales(event_id=pk, **counters) for pk, counters in events.items()), batch_size=1000
+    )
+
+    organizers = defaultdict(lambda: defaultdict(int))
+    for organizer_id, event_id in Event.objects.values_list('organizer_id', 'pk').iterator():
+        organizers[organizer_id]['events'] += 1
+        for field, value in events[event_id].items():
+            organizers[organizer_id][field] += value
+    OrganizerSales.objects.bulk_create(
+        (OrganizerSales(organizer_id=pk, **counters) for pk, counters in organizers.items()), batch_size=1000
+    )
+
+
+def clear_sales(apps, schema_editor):
+    apps.get_model('tickets', 'EventSales').objects.all().delete()
+    apps.get_model('tickets', 'OrganizerSales').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0010_sales_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_sales, clear_sales),
+    ]
@@ -1,9 +1,46 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
 
+class EventQuerySet(models.QuerySet):
+    def with_availability(self):
+        """Annota `current_available_seats`: la somma degli shard per gli eventi
+        in modalità sharded, il contatore dell'evento per tutti gli altri"""
+        shard_total = EventSeatShard.objects.filter(
+            event=models.OuterRef('pk')
+        ).values('event').annotate(total=models.Sum('available_seats')).values('total')
+        return self.annotate(current_available_seats=models.Case(
+            models.When(seat_shard_count__gt=0, then=Coalesce(
+                models.Subquery(shard_total), 0
+            )),
+            default=models.F('available_seats'),
+        ))
+
+    def with_version(self):
+        """Annota `shard_version` e `last_modified`: per gli eventi sharded le
+        scritture dei posti aggiornano gli shard e non la riga dell'evento"""
+        shards = EventSeatShard.objects.filter(event=models.OuterRef('pk')).values('event')
+        sharded = models.Q(seat_shard_count__gt=0)
+        return self.annotate(
+            shard_version=models.Case(
+                models.When(sharded, then=Coalesce(models.Subquery(
+                    shards.annotate(total=models.Sum('version')).values('total')
+                ), 0)),
+                default=models.Value(0),
+            ),
+            last_modified=models.Case(
+                models.When(sharded, then=Greatest('updated_at', Coalesce(models.Subquery(
+                    shards.annotate(latest=models.Max('updated_at')).values('latest')
+                ), 'updated_at'))),
+                default=models.F('updated_at'),
+            ),
+        )
+
+
 class Event(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField()
@@ -13,10 +50,128 @@ class Event(models.Model):
     available_seats = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
     organizer = models.ForeignKey(User, on_delete=models.CASCADE)
+    # 0 = contatore unico su available_seats, N > 0 = posti distribuiti su N shard
+    seat_shard_count = models.PositiveSmallIntegerField(default=0)
+    # tsvector di titolo/luogo/descrizione, mantenuto da un trigger su PostgreSQL
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Incrementato da ogni scrittura (anche dagli UPDATE con F() dei posti): ETag
+    version = models.PositiveBigIntegerField(default=1, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = EventQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Eventi futuri in ordine di data (lista, ricerca, paginazione keyset)
+            models.Index(fields=['date', 'id'], name='event_date_id_idx'),
+            models.Index(fields=['organizer', 'date'], name='event_organizer_date_idx'),
+            models.Index(fields=['location', 'date'], name='event_location_date_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+        # Incremento nel database: non perde gli UPDATE concorrenti dei posti
+        self.version = models.F('version') + 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+        self.refresh_from_db(fields=['version'])
+
+    @property
+    def remaining_seats(self):
+        """Posti ancora prenotabili, indipendentemente dalla modalità di inventario"""
+        if hasattr(self, 'current_available_seats'):
+            return self.current_available_seats
+        if not self.seat_shard_count:
+            return self.available_seats
+        return self.seat_shards.aggregate(
+            total=models.Sum('available_seats')
+        )['total'] or 0
+
+
+class EventSeatShard(models.Model):
+    """Porzione dell'inventario di un evento ad alta domanda.
+
+    Distribuire i posti su più righe evita che tutte le prenotazioni si
+    serializzino sul lock della singola riga dell'evento.
+    """
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='seat_shards')
+    index = models.PositiveSmallIntegerField()
+    available_seats = models.PositiveIntegerField()
+    version = models.PositiveBigIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('event', 'index')
+        indexes = [
+            # Fallback dell'allocazione: solo gli shard con posti residui
+            models.Index(
+                fields=['event'], condition=models.Q(available_seats__gt=0),
+                name='seatshard_in_stock_idx'
+            ),
+        ]
+
+
+class AvailabilityRollup(models.Model):
+    """Eventi, posti totali e posti residui per giorno o per ora.
+
+    Mantenuta in modo incrementale da ``tickets.availability`` (prenotazioni,
+    cancellazioni, modifiche degli eventi); ``rebuild_availability`` la
+    ricalcola da zero.
+    """
+    GRANULARITIES = [('day', 'Giorno'), ('hour', 'Ora')]
+
+    granularity = models.CharField(max_length=4, choices=GRANULARITIES)
+    # Inizio del giorno o dell'ora nel fuso di settings.TIME_ZONE
+    bucket = models.DateTimeField()
+    events = models.IntegerField(default=0)
+    total_seats = models.BigIntegerField(default=0)
+    remaining_seats = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Anche l'indice delle letture per intervallo del calendario
+            models.UniqueConstraint(fields=['granularity', 'bucket'], name='availability_rollup_bucket_uniq'),
+        ]
+
+
+class SalesCounters(models.Model):
+    """Contatori di vendita mantenuti da ``tickets.sales`` nella stessa
+    transazione di prenotazioni, cancellazioni e pagamenti"""
+    COUNTERS = ('reservations', 'seats_reserved', 'seats_sold', 'payments_pending', 'payments_completed',
+                'payments_failed', 'payments_refunded', 'amount_pending', 'revenue', 'amount_refunded')
+
+    # Prenotazioni esistenti (in attesa di pagamento o confermate) e i loro posti
+    reservations = models.IntegerField(default=0)
+    seats_reserved = models.BigIntegerField(default=0)
+    seats_sold = models.BigIntegerField(default=0)
+    payments_pending = models.IntegerField(default=0)
+    payments_completed = models.IntegerField(default=0)
+    payments_failed = models.IntegerField(default=0)
+    payments_refunded = models.IntegerField(default=0)
+    amount_pending = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    amount_refunded = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+
+
+class EventSales(SalesCounters):
+    event = models.OneToOneField(Event, on_delete=models.CASCADE, primary_key=True, related_name='sales')
+
+
+class OrganizerSales(SalesCounters):
+    COUNTERS = ('events',) + SalesCounters.COUNTERS
+
+    organizer = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='sales')
+    events = models.IntegerField(default=0)
+
 
 class Reservation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -24,11 +179,22 @@ class Reservation(models.Model):
     seats = models.PositiveIntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
     is_confirmed = models.BooleanField(default=False)
+    # Scadenza della prenotazione non ancora pagata (hold); None se confermata
+    expires_at = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         permissions = [
             ("cancel_reservation", "Can cancel reservation"),
         ]
+        indexes = [
+            models.Index(
+                fields=['expires_at'], condition=models.Q(is_confirmed=False),
+                name='reservation_hold_expiry_idx'
+            ),
+            # Prenotazioni dell'utente in ordine di creazione (paginazione keyset)
+            models.Index(fields=['user', 'created_at', 'id'], name='reservation_user_created_idx'),
+            models.Index(fields=['user', 'event'], name='reservation_user_event_idx'),
+        ]
 
 
 class Payment(models.Model):
@@ -43,6 +209,23 @@ class Payment(models.Model):
     ], default='pending')
     payment_method = models.CharField(max_length=50)
     transaction_id = models.CharField(max_length=100, blank=True, null=True)
+    # Coda dei pagamenti su database (tickets.payments): i worker prendono i
+    # 'pending' con next_attempt_at scaduto; durante la chiamata al gateway
+    # next_attempt_at è la scadenza del lease del worker
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.CharField(max_length=200, blank=True)
+    # Notifica dell'esito (POST JSON firmato) al posto del polling
+    callback_url = models.URLField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at'], condition=models.Q(status='pending'),
+                name='payment_pending_due_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"Pagamento {self.id} - {self.amount}€"
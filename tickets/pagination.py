@@ -0,0 +1,193 @@
+"""Paginazione keyset per gli endpoint di lista.
+
+A differenza di LIMIT/OFFSET, ogni pagina viene letta con una condizione
+``(a, b) > (ultimo_a, ultimo_b)`` sull'ordinamento stabile della view: con un
+indice composito sugli stessi campi il costo di una pagina non dipende da
+quanto in profondità si trova. Il cursore è opaco (JSON in base64) e contiene
+i valori della chiave dell'ultima riga e la direzione.
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .models import Event, Reservation
+from .search import SearchResults
+
+
+class KeysetPagination(BasePagination):
+    model = None
+    ordering = ('id',)
+    page_size = getattr(settings, 'API_PAGE_SIZE', 20)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 100)
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Cursore non valido'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        position, reverse = self._start(request)
+        rows = self.fetch(queryset, position, reverse, self.page_size + 1)
+        return self._finish(rows, position, reverse)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """Come `paginate_queryset`, con l'ORM asincrono"""
+        position, reverse = self._start(request)
+        rows = await self.afetch(queryset, position, reverse, self.page_size + 1)
+        return self._finish(rows, position, reverse)
+
+    def _start(self, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        return self.decode_cursor(request)
+
+    def _finish(self, rows, position, reverse):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        # Si arriva a una pagina all'indietro solo da una pagina successiva
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else position is not None
+        self.page = rows
+        return rows
+
+    def fetch(self, queryset, position, reverse, limit):
+        """Le prime `limit` righe dopo `position` (prima, se `reverse`), in ordine di lettura"""
+        return list(self._window(queryset, position, reverse)[:limit])
+
+    async def afetch(self, queryset, position, reverse, limit):
+        return [row async for row in self._window(queryset, position, reverse)[:limit]]
+
+    def _window(self, queryset, position, reverse):
+        ordering = [f'-{field}' if reverse else field for field in self.ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(position, reverse))
+        return queryset
+
+    def cursor_values(self, row):
+        return [getattr(row, field) for field in self.ordering]
+
+    def parse_position(self, values):
+        if len(values) != len(self.ordering):
+            raise ValueError
+        return [
+            self.model._meta.get_field(field).to_python(value)
+            for field, value in zip(self.ordering, values)
+        ]
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self._link(self.page[0], reverse=True)
+
+    def _link(self, row, reverse):
+        url = self.request.build_absolute_uri()
+        cursor = self.encode_cursor(self.cursor_values(row), reverse)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def _after(self, position, reverse):
+        """Condizione keyset: righe strettamente dopo `position` nell'ordinamento"""
+        lookup = 'lt' if reverse else 'gt'
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            equal = {f: value for f, value in zip(self.ordering[:i], position[:i])}
+            condition |= Q(**equal, **{f'{field}__{lookup}': position[i]})
+        return condition
+
+    def encode_cursor(self, values, reverse):
+        # isoformat completo: DjangoJSONEncoder troncherebbe i microsecondi
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        payload = json.dumps({'p': values, 'r': reverse})
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            return self.parse_position(payload['p']), bool(payload['r'])
+        except (ValueError, TypeError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class EventKeysetPagination(KeysetPagination):
+    model = Event
+    ordering = ('date', 'id')
+
+
+class ReservationKeysetPagination(KeysetPagination):
+    model = Reservation
+    ordering = ('created_at', 'id')
+
+
+class EventSearchPagination(EventKeysetPagination):
+    """Come EventKeysetPagination, ma i risultati di una ricerca full-text
+    sono ordinati e paginati per (rilevanza decrescente, id)"""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.ranked = isinstance(queryset, SearchResults)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.ranked = isinstance(queryset, SearchResults)
+        return await super().apaginate_queryset(queryset, request, view)
+
+    def fetch(self, queryset, position, reverse, limit):
+        if self.ranked:
+            return queryset.page(position, reverse, limit)
+        return super().fetch(queryset, position, reverse, limit)
+
+    async def afetch(self, queryset, position, reverse, limit):
+        if self.ranked:
+            return await queryset.apage(position, reverse, limit)
+        return await super().afetch(queryset, position, reverse, limit)
+
+    def cursor_values(self, row):
+        if self.ranked:
+            return [row.rank, row.id]
+        return super().cursor_values(row)
+
+    def parse_position(self, values):
+        if self.ranked:
+            rank, pk = values
+            return [float(rank), int(pk)]
+        return super().parse_position(values)
@@ -0,0 +1,439 @@
+"""Pipeline asincrona dei pagamenti.
+
+La POST su /api/payments/ conferma la prenotazione, salva il pagamento come
+'pending' e risponde subito 202: la chiamata al gateway la fa un pool di
+worker (thread del processo web, avviati alla prima richiesta con
+``PAYMENTS['WORKERS_IN_PROCESS']``, o il comando ``process_payments``) che usa
+la tabella dei pagamenti come coda.
+
+Un worker sceglie i pagamenti con ``next_attempt_at`` scaduto (``SELECT ...
+FOR UPDATE SKIP LOCKED`` su PostgreSQL) e li reclama con un UPDATE
+condizionale su ``attempts``. L'UPDATE sposta ``next_attempt_at`` alla
+scadenza del lease: se il worker muore, il pagamento torna disponibile dopo
+``LEASE`` secondi. Gli errori del gateway (timeout compresi) vengono ritentati
+con backoff esponenziale fino a ``MAX_ATTEMPTS`` tentativi, il rifiuto del
+pagamento è definitivo. Un circuit breaker per processo sospende le chiamate
+dopo ``BREAKER_THRESHOLD`` errori consecutivi e rimanda i pagamenti senza
+consumare tentativi. Il gateway riceve sempre lo stesso riferimento per
+pagamento, così un retry dopo un timeout non addebita due volte.
+
+L'esito si legge con il polling su /api/payments/<id>/ oppure arriva con una
+POST firmata (HMAC-SHA256 della SECRET_KEY) su ``callback_url``: solo https,
+verso gli host di ``CALLBACK_HOSTS`` se configurati, altrimenti verso
+indirizzi pubblici (controllati alla creazione e di nuovo prima dell'invio),
+senza seguire i redirect.
+"""
+import hashlib
+import hmac
+import ipaddress
+import logging
+import random
+import socket
+import threading
+import time
+import urllib.parse
+import urllib.request
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.http.request import validate_host
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.renderers import JSONRenderer
+
+from . import sales
+from .models import Payment, Reservation
+from .services import AllocationStats, hold_expiry
+
+logger = logging.getLogger(__name__)
+
+
+def _config(key, default=None):
+    return getattr(settings, 'PAYMENTS', {}).get(key, default)
+
+
+class GatewayError(Exception):
+    """Errore transitorio del gateway: il pagamento viene ritentato"""
+
+
+class GatewayTimeout(GatewayError):
+    """Il gateway non ha risposto entro il timeout"""
+
+
+class PaymentDeclined(Exception):
+    """Rifiuto definitivo del pagamento: nessun retry"""
+
+
+class PaymentStats(AllocationStats):
+    """Contatori thread-safe sugli esiti della pipeline dei pagamenti"""
+
+    FIELDS = ('enqueued', 'completed', 'declined', 'failed', 'retried', 'deferred',
+              'breaker_opened', 'callbacks', 'callback_errors')
+
+
+payment_stats = PaymentStats()
+
+
+class BaseGateway:
+    """Interfaccia degli adapter verso il processore di pagamento"""
+
+    def charge(self, reference, amount, method, timeout):
+        """Addebita `amount` e restituisce l'id della transazione.
+
+        Un secondo addebito con lo stesso `reference` deve restituire la
+        transazione già creata. Solleva ``PaymentDeclined`` o ``GatewayError``.
+        """
+        raise NotImplementedError
+
+
+class FakeGateway(BaseGateway):
+    """Gateway locale per sviluppo e benchmark: latenza e tassi d'errore configurabili"""
+
+    def __init__(self, latency_ms=200, jitter_ms=50, failure_rate=0.0, decline_rate=0.0,
+                 seed=None, **options):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.failure_rate = failure_rate
+        self.decline_rate = decline_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._charges = {}
+
+    def charge(self, reference, amount, method, timeout):
+        with self._lock:
+            latency = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            roll = self._random.random()
+        if latency > timeout:
+            time.sleep(timeout)
+            raise GatewayTimeout(f"Nessuna risposta dal gateway entro {timeout}s")
+        time.sleep(latency)
+        if roll < self.failure_rate:
+            raise GatewayError("Gateway non disponibile")
+        if roll < self.failure_rate + self.decline_rate:
+            raise PaymentDeclined("Pagamento rifiutato dal circuito")
+        with self._lock:
+            return self._charges.setdefault(reference, f'FAKE{len(self._charges) + 1:08d}')
+
+
+class CircuitBreaker:
+    """Circuit breaker thread-safe sul gateway.
+
+    Si apre dopo `threshold` errori consecutivi; trascorsi `reset_timeout`
+    secondi lascia passare una sola chiamata di prova, che lo richiude se va a
+    buon fine e lo riapre altrimenti.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            return 'half-open' if self._retry_after() == 0 else 'open'
+
+    def _retry_after(self):
+        if self._opened_at is None:
+            return 0
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def retry_after(self):
+        """Secondi mancanti alla prossima chiamata di prova (0 se chiuso)"""
+        with self._lock:
+            return self._retry_after()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or self._retry_after() > 0:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or (self._opened_at is None and self._failures >= self.threshold):
+                self._opened_at = time.monotonic()
+                self._trial = False
+                payment_stats.incr('breaker_opened')
+
+
+_gateway = None
+_breaker = None
+_singleton_lock = threading.Lock()
+
+
+def get_gateway():
+    global _gateway
+    if _gateway is None:
+        with _singleton_lock:
+            if _gateway is None:
+                gateway_class = import_string(_config('GATEWAY', 'tickets.payments.FakeGateway'))
+                _gateway = gateway_class(**_config('GATEWAY_OPTIONS', {}))
+    return _gateway
+
+
+def get_breaker():
+    global _breaker
+    if _breaker is None:
+        with _singleton_lock:
+            if _breaker is None:
+                _breaker = CircuitBreaker(_config('BREAKER_THRESHOLD', 5), _config('BREAKER_RESET', 30))
+    return _breaker
+
+
+def enqueued(payment):
+    """Da chiamare dopo il salvataggio di un pagamento 'pending': sveglia i worker al commit"""
+    payment_stats.incr('enqueued')
+    if _config('WORKERS_IN_PROCESS'):
+        transaction.on_commit(lambda: start_workers().wake())
+
+
+def backoff(attempts):
+    """Attesa prima del tentativo successivo al numero `attempts`, con jitter"""
+    delay = min(_config('BACKOFF_MAX', 60), _config('BACKOFF_BASE', 1) * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1)
+
+
+def claim_payments(limit):
+    """Reclama fino a `limit` pagamenti da elaborare e restituisce quelli ottenuti"""
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=_config('LEASE', 60))
+    with transaction.atomic():
+        candidates = list(
+            Payment.objects.filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at')
+            .select_for_update(skip_locked=True)
+            .values_list('pk', 'attempts')[:limit]
+        )
+        # L'UPDATE condizionale esclude i pagamenti reclamati nel frattempo
+        # da un altro worker (dove SKIP LOCKED non esiste)
+        claimed = [
+            pk for pk, attempts in candidates
+            if Payment.objects.filter(
+                pk=pk, status='pending', attempts=attempts, next_attempt_at__lte=now
+            ).update(attempts=attempts + 1, next_attempt_at=lease_until)
+        ]
+    return list(Payment.objects.filter(pk__in=claimed).order_by('next_attempt_at', 'pk'))
+
+
+def process_payment(payment, gateway=None, breaker=None):
+    """Una chiamata al gateway per un pagamento reclamato.
+
+    Restituisce 'completed', 'declined', 'failed', 'retried', 'deferred'
+    (circuit breaker aperto) o None se il lease era scaduto e il pagamento
+    è passato a un altro worker.
+    """
+    gateway = gateway or get_gateway()
+    breaker = breaker or get_breaker()
+    claimed = Payment.objects.filter(pk=payment.pk, status='pending', attempts=payment.attempts)
+
+    if not breaker.allow():
+        # Anche a breaker semiaperto (prova in corso) si rimanda di almeno un intervallo
+        delay = max(breaker.retry_after(), _config('POLL_INTERVAL', 1))
+        claimed.update(attempts=F('attempts') - 1, next_attempt_at=timezone.now() + timedelta(seconds=delay))
+        payment_stats.incr('deferred')
+        return 'deferred'
+
+    try:
+        transaction_id = gateway.charge(
+            f'PAY{payment.pk}', payment.amount, payment.payment_method, _config('TIMEOUT', 5)
+        )
+    except PaymentDeclined as exc:
+        breaker.record_success()
+        return _finish(payment, 'failed', error=str(exc), outcome='declined')
+    except GatewayError as exc:
+        breaker.record_failure()
+        if payment.attempts >= _config('MAX_ATTEMPTS', 5):
+            return _finish(payment, 'failed', error=str(exc), outcome='failed')
+        now = timezone.now()
+        if not claimed.update(next_attempt_at=now + timedelta(seconds=backoff(payment.attempts)),
+                              last_error=str(exc)[:200], updated_at=now):
+            return None
+        payment_stats.incr('retried')
+        return 'retried'
+
+    breaker.record_success()
+    return _finish(payment, 'completed', transaction_id=transaction_id, outcome='completed')
+
+
+def _finish(payment, status, transaction_id=None, error='', outcome=None):
+    with transaction.atomic():
+        updated = Payment.objects.filter(
+            pk=payment.pk, status='pending', attempts=payment.attempts
+        ).update(status=status, transaction_id=transaction_id, last_error=error[:200],
+                 next_attempt_at=None, updated_at=timezone.now())
+        if not updated:
+            return None
+        event_id, organizer_id, seats, confirmed = Reservation.objects.filter(
+            pk=payment.reservation_id
+        ).values_list('event_id', 'event__organizer_id', 'seats', 'is_confirmed').get()
+        changes = [sales.payment_delta('pending', payment.amount, -1), sales.payment_delta(status, payment.amount)]
+        if status == 'failed' and confirmed:
+            changes.append({'seats_sold': -seats})
+        sales.record([((event_id, organizer_id), delta) for delta in changes])
+        if status == 'failed':
+            # La prenotazione torna in attesa di pagamento: il cliente può
+            # riprovare entro il TTL, poi la sweep recupera i posti
+            Reservation.objects.filter(pk=payment.reservation_id).update(
+                is_confirmed=False, expires_at=hold_expiry()
+            )
+        if payment.callback_url:
+            transaction.on_commit(lambda: notify(payment.pk))
+    payment_stats.incr(outcome)
+    return outcome
+
+
+def check_callback_url(url):
+    """Solleva ValueError se `url` non è un https verso un host consentito o pubblico"""
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme != 'https' or not parts.hostname:
+        raise ValueError("L'URL di callback deve essere https.")
+    allowed = _config('CALLBACK_HOSTS')
+    if allowed is not None:
+        if not validate_host(parts.hostname, allowed):
+            raise ValueError("Host di callback non consentito.")
+        return
+    try:
+        addresses = socket.getaddrinfo(parts.hostname, parts.port or 443, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError) as exc:
+        raise ValueError("Host di callback non risolvibile.") from exc
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        # Niente reti private, loopback, link-local (metadati cloud), riservate
+        if not address.is_global:
+            raise ValueError("L'URL di callback punta a un indirizzo privato o locale.")
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Un redirect porterebbe la POST verso un host mai controllato
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def notify(payment_id):
+    """POST dell'esito su ``callback_url``; un errore viene registrato e non ritentato"""
+    from .serializers import PaymentSerializer
+
+    payment = Payment.objects.get(pk=payment_id)
+    body = JSONRenderer().render(PaymentSerializer(payment).data)
+    signature = hmac.new(settings.SECRET_KEY.encode(), body, hashlib.sha256).hexdigest()
+    request = urllib.request.Request(payment.callback_url, data=body, method='POST', headers={
+        'Content-Type': 'application/json', 'X-Signature': f'sha256={signature}',
+    })
+    try:
+        # Di nuovo: il DNS dell'host può essere cambiato dalla creazione
+        check_callback_url(payment.callback_url)
+        _opener.open(request, timeout=_config('CALLBACK_TIMEOUT', 5)).close()
+    except (OSError, ValueError):
+        logger.warning("Callback del pagamento %s fallita", payment_id, exc_info=True)
+        payment_stats.incr('callback_errors')
+    else:
+        payment_stats.incr('callbacks')
+
+
+class PaymentWorker(threading.Thread):
+    def __init__(self, pool, index):
+        super().__init__(name=f'payment-worker-{index}', daemon=True)
+        self.pool = pool
+
+    def run(self):
+        pool = self.pool
+        while not pool.stopped.is_set():
+            batch = []
+            close_old_connections()
+            try:
+                if pool.breaker.state != 'open':
+                    batch = claim_payments(pool.batch_size)
+                for payment in batch:
+                    process_payment(payment, pool.gateway, pool.breaker)
+            except Exception:
+                logger.exception("Elaborazione dei pagamenti fallita")
+            finally:
+                close_old_connections()
+            if not batch:
+                pool.wait()
+
+
+class PaymentWorkerPool:
+    """Pool di thread che svuota la coda dei pagamenti.
+
+    Senza lavoro ogni worker attende `poll_interval` secondi o un `wake()`
+    (nuovo pagamento accodato nello stesso processo).
+    """
+
+    def __init__(self, workers, batch_size=10, poll_interval=1, gateway=None, breaker=None):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.gateway = gateway or get_gateway()
+        self.breaker = breaker or get_breaker()
+        self.stopped = threading.Event()
+        self._wake = threading.Event()
+        self.threads = [PaymentWorker(self, i) for i in range(workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def wait(self):
+        timeout = self.poll_interval
+        if self.breaker.state == 'open':
+            timeout = max(timeout, self.breaker.retry_after())
+        if self._wake.wait(timeout):
+            self._wake.clear()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self.stopped.set()
+        self._wake.set()
+        for thread in self.threads:
+            thread.join()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def start_workers():
+    """Avvia (una sola volta per processo) il pool di worker in-process"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PaymentWorkerPool(
+                _config('WORKERS', 4), _config('BATCH_SIZE', 10), _config('POLL_INTERVAL', 1)
+            ).start()
+    return _pool
+
+
+def metrics():
+    pending = Payment.objects.filter(status='pending')
+    return {
+        **payment_stats.snapshot(),
+        'pending': pending.count(),
+        'due': pending.filter(next_attempt_at__lte=timezone.now()).count(),
+        'breaker': get_breaker().state,
+    }
@@ -1,9 +1,27 @@
+import hmac
+
+from django.conf import settings
 from rest_framework import permissions
 
+from .instrumentation import is_staff
+
 
 class IsOrganizerOrAdmin(permissions.BasePermission):
     """Permesso personalizzato per permettere solo all'organizzatore o all'admin di modificare"""
 
     def has_object_permission(self, request, view, obj):
-        # Permetti solo se l'utente è staff o è l'organizzatore dell'evento
-        return request.user.is_staff or obj.organizer == request.user
+        # Permetti solo se l'utente è staff o è l'organizzatore dell'evento.
+        # Confronto per id: vale anche per gli utenti stateless (users.authentication)
+        return request.user.is_staff or obj.organizer_id == request.user.pk
+
+
+class CanReadMetrics(permissions.BasePermission):
+    """Accesso a /metrics: token ``INSTRUMENTATION['METRICS_TOKEN']`` (per lo scraper
+    Prometheus, ``Authorization: Bearer <token>``) oppure utente staff"""
+
+    def has_permission(self, request, view):
+        token = getattr(settings, 'INSTRUMENTATION', {}).get('METRICS_TOKEN')
+        header = request.headers.get('Authorization', '')
+        if token and header.startswith('Bearer '):
+            return hmac.compare_digest(header[len('Bearer '):].encode(), token.encode())
+        return is_staff(request._request)
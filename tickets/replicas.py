@@ -0,0 +1,219 @@
+"""Letture sulle repliche del database.
+
+Le view di sola lettura con ``ReplicaReadMixin`` eseguono le query delle GET
+su una replica (``DATABASE_REPLICA_URLS``, alias ``replica_*``), scelta una
+volta per richiesta dopo l'autenticazione; tutto il resto, comprese le
+letture dentro una transazione aperta su default, va sul primario.
+
+Read-your-writes: dopo una scrittura riuscita (``ReplicaPinMiddleware``)
+l'utente legge dal primario per ``REPLICAS['STICKY_SECONDS']``. Il vincolo
+viaggia in un cookie firmato e, per i client che non conservano i cookie,
+in una voce di cache per utente. Le repliche in ritardo di oltre
+``MAX_LAG`` secondi o non raggiungibili vengono escluse; senza repliche
+utilizzabili si legge dal primario.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils.module_loading import import_string
+
+from django_project.database import REPLICA_PREFIX
+from .services import AllocationStats
+
+SAFE_METHODS = ('GET', 'HEAD')
+PIN_SALT = 'tickets.replicas.pin'
+
+# Replica scelta per la richiesta (o il task asincrono) in corso, None = primario
+_replica = ContextVar('replica', default=None)
+
+# Ritardo di una replica PostgreSQL in secondi; 0 se ha già applicato tutto
+# il WAL ricevuto (una replica senza scritture recenti non è in ritardo)
+PG_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+
+def _config(key, default=None):
+    return getattr(settings, 'REPLICAS', {}).get(key, default)
+
+
+class ReplicaStats(AllocationStats):
+    """Contatori thread-safe sulle richieste con letture instradabili alle repliche"""
+
+    FIELDS = ('replica_requests', 'pinned_requests', 'lag_fallbacks', 'lag_checks')
+
+
+replica_stats = ReplicaStats()
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith(REPLICA_PREFIX)]
+
+
+def replication_lag(alias):
+    """Ritardo della replica `alias` in secondi (funzione di default di ``LAG_FUNCTION``).
+
+    Fuori da PostgreSQL le repliche (per esempio copie SQLite) si considerano
+    allineate; un errore di connessione si propaga.
+    """
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        if connection.vendor != 'postgresql':
+            cursor.execute('SELECT 1')
+            return 0.0
+        cursor.execute(PG_LAG_SQL)
+        lag = cursor.fetchone()[0]
+    return float(lag or 0)
+
+
+class LagMonitor:
+    """Ritardo delle repliche, misurato al più ogni ``LAG_CHECK_INTERVAL`` secondi per processo"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lags = {}
+
+    def lag(self, alias):
+        """Ultimo ritardo misurato, None se la replica non risponde"""
+        now = time.monotonic()
+        with self._lock:
+            checked = self._lags.get(alias)
+            if checked is not None and now - checked[0] < _config('LAG_CHECK_INTERVAL', 5):
+                return checked[1]
+            # Gli altri thread usano il valore precedente mentre questo misura
+            self._lags[alias] = (now, checked[1] if checked else 0.0)
+        replica_stats.incr('lag_checks')
+        try:
+            lag = import_string(_config('LAG_FUNCTION', 'tickets.replicas.replication_lag'))(alias)
+        except DatabaseError:
+            lag = None
+        with self._lock:
+            self._lags[alias] = (now, lag)
+        return lag
+
+    def available(self):
+        max_lag = _config('MAX_LAG', 2)
+        return [alias for alias in replica_aliases()
+                if (lag := self.lag(alias)) is not None and lag <= max_lag]
+
+    def snapshot(self):
+        with self._lock:
+            return {alias: lag for alias, (_, lag) in self._lags.items()}
+
+    def reset(self):
+        with self._lock:
+            self._lags.clear()
+
+
+lag_monitor = LagMonitor()
+
+
+def _pin_key(user_id):
+    return f'replicas:pin:{user_id}'
+
+
+def is_pinned(request):
+    """True se l'utente ha scritto negli ultimi STICKY_SECONDS"""
+    seconds = _config('STICKY_SECONDS', 5)
+    if not seconds:
+        return False
+    if request.COOKIES.get(_config('PIN_COOKIE', 'db_pin')) is not None:
+        try:
+            request.get_signed_cookie(_config('PIN_COOKIE', 'db_pin'), salt=PIN_SALT, max_age=seconds)
+            return True
+        except (KeyError, signing.BadSignature):
+            pass
+    user = request.user
+    return bool(user.is_authenticated and caches[_config('PIN_CACHE', 'default')].get(_pin_key(user.pk)))
+
+
+def pin(request, response):
+    """Dopo una scrittura riuscita le letture dell'utente restano sul primario"""
+    seconds = _config('STICKY_SECONDS', 5)
+    if not seconds or request.method in SAFE_METHODS or response.status_code >= 400 or not replica_aliases():
+        return
+    response.set_signed_cookie(
+        _config('PIN_COOKIE', 'db_pin'), '1', salt=PIN_SALT, max_age=seconds, httponly=True, samesite='Lax'
+    )
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        caches[_config('PIN_CACHE', 'default')].set(_pin_key(user.pk), 1, seconds)
+
+
+def choose_replica(request):
+    """Replica per le letture della richiesta già autenticata, None per il primario"""
+    if request.method not in SAFE_METHODS or not replica_aliases():
+        return None
+    if is_pinned(request):
+        replica_stats.incr('pinned_requests')
+        return None
+    available = lag_monitor.available()
+    if not available:
+        replica_stats.incr('lag_fallbacks')
+        return None
+    replica_stats.incr('replica_requests')
+    return random.choice(available)
+
+
+@contextmanager
+def reading_from(alias):
+    """Le letture eseguite nel blocco vanno alla replica `alias` (None: primario)"""
+    token = _replica.set(alias)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+class ReplicaRouter:
+    """Router per ``settings.DATABASE_ROUTERS``"""
+
+    def db_for_read(self, model, **hints):
+        alias = _replica.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Repliche e primario contengono gli stessi dati
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Le repliche ricevono lo schema dalla replica del primario
+        return not db.startswith(REPLICA_PREFIX)
+
+
+class ReplicaReadMixin:
+    """Le query delle GET/HEAD della view vanno a una replica.
+
+    Autenticazione e permessi leggono dal primario (un utente appena
+    registrato potrebbe non essere ancora sulle repliche).
+    """
+    read_from_replica = True
+
+    def dispatch(self, request, *args, **kwargs):
+        with reading_from(None):
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Vale fino alla fine di dispatch(), che ripristina il valore precedente
+        _replica.set(choose_replica(request))
+
+
+def metrics():
+    return {**replica_stats.snapshot(), 'lag': lag_monitor.snapshot(),
+            'replicas': replica_aliases(), 'sticky_seconds': _config('STICKY_SECONDS', 5)}
@@ -0,0 +1,173 @@
+"""Cache delle risposte pubbliche sugli eventi (lista, dettaglio, ricerca).
+
+Le chiavi contengono un numero di generazione: ogni scrittura su un evento
+(modifica, cancellazione o variazione dei posti da prenotazioni, rilasci e
+sweep) incrementa la generazione dell'evento e quella globale delle liste
+dopo il commit, così le risposte precedenti non vengono più lette. Il
+``TIMEOUT`` di ``settings.RESPONSE_CACHE`` limita comunque l'età di una
+risposta: è il ritardo massimo con cui si vede una scrittura che non passa da
+qui (SQL manuale, o un altro processo quando il backend è locmem).
+
+Il backend è la cache Django indicata da ``ALIAS`` (locmem in sviluppo,
+Redis in produzione). Si mette in cache ``response.data``, non il corpo
+renderizzato, per rispettare la negoziazione del formato.
+"""
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+from .services import AllocationStats
+
+LIST_GENERATION = 'gen:events'
+CACHED_HEADERS = ('ETag', 'Last-Modified')
+
+
+class ResponseCacheStats(AllocationStats):
+    """Contatori thread-safe su hit, miss e invalidazioni della cache"""
+
+    FIELDS = ('hits', 'misses', 'stores', 'invalidations')
+
+
+cache_stats = ResponseCacheStats()
+
+
+def _config(key, default):
+    return getattr(settings, 'RESPONSE_CACHE', {}).get(key, default)
+
+
+def enabled():
+    return _config('ENABLED', True)
+
+
+def get_cache():
+    return caches[_config('ALIAS', 'default')]
+
+
+def _key(*parts):
+    return ':'.join([_config('KEY_PREFIX', 'responses'), *map(str, parts)])
+
+
+def _event_generation(pk):
+    return f'gen:event:{pk}'
+
+
+def _generation_key(pk):
+    return _key(_event_generation(pk) if pk is not None else LIST_GENERATION)
+
+
+def response_key(request, scope, pk=None):
+    """Chiave della risposta: scope, generazione e parametri normalizzati"""
+    current = get_cache().get(_generation_key(pk), 0)
+    return _response_key(request, scope, pk, current)
+
+
+async def aresponse_key(request, scope, pk=None):
+    current = await get_cache().aget(_generation_key(pk), 0)
+    return _response_key(request, scope, pk, current)
+
+
+def _response_key(request, scope, pk, current):
+    params = urlencode(sorted(
+        (name, value) for name, values in request.query_params.lists() for value in values
+    ))
+    # L'host entra nella chiave perché i link di paginazione sono assoluti
+    digest = hashlib.md5(f'{request.get_host()}?{params}'.encode()).hexdigest()
+    return _key(scope, pk if pk is not None else '', current, digest)
+
+
+def lookup(key):
+    entry = get_cache().get(key)
+    cache_stats.incr('hits' if entry is not None else 'misses')
+    return entry
+
+
+async def alookup(key):
+    entry = await get_cache().aget(key)
+    cache_stats.incr('hits' if entry is not None else 'misses')
+    return entry
+
+
+def _entry(response, data):
+    headers = {name: response[name] for name in CACHED_HEADERS if name in response}
+    return response.status_code, data, headers
+
+
+def store(key, response):
+    get_cache().set(key, _entry(response, response.data), _config('TIMEOUT', 30))
+    cache_stats.incr('stores')
+
+
+async def astore(key, response, data):
+    """Come `store`, per le risposte già renderizzate del percorso asincrono"""
+    await get_cache().aset(key, _entry(response, data), _config('TIMEOUT', 30))
+    cache_stats.incr('stores')
+
+
+def _bump(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def _invalidate(event_ids):
+    for pk in event_ids:
+        _bump(_key(_event_generation(pk)))
+    _bump(_key(LIST_GENERATION))
+    cache_stats.incr('invalidations')
+
+
+def invalidate_events(*event_ids):
+    """Invalida dettaglio degli eventi e liste, alla conferma della transazione"""
+    transaction.on_commit(lambda: _invalidate(event_ids))
+
+
+def event_changed(sender, instance, **kwargs):
+    invalidate_events(instance.pk)
+
+
+def seats_changed(sender, deltas, **kwargs):
+    invalidate_events(*deltas)
+
+
+def metrics():
+    return {
+        'enabled': enabled(),
+        'timeout': _config('TIMEOUT', 30),
+        **cache_stats.snapshot(),
+    }
+
+
+class CachedResponseMixin:
+    """Serve le GET della view dalla cache delle risposte.
+
+    `cache_scope` distingue le view; per le view di dettaglio la chiave usa la
+    generazione dell'evento in ``kwargs['pk']`` invece di quella delle liste.
+    """
+    cache_scope = None
+
+    def get(self, request, *args, **kwargs):
+        if not enabled():
+            return super().get(request, *args, **kwargs)
+
+        # La generazione si legge prima della query: una scrittura concorrente
+        # la incrementa e la risposta salvata qui non verrà più servita
+        key = response_key(request, self.cache_scope, kwargs.get('pk'))
+        entry = lookup(key)
+        if entry is not None:
+            status, data, headers = entry
+            response = Response(data, status=status, headers=headers)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            store(key, response)
+        response['X-Cache'] = 'MISS'
+        return response
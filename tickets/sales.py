@@ -0,0 +1,229 @@
+"""Statistiche di vendita per evento e per organizzatore.
+
+``EventSales`` e ``OrganizerSales`` tengono prenotazioni, posti prenotati e
+venduti, pagamenti per stato e importi (incassato, in attesa, rimborsato):
+``/api/organizer/stats/`` li legge senza unire prenotazioni e pagamenti di
+tutti gli eventi dell'organizzatore.
+
+Ogni scrittura che li cambia chiama `record` nella propria transazione con
+le variazioni per (evento, organizzatore): creazione e cancellazione delle
+prenotazioni, sweep delle prenotazioni scadute, conferma, creazione ed esito
+dei pagamenti. Come per il calendario (``tickets.availability``) le
+variazioni si applicano dopo il commit, in una transazione propria: la riga
+dell'organizzatore è condivisa da tutti i suoi eventi e bloccarla dentro la
+transazione dell'allocazione serializzerebbe di nuovo le vendite, shard
+compresi. Quella transazione blocca solo righe delle statistiche, in ordine
+fisso (prima gli eventi, poi gli organizzatori, per chiave), e non va in
+deadlock con le altre.
+
+Le righe di ``EventSales`` nascono con l'evento (o dalla migrazione e da
+``rebuild_sales_stats``) e le variazioni le aggiornano soltanto: quelle di un
+evento già eliminato si scartano, anche per l'organizzatore. Un crash tra il
+commit e l'incremento, le eliminazioni che non passano da queste funzioni
+(utenti eliminati con le loro prenotazioni, admin, ``bulk_create``) lasciano
+differenze che ``rebuild_sales_stats`` corregge ricalcolando a blocchi.
+"""
+import random
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from .models import Event, EventSales, OrganizerSales, Payment, Reservation
+
+# Importo di ogni stato del pagamento (i falliti non ne hanno)
+AMOUNTS = {'pending': 'amount_pending', 'completed': 'revenue', 'refunded': 'amount_refunded'}
+
+
+def reservation_delta(seats, confirmed, sign=1):
+    delta = {'reservations': sign, 'seats_reserved': sign * seats}
+    if confirmed:
+        delta['seats_sold'] = sign * seats
+    return delta
+
+
+def payment_delta(status, amount, sign=1):
+    delta = {f'payments_{status}': sign}
+    if status in AMOUNTS:
+        delta[AMOUNTS[status]] = sign * amount
+    return delta
+
+
+def _increment(model, changes, **lookup):
+    rows = model.objects.filter(**lookup)
+    increments = {field: F(field) + value for field, value in changes.items()}
+    if rows.update(**increments, updated_at=timezone.now()):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **changes)
+    except IntegrityError:
+        # Creata nel frattempo da un'altra transazione
+        rows.update(**increments, updated_at=timezone.now())
+
+
+def _apply(events, organizers, create, attempts=5):
+    for attempt in range(attempts):
+        try:
+            return _update(events, organizers, create)
+        except OperationalError:
+            # Contesa sul lock (database is locked su SQLite): nulla è stato applicato
+            if attempt == attempts - 1:
+                raise
+            time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+
+
+def _update(events, organizers, create):
+    totals = defaultdict(lambda: defaultdict(int))
+    for organizer_id, delta in organizers.items():
+        for field, value in delta.items():
+            totals[organizer_id][field] += value
+    with transaction.atomic():
+        for event_id, (organizer_id, delta) in sorted(events.items()):
+            increments = {field: F(field) + value for field, value in delta.items()}
+            if not EventSales.objects.filter(event_id=event_id).update(**increments, updated_at=timezone.now()):
+                continue
+            for field, value in delta.items():
+                totals[organizer_id][field] += value
+        for organizer_id in sorted(totals):
+            changed = {field: value for field, value in totals[organizer_id].items() if value}
+            if changed and create:
+                _increment(OrganizerSales, changed, organizer_id=organizer_id)
+            elif changed:
+                OrganizerSales.objects.filter(organizer_id=organizer_id).update(
+                    **{field: F(field) + value for field, value in changed.items()}, updated_at=timezone.now()
+                )
+
+
+def _schedule(events, organizers=None, create=True):
+    if events or organizers:
+        # robust: le statistiche non devono far fallire chi ha già fatto commit
+        transaction.on_commit(lambda: _apply(events, organizers or {}, create), robust=True)
+
+
+def record(changes):
+    """Variazioni ``[((event_id, organizer_id), {contatore: delta}), ...]``, applicate dopo il commit.
+
+    Va chiamata dentro la transazione della scrittura che le produce.
+    """
+    events = {}
+    for (event_id, organizer_id), delta in changes:
+        totals = events.setdefault(event_id, (organizer_id, defaultdict(int)))[1]
+        for field, value in delta.items():
+            totals[field] += value
+    _schedule({
+        event_id: (organizer_id, {field: value for field, value in delta.items() if value})
+        for event_id, (organizer_id, delta) in events.items() if any(delta.values())
+    })
+
+
+def reserved(reservations):
+    """Prenotazioni appena create (con l'evento caricato)"""
+    record([((r.event_id, r.event.organizer_id), reservation_delta(r.seats, r.is_confirmed))
+            for r in reservations])
+
+
+def released(reservation_ids):
+    """Da chiamare prima del DELETE delle prenotazioni: toglie loro e i loro pagamenti.
+
+    Le righe vengono bloccate: un pagamento che si conclude nel frattempo
+    aspetta il commit e non trova più la prenotazione.
+    """
+    reservations = Reservation.objects.select_for_update(of=('self',)).filter(pk__in=reservation_ids)
+    changes = [
+        ((event_id, organizer_id), reservation_delta(seats, confirmed, -1))
+        for event_id, organizer_id, seats, confirmed in reservations.values_list(
+            'event_id', 'event__organizer_id', 'seats', 'is_confirmed'
+        )
+    ]
+    payments = Payment.objects.select_for_update(of=('self',)).filter(reservation_id__in=reservation_ids)
+    changes += [
+        ((event_id, organizer_id), payment_delta(status, amount, -1))
+        for event_id, organizer_id, status, amount in payments.values_list(
+            'reservation__event_id', 'reservation__event__organizer_id', 'status', 'amount'
+        )
+    ]
+    record(changes)
+
+
+def event_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        # Riga nuova, nessuna contesa: si crea subito, così le variazioni la trovano
+        EventSales.objects.create(event_id=instance.pk)
+        _schedule({}, {instance.organizer_id: {'events': 1}})
+
+
+def event_deleting(sender, instance, **kwargs):
+    """Toglie all'organizzatore l'evento eliminato con tutti i suoi contatori"""
+    # Il lock ferma le variazioni in corso: dopo il commit non trovano più la riga
+    sales = EventSales.objects.select_for_update().filter(event_id=instance.pk).first()
+    delta = {field: -getattr(sales, field) for field in EventSales.COUNTERS} if sales else {}
+    # Senza creare la riga: l'organizzatore potrebbe essere stato eliminato con l'evento
+    _schedule({}, {instance.organizer_id: {**delta, 'events': -1}}, create=False)
+
+
+def rebuild_events(event_ids):
+    """Ricalcola i contatori degli eventi `event_ids` dalle prenotazioni e dai pagamenti.
+
+    Le variazioni delle transazioni concluse ma non ancora applicate durante
+    il ricalcolo possono essere contate due volte: va eseguito a traffico basso.
+    """
+    with transaction.atomic():
+        EventSales.objects.bulk_create([EventSales(event_id=pk) for pk in event_ids], ignore_conflicts=True)
+        # Le scritture concorrenti aspettano il commit e si sommano al ricalcolo
+        rows = {row.pk: row for row in EventSales.objects.select_for_update().filter(
+            event_id__in=event_ids).order_by('event_id')}
+        for row in rows.values():
+            for field in EventSales.COUNTERS:
+                setattr(row, field, 0)
+        for values in Reservation.objects.filter(event_id__in=event_ids).values('event_id').annotate(
+            reservations=Count('pk'), seats_reserved=Sum('seats'),
+            seats_sold=Sum('seats', filter=Q(is_confirmed=True)),
+        ):
+            row = rows[values.pop('event_id')]
+            for field, value in values.items():
+                setattr(row, field, value or 0)
+        for event_id, status, count, amount in Payment.objects.filter(
+            reservation__event_id__in=event_ids
+        ).values('reservation__event_id', 'status').annotate(
+            count=Count('pk'), amount=Sum('amount')
+        ).values_list('reservation__event_id', 'status', 'count', 'amount'):
+            setattr(rows[event_id], f'payments_{status}', count)
+            if status in AMOUNTS:
+                setattr(rows[event_id], AMOUNTS[status], amount or Decimal(0))
+        now = timezone.now()
+        for row in rows.values():
+            row.updated_at = now
+        EventSales.objects.bulk_update(rows.values(), [*EventSales.COUNTERS, 'updated_at'])
+    return len(rows)
+
+
+def rebuild_organizers(organizer_ids):
+    """Ricalcola i contatori degli organizzatori come somma di quelli dei loro eventi"""
+    with transaction.atomic():
+        OrganizerSales.objects.bulk_create(
+            [OrganizerSales(organizer_id=pk) for pk in organizer_ids], ignore_conflicts=True
+        )
+        rows = {row.pk: row for row in OrganizerSales.objects.select_for_update().filter(
+            organizer_id__in=organizer_ids).order_by('organizer_id')}
+        totals = {
+            values.pop('event__organizer_id'): values
+            for values in EventSales.objects.filter(event__organizer_id__in=organizer_ids).values(
+                'event__organizer_id'
+            ).annotate(total_events=Count('pk'), **{f'total_{field}': Sum(field) for field in EventSales.COUNTERS})
+        }
+        now = timezone.now()
+        for pk, row in rows.items():
+            values = totals.get(pk, {})
+            for field in OrganizerSales.COUNTERS:
+                setattr(row, field, values.get(f'total_{field}') or 0)
+            row.updated_at = now
+        OrganizerSales.objects.bulk_update(rows.values(), [*OrganizerSales.COUNTERS, 'updated_at'])
+    return len(rows)
+
+
+def organizers_of(event_ids):
+    return set(Event.objects.filter(pk__in=event_ids).values_list('organizer_id', flat=True))
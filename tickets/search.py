@@ -0,0 +1,232 @@
+"""Ricerca full-text sugli eventi.
+
+Su PostgreSQL la ricerca usa la colonna ``Event.search_vector`` (tsvector
+mantenuto da un trigger, con indice GIN): titolo, luogo e descrizione pesano
+rispettivamente A, B e C, i termini sono in AND e ognuno vale come prefisso
+(``concer`` trova ``concerto``). Sugli altri database (SQLite in sviluppo) si
+usa un indice invertito in memoria con la stessa semantica, aggiornato dai
+segnali di salvataggio degli eventi alla conferma della transazione.
+
+Entrambi i backend restituiscono un ``SearchResults`` ordinato per rilevanza
+decrescente e id, paginabile per keyset da ``EventSearchPagination``.
+"""
+import bisect
+import re
+import threading
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection, transaction
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
+from django.utils.module_loading import import_string
+
+from .models import Event
+
+WORD_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return WORD_RE.findall((text or '').lower())
+
+
+class SearchResults:
+    """Risultati ordinati per (rank decrescente, id) con accesso per keyset"""
+
+    def page(self, position, reverse, limit):
+        raise NotImplementedError
+
+    async def apage(self, position, reverse, limit):
+        raise NotImplementedError
+
+
+class QuerySetResults(SearchResults):
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+    def page(self, position, reverse, limit):
+        return list(self._window(position, reverse)[:limit])
+
+    async def apage(self, position, reverse, limit):
+        return [row async for row in self._window(position, reverse)[:limit]]
+
+    def _window(self, position, reverse):
+        queryset = self.queryset.order_by(*(('rank', '-id') if reverse else ('-rank', 'id')))
+        if position is not None:
+            rank, pk = position
+            if reverse:
+                queryset = queryset.filter(Q(rank__gt=rank) | Q(rank=rank, id__lt=pk))
+            else:
+                queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, id__gt=pk))
+        return queryset
+
+
+class RankedIdResults(SearchResults):
+    def __init__(self, ranked, queryset):
+        # Chiavi (-rank, id): l'ordine crescente è quello di pagina
+        self.keys = sorted((-score, pk) for pk, score in ranked.items())
+        self.queryset = queryset
+
+    def page(self, position, reverse, limit):
+        keys = self._keys(position, reverse, limit)
+        return self._rows(keys, self.queryset.in_bulk([pk for _, pk in keys]))
+
+    async def apage(self, position, reverse, limit):
+        keys = self._keys(position, reverse, limit)
+        return self._rows(keys, await self.queryset.ain_bulk([pk for _, pk in keys]))
+
+    def _keys(self, position, reverse, limit):
+        if position is None:
+            return self.keys[:limit]
+        if reverse:
+            end = bisect.bisect_left(self.keys, (-position[0], position[1]))
+            return self.keys[max(0, end - limit):end][::-1]
+        start = bisect.bisect_right(self.keys, (-position[0], position[1]))
+        return self.keys[start:start + limit]
+
+    @staticmethod
+    def _rows(keys, events):
+        rows = []
+        for negative_rank, pk in keys:
+            event = events.get(pk)
+            if event is not None:
+                event.rank = -negative_rank
+                rows.append(event)
+        return rows
+
+
+class PostgresSearchBackend:
+    def search(self, queryset, term, since=None):
+        terms = tokenize(term)
+        if not terms:
+            return QuerySetResults(queryset.none())
+        query = SearchQuery(
+            ' & '.join(f'{word}:*' for word in terms), search_type='raw', config='simple'
+        )
+        # ts_rank è real (float4): in float8 il valore letto, messo nel cursore e
+        # riconfrontato con rank=/rank__lt è esattamente quello della colonna
+        return QuerySetResults(queryset.filter(search_vector=query).annotate(
+            rank=Cast(SearchRank(F('search_vector'), query), FloatField())
+        ))
+
+
+class InvertedIndexSearchBackend:
+    """Indice invertito in memoria di processo, costruito alla prima ricerca"""
+
+    WEIGHTS = {'title': 1.0, 'location': 0.4, 'description': 0.2}
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._postings = {}     # token -> {event_id: peso}
+        self._documents = {}    # event_id -> (data, token indicizzati)
+        self._vocabulary = []   # token ordinati, per la ricerca per prefisso
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            rows = Event.objects.values_list(
+                'id', 'date', *self.WEIGHTS
+            ).iterator(chunk_size=2000)
+            for pk, date, *texts in rows:
+                self._add(pk, date, dict(zip(self.WEIGHTS, texts)))
+            self._vocabulary = sorted(self._postings)
+            self._loaded = True
+
+    def _add(self, pk, date, texts):
+        weights = {}
+        for field, weight in self.WEIGHTS.items():
+            for token in tokenize(texts[field]):
+                weights[token] = weights.get(token, 0) + weight
+        for token, weight in weights.items():
+            self._postings.setdefault(token, {})[pk] = weight
+        self._documents[pk] = (date, tuple(weights))
+
+    def _remove(self, pk):
+        _, tokens = self._documents.pop(pk, (None, ()))
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(pk, None)
+                if not postings:
+                    del self._postings[token]
+                    index = bisect.bisect_left(self._vocabulary, token)
+                    if index < len(self._vocabulary) and self._vocabulary[index] == token:
+                        del self._vocabulary[index]
+
+    def index_event(self, event):
+        if not self._loaded:
+            return
+        with self._lock:
+            self._remove(event.pk)
+            self._add(event.pk, event.date, {field: getattr(event, field) for field in self.WEIGHTS})
+            for token in self._documents[event.pk][1]:
+                index = bisect.bisect_left(self._vocabulary, token)
+                if index == len(self._vocabulary) or self._vocabulary[index] != token:
+                    self._vocabulary.insert(index, token)
+
+    def remove_event(self, pk):
+        if not self._loaded:
+            return
+        with self._lock:
+            self._remove(pk)
+
+    def _expand(self, prefix):
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        for token in self._vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            yield token
+
+    def search(self, queryset, term, since=None):
+        self._ensure_loaded()
+        scores = None
+        with self._lock:
+            for word in tokenize(term):
+                matched = {}
+                for token in self._expand(word):
+                    for pk, weight in self._postings[token].items():
+                        matched[pk] = matched.get(pk, 0) + weight
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = {pk: scores[pk] + matched[pk] for pk in scores.keys() & matched.keys()}
+            if scores and since is not None:
+                scores = {pk: score for pk, score in scores.items() if self._documents[pk][0] >= since}
+        return RankedIdResults(scores or {}, queryset)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                path = getattr(settings, 'EVENT_SEARCH_BACKEND', None)
+                if path:
+                    _backend = import_string(path)()
+                elif connection.vendor == 'postgresql':
+                    _backend = PostgresSearchBackend()
+                else:
+                    _backend = InvertedIndexSearchBackend()
+    return _backend
+
+
+def event_saved(sender, instance, **kwargs):
+    backend = get_backend()
+    if isinstance(backend, InvertedIndexSearchBackend):
+        # Solo a transazione confermata: un rollback non deve lasciare tracce nell'indice
+        transaction.on_commit(lambda: backend.index_event(instance))
+
+
+def event_deleted(sender, instance, **kwargs):
+    backend = get_backend()
+    if isinstance(backend, InvertedIndexSearchBackend):
+        pk = instance.pk
+        transaction.on_commit(lambda: backend.remove_event(pk))
@@ -1,5 +1,8 @@
+from datetime import timedelta
+
 from rest_framework import serializers
-from .models import Event, Reservation, Payment
+from . import availability, payments
+from .models import AvailabilityRollup, Event, EventSales, OrganizerSales, Reservation, Payment
 from users.models import CustomUser
 from django.utils import timezone
 
@@ -11,12 +14,12 @@ class EventSerializer(serializers.ModelSerializer):
         default=serializers.CurrentUserDefault()
     )
     is_past = serializers.SerializerMethodField()
-    available_seats = serializers.IntegerField(read_only=True)
+    available_seats = serializers.IntegerField(source='remaining_seats', read_only=True)
 
     class Meta:
         model = Event
-        fields = '__all__'
-        read_only_fields = ('organizer', 'created_at')
+        exclude = ('search_vector',)
+        read_only_fields = ('organizer', 'created_at', 'seat_shard_count')
 
     def get_is_past(self, obj):
         return obj.date < timezone.now()
@@ -40,6 +43,13 @@ class EventSerializer(serializers.ModelSerializer):
         validated_data['available_seats'] = validated_data['total_seats']
         return super().create(validated_data)
 
+    def update(self, instance, validated_data):
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        # Solo i campi modificati: i posti disponibili sono aggiornati dai servizi
+        instance.save(update_fields=list(validated_data))
+        return instance
+
 
 class ReservationSerializer(serializers.ModelSerializer):
     user = serializers.SlugRelatedField(
@@ -55,15 +65,16 @@ class ReservationSerializer(serializers.ModelSerializer):
         model = Reservation
         fields = (
             'id', 'event', 'event_details', 'user', 'seats',
-            'created_at', 'is_confirmed', 'can_cancel'
+            'created_at', 'is_confirmed', 'expires_at', 'can_cancel'
         )
-        read_only_fields = ('user', 'created_at', 'is_confirmed')
+        read_only_fields = ('user', 'created_at', 'is_confirmed', 'expires_at')
 
     def get_can_cancel(self, obj):
         request = self.context.get('request')
+        # Confronto per id: non serve caricare l'utente della prenotazione
         return (
                 request and
-                request.user == obj.user and
+                request.user.pk == obj.user_id and
                 obj.event.date > timezone.now()
         )
 
@@ -78,7 +89,7 @@ class ReservationSerializer(serializers.ModelSerializer):
                 {"seats": "Il numero di posti deve essere positivo."}
             )
 
-        if data['seats'] > data['event'].available_seats:
+        if data['seats'] > data['event'].remaining_seats:
             raise serializers.ValidationError(
                 {"seats": "Posti disponibili insufficienti."}
             )
@@ -86,20 +97,116 @@ class ReservationSerializer(serializers.ModelSerializer):
         return data
 
 
+class ReservationBatchItemSerializer(serializers.Serializer):
+    event = serializers.IntegerField()
+    seats = serializers.IntegerField(min_value=1)
+
+
+class ReservationBatchSerializer(serializers.Serializer):
+    """Batch di prenotazioni su uno o più eventi.
+
+    La validazione carica tutti gli eventi con una sola query; gli elementi
+    non validi finiscono in `item_errors` (indice -> errori) invece di
+    interrompere il batch, così la modalità best-effort può scartarli.
+    """
+    MODE_CHOICES = ('all_or_nothing', 'best_effort')
+
+    mode = serializers.ChoiceField(choices=MODE_CHOICES, default='all_or_nothing')
+    items = serializers.ListField(
+        child=ReservationBatchItemSerializer(), min_length=1, max_length=100
+    )
+
+    def validate(self, data):
+        events = Event.objects.in_bulk({item['event'] for item in data['items']})
+        now = timezone.now()
+        valid, errors = [], {}
+        for index, item in enumerate(data['items']):
+            event = events.get(item['event'])
+            if event is None:
+                errors[index] = {"event": "Evento inesistente."}
+            elif event.date < now:
+                errors[index] = {"event": "Non è possibile prenotare per un evento passato."}
+            else:
+                valid.append((index, event, item['seats']))
+
+        if errors and data['mode'] == 'all_or_nothing':
+            raise serializers.ValidationError({'items': errors})
+        data['valid_items'] = valid
+        data['item_errors'] = errors
+        return data
+
+
 class EventAvailabilitySerializer(serializers.Serializer):
     date_from = serializers.DateTimeField(required=True)
     date_to = serializers.DateTimeField(required=True)
+    granularity = serializers.ChoiceField(choices=AvailabilityRollup.GRANULARITIES, default='day')
 
     def validate(self, data):
         if data['date_from'] > data['date_to']:
             raise serializers.ValidationError(
                 "La data di inizio deve essere precedente alla data di fine."
             )
+        days = availability.max_days(data['granularity'])
+        if data['date_to'] - data['date_from'] > timedelta(days=days):
+            raise serializers.ValidationError(
+                f"L'intervallo non può superare {days} giorni con questa granularità."
+            )
         return data
 
 
+class AvailabilityRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AvailabilityRollup
+        fields = ['bucket', 'events', 'total_seats', 'remaining_seats']
+
+
+class ExportFilterSerializer(serializers.Serializer):
+    event = serializers.IntegerField(required=False)
+    organizer = serializers.IntegerField(required=False)
+    date_from = serializers.DateTimeField(required=False)
+    date_to = serializers.DateTimeField(required=False)
+    output = serializers.ChoiceField(choices=['csv', 'ndjson'], default='csv')
+
+    def validate(self, data):
+        if 'date_from' in data and 'date_to' in data and data['date_from'] > data['date_to']:
+            raise serializers.ValidationError(
+                "La data di inizio deve essere precedente alla data di fine."
+            )
+        return data
+
+
+class EventSalesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = EventSales
+        fields = [*EventSales.COUNTERS, 'updated_at']
+
+
+class OrganizerSalesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrganizerSales
+        fields = [*OrganizerSales.COUNTERS, 'updated_at']
+
+
+class OrganizerEventSalesSerializer(serializers.ModelSerializer):
+    sales = EventSalesSerializer(read_only=True)
+
+    class Meta:
+        model = Event
+        fields = ['id', 'title', 'date', 'total_seats', 'price', 'sales']
+
+
 class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Payment
-        fields = ['id', 'reservation', 'amount', 'payment_date', 'status', 'payment_method']
-        read_only_fields = ['id', 'payment_date', 'status']
+        fields = ['id', 'reservation', 'amount', 'payment_date', 'status', 'payment_method',
+                  'transaction_id', 'attempts', 'last_error', 'callback_url', 'updated_at']
+        read_only_fields = ['id', 'payment_date', 'status', 'transaction_id', 'attempts',
+                            'last_error', 'updated_at']
+
+    def validate_callback_url(self, value):
+        if value:
+            try:
+                payments.check_callback_url(value)
+            except ValueError as exc:
+                raise serializers.ValidationError(str(exc))
+        return value
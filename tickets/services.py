@@ -0,0 +1,390 @@
+"""Servizi di dominio per l'allocazione dei posti degli eventi.
+
+L'allocazione usa un singolo UPDATE condizionale
+(``available_seats >= seats``) dentro ``transaction.atomic``: il database
+applica il decremento solo se ci sono ancora posti, quindi non serve leggere
+il contatore prima di scriverlo e non si può mai andare in overbooking.
+Gli errori di serializzazione/deadlock (o ``database is locked`` su SQLite)
+vengono ritentati con backoff esponenziale e jitter.
+
+Per gli eventi ad alta domanda l'inventario può essere distribuito su N righe
+``EventSeatShard`` (``Event.seat_shard_count > 0``): ogni prenotazione prova gli
+shard in ordine casuale, così i writer si spartiscono lock diversi. In questa
+modalità ``Event.available_seats`` resta a 0 e il valore esposto è la somma
+degli shard (``Event.remaining_seats`` / ``EventQuerySet.with_availability``).
+"""
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.models import F, Q, Sum, Count, Case, When
+from django.dispatch import Signal
+from django.utils import timezone
+
+from . import sales
+from .models import Event, EventSeatShard, Reservation
+
+logger = logging.getLogger(__name__)
+
+# Inviato dentro la transazione che cambia i posti liberi di uno o più eventi
+# (argomento `deltas`: {event_id: variazione}); gli UPDATE condizionali non
+# passano da post_save
+seats_changed = Signal()
+
+
+class SeatsUnavailable(Exception):
+    """Sollevata quando l'evento non ha abbastanza posti disponibili"""
+
+
+class AllocationFailed(Exception):
+    """Sollevata quando i retry sono esauriti per contesa sul database"""
+
+
+class BatchRejected(Exception):
+    """Sollevata quando un batch tutto-o-niente non può essere evaso per intero"""
+
+    def __init__(self, outcome):
+        super().__init__(outcome)
+        self.outcome = outcome
+
+
+class AllocationStats:
+    """Contatori thread-safe sugli esiti delle allocazioni"""
+
+    FIELDS = ('allocated', 'released', 'rejected', 'retries', 'failed')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = dict.fromkeys(self.FIELDS, 0)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+allocation_stats = AllocationStats()
+
+
+class HoldStats(AllocationStats):
+    """Contatori thread-safe sulle sweep delle prenotazioni scadute"""
+
+    FIELDS = ('sweeps', 'holds_expired', 'seats_reclaimed', 'last_sweep_seats')
+
+    def record_sweep(self, holds, seats):
+        with self._lock:
+            self._counters['sweeps'] += 1
+            self._counters['holds_expired'] += holds
+            self._counters['seats_reclaimed'] += seats
+            self._counters['last_sweep_seats'] = seats
+
+
+hold_stats = HoldStats()
+
+
+def _config(key, default):
+    return getattr(settings, 'SEAT_ALLOCATION', {}).get(key, default)
+
+
+def _backoff(attempt):
+    base = _config('BACKOFF_BASE', 0.01)
+    cap = _config('BACKOFF_MAX', 0.5)
+    # Full jitter: evita che i retry si risincronizzino sullo stesso lock
+    time.sleep(random.uniform(0, min(cap, base * (2 ** attempt))))
+
+
+def _run_with_retry(operation):
+    """Esegue `operation` in una transazione, ritentando sugli errori di contesa"""
+    max_retries = _config('MAX_RETRIES', 5)
+    for attempt in range(max_retries + 1):
+        try:
+            with transaction.atomic():
+                return operation()
+        except OperationalError as exc:
+            if attempt == max_retries:
+                allocation_stats.incr('failed')
+                logger.warning("Allocazione fallita dopo %d tentativi: %s", attempt + 1, exc)
+                raise AllocationFailed(str(exc)) from exc
+            allocation_stats.incr('retries')
+            _backoff(attempt)
+
+
+def _stamp(**changes):
+    """Valori di un UPDATE dei posti più l'incremento di versione (ETag)"""
+    return {**changes, 'version': F('version') + 1, 'updated_at': timezone.now()}
+
+
+def _decrement_event(event_id, seats):
+    updated = Event.objects.filter(
+        pk=event_id, available_seats__gte=seats
+    ).update(**_stamp(available_seats=F('available_seats') - seats))
+    if not updated:
+        raise SeatsUnavailable(event_id)
+    seats_changed.send(sender=Event, deltas={event_id: -seats})
+
+
+def _decrement_shards(event_id, shard_count, seats):
+    # Percorso veloce: un solo shard con abbastanza posti, scelto a caso
+    for index in random.sample(range(shard_count), shard_count):
+        if EventSeatShard.objects.filter(
+            event_id=event_id, index=index, available_seats__gte=seats
+        ).update(**_stamp(available_seats=F('available_seats') - seats)):
+            seats_changed.send(sender=Event, deltas={event_id: -seats})
+            return
+
+    # Nessuno shard basta da solo: si preleva da più shard bloccandoli in ordine
+    shards = list(
+        EventSeatShard.objects.select_for_update()
+        .filter(event_id=event_id, available_seats__gt=0)
+        .order_by('index')
+    )
+    if sum(shard.available_seats for shard in shards) < seats:
+        raise SeatsUnavailable(event_id)
+    remaining = seats
+    for shard in shards:
+        take = min(remaining, shard.available_seats)
+        EventSeatShard.objects.filter(pk=shard.pk).update(
+            **_stamp(available_seats=F('available_seats') - take)
+        )
+        remaining -= take
+        if not remaining:
+            break
+    seats_changed.send(sender=Event, deltas={event_id: -seats})
+
+
+def _increment(event, seats):
+    seats_changed.send(sender=Event, deltas={event.pk: seats})
+    if event.seat_shard_count:
+        updated = EventSeatShard.objects.filter(
+            event_id=event.pk, index=random.randrange(event.seat_shard_count)
+        ).update(**_stamp(available_seats=F('available_seats') + seats))
+        if updated:
+            return
+    Event.objects.filter(pk=event.pk).update(
+        **_stamp(available_seats=F('available_seats') + seats)
+    )
+
+
+def allocate_seats(event, seats, commit=None):
+    """Decrementa atomicamente i posti dell'evento.
+
+    `commit`, se fornito, viene eseguito nella stessa transazione dopo il
+    decremento (es. il salvataggio della prenotazione) e il suo risultato
+    viene restituito. Solleva ``SeatsUnavailable`` se i posti non bastano.
+    """
+    def operation():
+        if event.seat_shard_count:
+            _decrement_shards(event.pk, event.seat_shard_count, seats)
+        else:
+            _decrement_event(event.pk, seats)
+        return commit() if commit else None
+
+    try:
+        result = _run_with_retry(operation)
+    except SeatsUnavailable:
+        allocation_stats.incr('rejected')
+        logger.info("Prenotazione rifiutata: evento %s senza %d posti liberi", event.pk, seats)
+        raise
+    allocation_stats.incr('allocated', seats)
+    return result
+
+
+def release_seats(event, seats, commit=None):
+    """Restituisce i posti all'evento, eseguendo `commit` nella stessa transazione"""
+    def operation():
+        _increment(event, seats)
+        return commit() if commit else None
+
+    result = _run_with_retry(operation)
+    allocation_stats.incr('released', seats)
+    return result
+
+
+def allocate_batch(user, items, all_or_nothing=True):
+    """Alloca più prenotazioni, anche su eventi diversi, in un'unica transazione.
+
+    `items` è una lista di coppie (evento, posti) già validate. Le righe degli
+    eventi vengono bloccate in ordine di id per evitare deadlock tra batch
+    concorrenti; i decrementi si applicano con un solo UPDATE e le prenotazioni
+    con un solo ``bulk_create``. Restituisce, per ogni elemento, la
+    ``Reservation`` creata o None se rifiutata; in modalità tutto-o-niente un
+    rifiuto annulla l'intero batch con ``BatchRejected``.
+    """
+    event_ids = sorted({event.pk for event, _ in items})
+    expires_at = hold_expiry()
+
+    def operation():
+        locked = {
+            event.pk: event for event in
+            Event.objects.select_for_update().filter(pk__in=event_ids).order_by('pk')
+        }
+        remaining = {pk: event.available_seats for pk, event in locked.items()}
+        decrements = defaultdict(int)
+        outcome = [None] * len(items)
+
+        for i, (event, seats) in enumerate(items):
+            current = locked.get(event.pk)
+            if current is None:
+                continue
+            if current.seat_shard_count:
+                try:
+                    _decrement_shards(current.pk, current.seat_shard_count, seats)
+                except SeatsUnavailable:
+                    continue
+            elif remaining[current.pk] >= seats:
+                remaining[current.pk] -= seats
+                decrements[current.pk] += seats
+            else:
+                continue
+            outcome[i] = Reservation(
+                user=user, event=current, seats=seats, is_confirmed=False, expires_at=expires_at
+            )
+
+        if all_or_nothing and None in outcome:
+            raise BatchRejected(outcome)
+        if decrements:
+            Event.objects.filter(pk__in=decrements).update(**_stamp(available_seats=Case(*[
+                When(pk=pk, then=F('available_seats') - seats) for pk, seats in decrements.items()
+            ])))
+            seats_changed.send(sender=Event, deltas={pk: -seats for pk, seats in decrements.items()})
+        created = Reservation.objects.bulk_create([r for r in outcome if r is not None])
+        sales.reserved(created)
+        return outcome
+
+    try:
+        outcome = _run_with_retry(operation)
+    except BatchRejected as exc:
+        allocation_stats.incr('rejected', exc.outcome.count(None))
+        raise
+    allocation_stats.incr('allocated', sum(r.seats for r in outcome if r is not None))
+    allocation_stats.incr('rejected', outcome.count(None))
+    return outcome
+
+
+def adjust_capacity(event, difference):
+    """Applica una variazione di `total_seats` ai posti disponibili"""
+    if difference >= 0:
+        _increment(event, difference)
+    elif event.seat_shard_count:
+        _decrement_shards(event.pk, event.seat_shard_count, -difference)
+    else:
+        _decrement_event(event.pk, -difference)
+
+
+@transaction.atomic
+def set_shard_count(event, shard_count):
+    """Attiva (N > 0) o disattiva (0) l'inventario sharded per un evento.
+
+    I posti residui vengono ridistribuiti in modo uniforme sui nuovi shard o
+    riportati sul contatore dell'evento.
+    """
+    event = Event.objects.select_for_update().get(pk=event.pk)
+    shards = EventSeatShard.objects.select_for_update().filter(event=event)
+    available = event.available_seats + sum(shard.available_seats for shard in shards)
+    EventSeatShard.objects.filter(event=event).delete()
+
+    if shard_count:
+        base, extra = divmod(available, shard_count)
+        EventSeatShard.objects.bulk_create(
+            EventSeatShard(event=event, index=i, available_seats=base + (1 if i < extra else 0))
+            for i in range(shard_count)
+        )
+        available = 0
+    Event.objects.filter(pk=event.pk).update(
+        **_stamp(available_seats=available, seat_shard_count=shard_count)
+    )
+    seats_changed.send(sender=Event, deltas={event.pk: 0})
+    event.refresh_from_db()
+    return event
+
+
+def _hold_config(key, default):
+    return getattr(settings, 'RESERVATION_HOLDS', {}).get(key, default)
+
+
+def hold_expiry():
+    """Scadenza di una nuova prenotazione non ancora pagata"""
+    return timezone.now() + timedelta(seconds=_hold_config('TTL', 600))
+
+
+def active_holds():
+    """Prenotazioni non confermate e non ancora scadute"""
+    return Reservation.objects.filter(is_confirmed=False).filter(
+        Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now())
+    )
+
+
+def confirm_hold(reservation):
+    """Conferma la prenotazione se non è scaduta; False se scaduta o già rilasciata.
+
+    L'UPDATE condizionale compete con la sweep sulla stessa riga: vince chi
+    arriva prima e l'altro non trova più la riga nello stato atteso.
+    """
+    if active_holds().filter(pk=reservation.pk).update(is_confirmed=True, expires_at=None):
+        reservation.is_confirmed, reservation.expires_at = True, None
+        sales.record([((reservation.event_id, reservation.event.organizer_id), {'seats_sold': reservation.seats})])
+        return True
+    return Reservation.objects.filter(pk=reservation.pk, is_confirmed=True).exists()
+
+
+def sweep_expired_holds(batch_size=None):
+    """Rilascia le prenotazioni scadute con un DELETE e un UPDATE dei posti per evento.
+
+    Per ogni evento si trattano al più `batch_size` prenotazioni.
+    Le righe già bloccate (es. da un pagamento in corso) vengono saltate
+    e riconsiderate alla sweep successiva.
+    Restituisce il numero di prenotazioni e di posti recuperati.
+    """
+    batch_size = batch_size or _hold_config('SWEEP_BATCH_SIZE', 1000)
+    now = timezone.now()
+    expired = Reservation.objects.filter(is_confirmed=False, expires_at__lte=now)
+    event_ids = list(expired.values_list('event_id', flat=True).distinct())
+    events = Event.objects.in_bulk(event_ids)
+
+    total_holds = total_seats = 0
+    for event_id in event_ids:
+        def operation():
+            holds = list(
+                expired.filter(event_id=event_id)
+                .select_for_update(skip_locked=True)
+                .values_list('pk', 'seats')[:batch_size]
+            )
+            if not holds:
+                return 0, 0
+            seats = sum(s for _, s in holds)
+            ids = [pk for pk, _ in holds]
+            sales.released(ids)
+            Reservation.objects.filter(pk__in=ids).delete()
+            _increment(events[event_id], seats)
+            return len(holds), seats
+
+        holds, seats = _run_with_retry(operation)
+        total_holds += holds
+        total_seats += seats
+
+    hold_stats.record_sweep(total_holds, total_seats)
+    if total_holds:
+        logger.info("Sweep: %d prenotazioni scadute, %d posti recuperati", total_holds, total_seats)
+    return total_holds, total_seats
+
+
+def hold_metrics():
+    """Metriche sulle prenotazioni in attesa di pagamento e sulle sweep"""
+    active = active_holds().aggregate(holds=Count('pk'), seats=Sum('seats'))
+    return {
+        'active_holds': active['holds'],
+        'held_seats': active['seats'] or 0,
+        **hold_stats.snapshot(),
+    }
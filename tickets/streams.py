@@ -0,0 +1,318 @@
+"""Stream Server-Sent Events della disponibilità posti, servito dall'app ASGI.
+
+``GET /api/events/<pk>/stream/`` o ``/api/events/stream/?events=1,2,3``
+risponde con un'istantanea dei posti liberi e poi con le variazioni.
+
+Le variazioni dei posti (segnale ``services.seats_changed``) vengono
+pubblicate sul broker di ``settings.SEAT_STREAM`` dopo il commit. In ogni
+worker un ``SeatHub`` le accumula per evento e ogni ``COALESCE_MS``
+millisecondi invia agli iscritti un solo messaggio per evento, con la
+variazione cumulata e i posti correnti (una query per tutti gli eventi
+cambiati nell'intervallo).
+
+Gli stream non passano dall'app Django: sotto ASGI una richiesta che chiama
+codice sincrono (middleware, ORM) tiene occupato un thread per tutta la sua
+durata. ``SeatStreamApp`` li serve direttamente e tocca il database solo per
+l'istantanea iniziale, su un thread condiviso; una connessione inattiva costa
+un ``Subscriber`` e un future in attesa della disconnessione.
+
+Broker: ``InProcessBroker`` (scritture e stream nello stesso processo) o
+``RedisBroker`` (pub/sub su un server compatibile Redis, per più worker).
+"""
+import asyncio
+import json
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+from django.utils.module_loading import import_string
+
+from .models import Event
+
+logger = logging.getLogger(__name__)
+
+
+def _config(key, default=None):
+    return getattr(settings, 'SEAT_STREAM', {}).get(key, default)
+
+
+def _availability(event_ids):
+    close_old_connections()
+    return dict(
+        Event.objects.with_availability().filter(
+            pk__in=list(event_ids)
+        ).values_list('pk', 'current_available_seats')
+    )
+
+
+# Thread del pool condiviso, non uno per connessione
+current_availability = sync_to_async(_availability, thread_sensitive=False)
+
+
+def format_event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'.encode()
+
+
+class Subscriber:
+    """Connessione in ascolto: l'ultimo messaggio non ancora inviato per evento"""
+
+    __slots__ = ('event_ids', 'pending', 'waiter')
+
+    def __init__(self, event_ids):
+        self.event_ids = event_ids
+        self.pending = {}
+        self.waiter = None
+
+    def push(self, event_id, message):
+        previous = self.pending.get(event_id)
+        if previous is not None:
+            message = {**message, 'delta': previous['delta'] + message['delta']}
+        self.pending[event_id] = message
+        self.wake()
+
+    def wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def wait(self):
+        """Future completato al prossimo messaggio (o keepalive)"""
+        if self.waiter is None or self.waiter.done():
+            self.waiter = asyncio.get_running_loop().create_future()
+            if self.pending:
+                self.waiter.set_result(None)
+        return self.waiter
+
+    def drain(self):
+        messages, self.pending = list(self.pending.values()), {}
+        return messages
+
+
+class SeatHub:
+    """Pub/sub in processo: iscritti per evento e accorpamento delle variazioni"""
+
+    def __init__(self, interval, keepalive):
+        self.interval = interval
+        self.keepalive = keepalive
+        self._lock = threading.Lock()
+        self._deltas = defaultdict(int)        # event_id -> variazione non ancora inviata
+        self._subscribers = defaultdict(set)   # event_id -> {Subscriber}
+        self._all = set()
+        self._task = None
+
+    @property
+    def subscriber_count(self):
+        return len(self._all)
+
+    def receive(self, deltas):
+        """Accumula variazioni {event_id: delta}; chiamabile da qualsiasi thread"""
+        with self._lock:
+            for event_id, delta in deltas.items():
+                if event_id in self._subscribers:
+                    self._deltas[event_id] += delta
+
+    def subscribe(self, event_ids):
+        subscriber = Subscriber(tuple(event_ids))
+        for event_id in subscriber.event_ids:
+            self._subscribers[event_id].add(subscriber)
+        self._all.add(subscriber)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._all.discard(subscriber)
+        for event_id in subscriber.event_ids:
+            subscribers = self._subscribers.get(event_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[event_id]
+
+    async def flush(self):
+        """Invia le variazioni accumulate; restituisce il numero di messaggi consegnati"""
+        with self._lock:
+            deltas, self._deltas = self._deltas, defaultdict(int)
+        if not deltas:
+            return 0
+        available = await current_availability(deltas)
+        delivered = 0
+        for event_id, delta in deltas.items():
+            message = {'event': event_id, 'delta': delta, 'available_seats': available.get(event_id)}
+            for subscriber in self._subscribers.get(event_id, ()):
+                subscriber.push(event_id, message)
+                delivered += 1
+        return delivered
+
+    async def _run(self):
+        listener = get_broker().start(self)
+        last_keepalive = time.monotonic()
+        try:
+            while self._all:
+                await asyncio.sleep(self.interval)
+                try:
+                    await self.flush()
+                except Exception:
+                    logger.exception("Invio delle variazioni dei posti fallito")
+                if time.monotonic() - last_keepalive >= self.keepalive:
+                    # Senza messaggi in attesa lo stream invia un commento di keepalive
+                    for subscriber in self._all:
+                        subscriber.wake()
+                    last_keepalive = time.monotonic()
+        finally:
+            if listener is not None:
+                listener.cancel()
+
+
+class InProcessBroker:
+    """Consegna le variazioni al hub dello stesso processo"""
+
+    def __init__(self, **options):
+        pass
+
+    def publish(self, deltas):
+        get_hub().receive(deltas)
+
+    def start(self, hub):
+        return None
+
+
+class RedisBroker:
+    """Pub/sub su un server compatibile Redis: ogni worker riceve tutte le variazioni"""
+
+    def __init__(self, url='redis://localhost:6379/0', channel='seats', **options):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured("RedisBroker richiede il pacchetto 'redis'")
+        self.url = url
+        self.channel = channel
+        self.client = redis.Redis.from_url(url)
+
+    def publish(self, deltas):
+        self.client.publish(self.channel, json.dumps(deltas))
+
+    def start(self, hub):
+        return asyncio.get_running_loop().create_task(self._listen(hub))
+
+    async def _listen(self, hub):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        async with client.pubsub() as pubsub:
+            await pubsub.subscribe(self.channel)
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    hub.receive({int(pk): delta for pk, delta in json.loads(message['data']).items()})
+
+
+_hub = None
+_broker = None
+_lock = threading.Lock()
+
+
+def get_hub():
+    global _hub
+    if _hub is None:
+        with _lock:
+            if _hub is None:
+                _hub = SeatHub(_config('COALESCE_MS', 250) / 1000, _config('KEEPALIVE', 15))
+    return _hub
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _lock:
+            if _broker is None:
+                broker_class = import_string(_config('BROKER', 'tickets.streams.InProcessBroker'))
+                _broker = broker_class(**_config('OPTIONS', {}))
+    return _broker
+
+
+def seats_changed(sender, deltas, **kwargs):
+    # robust: un broker irraggiungibile non deve far fallire la prenotazione
+    transaction.on_commit(lambda: get_broker().publish(deltas), robust=True)
+
+
+class SeatStreamApp:
+    """App ASGI che serve gli stream e passa tutte le altre richieste a `app`"""
+
+    PATH_RE = re.compile(r'^/api/events/(?:(?P<pk>\d+)/)?stream/$')
+    HEADERS = [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),  # niente buffering sui proxy nginx
+        (b'access-control-allow-origin', b'*'),
+    ]
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        match = self.PATH_RE.match(scope['path']) if scope['type'] == 'http' else None
+        if match is None:
+            return await self.app(scope, receive, send)
+        if scope['method'] != 'GET':
+            return await self._error(send, 405, "Metodo non consentito")
+
+        event_ids = self._event_ids(match, scope)
+        max_events = _config('MAX_EVENTS', 50)
+        if not event_ids or len(event_ids) > max_events:
+            return await self._error(send, 400, f"Indica da 1 a {max_events} id di eventi")
+
+        hub = get_hub()
+        # Iscrizione prima dell'istantanea: nessuna variazione va persa nel mezzo
+        subscriber = hub.subscribe(event_ids)
+        try:
+            snapshot = await current_availability(event_ids)
+            if not snapshot:
+                return await self._error(send, 404, "Evento non trovato")
+            await send({'type': 'http.response.start', 'status': 200, 'headers': self.HEADERS})
+            await send({'type': 'http.response.body', 'more_body': True, 'body': format_event(
+                'snapshot', [{'event': pk, 'available_seats': seats} for pk, seats in snapshot.items()]
+            )})
+            await self._stream(subscriber, receive, send)
+        finally:
+            hub.unsubscribe(subscriber)
+
+    async def _stream(self, subscriber, receive, send):
+        disconnect = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            while True:
+                await asyncio.wait({subscriber.wait(), disconnect}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnect.done():
+                    return
+                messages = subscriber.drain()
+                body = format_event('seats', messages) if messages else b': keepalive\n\n'
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        finally:
+            disconnect.cancel()
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    @staticmethod
+    def _event_ids(match, scope):
+        if match['pk']:
+            return [int(match['pk'])]
+        values = parse_qs(scope.get('query_string', b'').decode()).get('events', [''])[0]
+        try:
+            return sorted({int(value) for value in values.split(',') if value})
+        except ValueError:
+            return []
+
+    @staticmethod
+    async def _error(send, status, message):
+        body = json.dumps({'error': message}).encode()
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': body})
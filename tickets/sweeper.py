@@ -0,0 +1,47 @@
+"""Scheduler in-process per la sweep periodica delle prenotazioni scadute.
+
+Alternativa al comando ``sweep_holds`` lanciato da cron: si attiva con
+``RESERVATION_HOLDS['SWEEP_IN_PROCESS'] = True`` e gira in un thread daemon
+del worker.
+"""
+import logging
+import threading
+
+from django.db import close_old_connections
+
+from .services import sweep_expired_holds
+
+logger = logging.getLogger(__name__)
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+class HoldSweeper(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(name='hold-sweeper', daemon=True)
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            close_old_connections()
+            try:
+                sweep_expired_holds()
+            except Exception:
+                logger.exception("Sweep delle prenotazioni scadute fallita")
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def start_sweeper(interval):
+    """Avvia (una sola volta per processo) il thread di sweep"""
+    global _sweeper
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = HoldSweeper(interval)
+            _sweeper.start()
+    return _sweeper
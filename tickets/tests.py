@@ -1,3 +1,676 @@
-from django.test import TestCase
+from contextlib import ExitStack
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from tickets import admission, idempotency, payments, replicas, search
+from tickets.models import Event, EventSeatShard, Payment, Reservation
+from tickets.serializers import PaymentSerializer
+from tickets.services import (
+    AllocationFailed, SeatsUnavailable, allocate_seats, confirm_hold, release_seats, set_shard_count, sweep_expired_holds,
+)
+
+REPLICA = 'replica_0'
+
+# Numero massimo di query SQL per endpoint, indipendente dal numero di righe
+QUERY_BUDGETS = {
+    'event-list': 1,
+    'event-search': 1,
+    'event-detail': 1,
+    'my-reservations': 2,
+    'event-availability': 1,
+}
+
+
+def lagging_replica(alias):
+    """LAG_FUNCTION che dichiara ogni replica in ritardo"""
+    return 3600.0
+
+
+def make_event(organizer, seats=10, **fields):
+    """Evento futuro con `seats` posti liberi"""
+    return Event.objects.create(**{
+        'title': 'Evento', 'description': 'Test', 'location': 'Test',
+        'date': timezone.now() + timedelta(days=10), 'total_seats': seats, 'available_seats': seats,
+        'organizer': organizer, **fields,
+    })
+
+
+# Si misura il percorso senza cache delle risposte, con tutte le letture sul primario
+@override_settings(
+    RESPONSE_CACHE={**settings.RESPONSE_CACHE, 'ENABLED': False},
+    REPLICAS={**settings.REPLICAS, 'LAG_FUNCTION': 'tickets.tests.lagging_replica'},
+)
+class QueryBudgetTests(TestCase):
+    """Ogni endpoint di lista esegue un numero fisso di query, qualunque sia il numero di righe"""
+
+    def test_endpoints_within_budget(self):
+        for size in (3, 30):
+            for name, (client, url) in self._requests(size).items():
+                with self.subTest(endpoint=name, rows=size):
+                    with self.assertNumQueries(QUERY_BUDGETS[name]):
+                        response = client.get(url)
+                    self.assertEqual(response.status_code, 200)
+
+    def _requests(self, size):
+        User = get_user_model()
+        # Indice di ricerca, calendario e statistiche si aggiornano dopo il commit
+        with self.captureOnCommitCallbacks(execute=True):
+            Event.objects.all().delete()
+            buyer = User.objects.create_user(f'budget-buyer-{size}', f'budget-buyer-{size}@example.com')
+            events = []
+            for i in range(size):
+                # Un organizzatore diverso per evento: fa emergere le N+1 sull'organizer
+                organizer = User.objects.create_user(
+                    f'budget-org-{size}-{i}', f'budget-org-{size}-{i}@example.com'
+                )
+                events.append(Event.objects.create(
+                    title=f'Evento {i}', description='Budget', location='Budget',
+                    date=timezone.now() + timedelta(days=i + 1), total_seats=10,
+                    available_seats=8, organizer=organizer,
+                ))
+                Reservation.objects.create(user=buyer, event=events[-1], seats=2, is_confirmed=True)
+
+        # L'indice di ricerca in memoria si costruisce una volta per processo
+        search.get_backend().search(Event.objects.none(), 'budget')
+
+        anonymous = APIClient()
+        client = APIClient()
+        client.force_authenticate(buyer)
+        return {
+            'event-list': (anonymous, reverse('event-list')),
+            'event-search': (anonymous, reverse('event-search') + '?search=Budget'),
+            'event-detail': (anonymous, reverse('event-detail', args=[events[0].pk])),
+            'my-reservations': (client, reverse('my-reservations')),
+            'event-availability': (anonymous, reverse('event-availability') + '?' + urlencode({
+                'date_from': timezone.now().isoformat(),
+                'date_to': (timezone.now() + timedelta(days=size + 1)).isoformat(),
+            })),
+        }
+
+
+@skipUnless(REPLICA in settings.DATABASES, "nessuna replica configurata")
+@override_settings(
+    RESPONSE_CACHE={**settings.RESPONSE_CACHE, 'ENABLED': False},
+    REPLICAS={**settings.REPLICAS, 'STICKY_SECONDS': 60},
+)
+class ReplicaRoutingTests(TransactionTestCase):
+    """Instradamento delle letture sulla replica di test (mirror di default).
+
+    TransactionTestCase: dentro una transazione aperta su default il router
+    manda tutto al primario.
+    """
+    databases = {DEFAULT_DB_ALIAS, REPLICA}
+
+    def setUp(self):
+        replicas.lag_monitor.reset()
+        caches[settings.REPLICAS['PIN_CACHE']].clear()
+        User = get_user_model()
+        self.buyer = User.objects.create_user('replica-buyer', 'replica-buyer@example.com')
+        self.other = User.objects.create_user('replica-other', 'replica-other@example.com')
+        self.event = Event.objects.create(
+            title='Evento repliche', description='Repliche', location='Repliche',
+            date=timezone.now() + timedelta(days=10), total_seats=10, available_seats=10,
+            organizer=self.other,
+        )
+
+    def tearDown(self):
+        replicas.lag_monitor.reset()
+
+    def test_router(self):
+        router = replicas.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Event))
+        self.assertEqual(router.db_for_write(Event), DEFAULT_DB_ALIAS)
+        with replicas.reading_from(REPLICA):
+            self.assertEqual(router.db_for_read(Event), REPLICA)
+            self.assertEqual(router.db_for_write(Event), DEFAULT_DB_ALIAS)
+            with transaction.atomic():
+                self.assertIsNone(router.db_for_read(Event))
+        self.assertFalse(router.allow_migrate(REPLICA, 'tickets'))
+
+    def test_anonymous_list_reads_from_replica(self):
+        self.assertEqual(self._read(APIClient(), 'event-list'), REPLICA)
+
+    def test_reads_pinned_to_primary_after_write(self):
+        client = self._client(self.buyer)
+        response = client.post(reverse('reservation-create'), {'event': self.event.pk, 'seats': 1},
+                               format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self._read(client, 'my-reservations'), DEFAULT_DB_ALIAS)
+        # Il vincolo vale per chi ha scritto, non per gli altri utenti
+        self.assertEqual(self._read(self._client(self.other), 'my-reservations'), REPLICA)
+        # Senza cookie (client che non li conserva) resta la voce di cache per utente
+        client.cookies.clear()
+        self.assertEqual(self._read(client, 'my-reservations'), DEFAULT_DB_ALIAS)
+        with override_settings(REPLICAS={**settings.REPLICAS, 'STICKY_SECONDS': 0}):
+            self.assertEqual(self._read(client, 'my-reservations'), REPLICA)
+
+    def test_async_reads_pinned_after_write(self):
+        # Sessione vera e non force_authenticate: la view asincrona deve
+        # autenticare la richiesta da sé per trovare il vincolo dell'utente
+        client = APIClient()
+        client.force_login(self.buyer)
+        response = client.post(reverse('reservation-create'), {'event': self.event.pk, 'seats': 1},
+                               format='json')
+        self.assertEqual(response.status_code, 201)
+        # Senza il cookie resta la voce di cache per utente
+        del client.cookies[settings.REPLICAS['PIN_COOKIE']]
+        self.assertEqual(self._read(client, 'event-list'), DEFAULT_DB_ALIAS)
+        other = APIClient()
+        other.force_login(self.other)
+        self.assertEqual(self._read(other, 'event-list', table=Event._meta.db_table), REPLICA)
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        with override_settings(REPLICAS={**settings.REPLICAS, 'LAG_FUNCTION': 'tickets.tests.lagging_replica'}):
+            self.assertEqual(self._read(APIClient(), 'event-list'), DEFAULT_DB_ALIAS)
+
+    @staticmethod
+    def _client(user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def _read(self, client, url_name, table=None):
+        """Alias che ha eseguito le query della GET (uno solo), o solo quelle su `table`"""
+        # Le misure del ritardo non vanno contate tra le query della richiesta
+        replicas.lag_monitor.available()
+        with ExitStack() as stack:
+            captured = {alias: stack.enter_context(CaptureQueriesContext(connections[alias]))
+                        for alias in self.databases}
+            response = client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        used = [alias for alias, queries in captured.items()
+                if any(table is None or table in query['sql'] for query in queries)]
+        self.assertEqual(len(used), 1, used)
+        return used[0]
+
+
+class SeatAllocationTests(TestCase):
+    """UPDATE condizionale dei posti: mai sotto zero, anche con l'inventario sharded"""
+
+    def setUp(self):
+        organizer = get_user_model().objects.create_user('seats-org', 'seats-org@example.com')
+        self.event = make_event(organizer, seats=5)
+
+    def _remaining(self):
+        return Event.objects.get(pk=self.event.pk).remaining_seats
+
+    def test_allocation_beyond_remaining_rejected(self):
+        allocate_seats(self.event, 3)
+        with self.assertRaises(SeatsUnavailable):
+            allocate_seats(self.event, 3)
+        self.assertEqual(self._remaining(), 2)
+        allocate_seats(self.event, 2)
+        with self.assertRaises(SeatsUnavailable):
+            allocate_seats(self.event, 1)
+        self.assertEqual(self._remaining(), 0)
+
+    def test_commit_runs_only_on_success(self):
+        commits = []
+        self.assertEqual(allocate_seats(self.event, 5, commit=lambda: commits.append(1) or 'ok'), 'ok')
+        with self.assertRaises(SeatsUnavailable):
+            allocate_seats(self.event, 1, commit=lambda: commits.append(2))
+        self.assertEqual(commits, [1])
+
+    def test_release_restores_seats(self):
+        allocate_seats(self.event, 4)
+        release_seats(self.event, 4)
+        self.assertEqual(self._remaining(), 5)
+
+    def test_sharded_inventory_keeps_total(self):
+        event = set_shard_count(self.event, 3)
+        self.assertEqual(event.available_seats, 0)
+        shards = EventSeatShard.objects.filter(event=event).values_list('available_seats', flat=True)
+        self.assertEqual(sorted(shards), [1, 2, 2])
+        self.assertEqual(self._remaining(), 5)
+        # Nessuno shard ha 4 posti: il prelievo si distribuisce su più shard
+        allocate_seats(event, 4)
+        self.assertEqual(self._remaining(), 1)
+        with self.assertRaises(SeatsUnavailable):
+            allocate_seats(event, 2)
+        release_seats(event, 3)
+        event = set_shard_count(event, 2)
+        self.assertEqual(self._remaining(), 4)
+        event = set_shard_count(event, 0)
+        self.assertEqual((event.available_seats, event.remaining_seats), (4, 4))
+        self.assertFalse(EventSeatShard.objects.filter(event=event).exists())
+
+
+class HoldExpiryTests(TestCase):
+    """Prenotazioni non pagate: scadenza, conferma e sweep"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.buyer = User.objects.create_user('hold-buyer', 'hold-buyer@example.com')
+        organizer = User.objects.create_user('hold-org', 'hold-org@example.com')
+        # 10 posti, 3 già trattenuti dalle prenotazioni create nei test
+        self.event = make_event(organizer, seats=10, available_seats=7)
+
+    def _hold(self, seats=3, expires_in=600, **fields):
+        return Reservation.objects.create(
+            user=self.buyer, event=self.event, seats=seats,
+            expires_at=timezone.now() + timedelta(seconds=expires_in), **fields
+        )
+
+    def _available(self):
+        return Event.objects.get(pk=self.event.pk).available_seats
+
+    def test_expired_hold_swept(self):
+        expired = self._hold(expires_in=-1)
+        self.assertEqual(sweep_expired_holds(), (1, 3))
+        self.assertFalse(Reservation.objects.filter(pk=expired.pk).exists())
+        self.assertEqual(self._available(), 10)
+        # Una seconda sweep non trova più nulla
+        self.assertEqual(sweep_expired_holds(), (0, 0))
+        self.assertEqual(self._available(), 10)
+
+    def test_active_hold_not_swept(self):
+        active = self._hold()
+        self.assertEqual(sweep_expired_holds(), (0, 0))
+        self.assertTrue(Reservation.objects.filter(pk=active.pk).exists())
+        self.assertEqual(self._available(), 7)
+
+    def test_confirm_expired_hold_fails(self):
+        expired = self._hold(expires_in=-1)
+        self.assertFalse(confirm_hold(expired))
+        expired.refresh_from_db()
+        self.assertFalse(expired.is_confirmed)
+
+    def test_confirmed_reservation_never_swept(self):
+        hold = self._hold()
+        self.assertTrue(confirm_hold(hold))
+        hold.refresh_from_db()
+        self.assertEqual((hold.is_confirmed, hold.expires_at), (True, None))
+        # Anche con una scadenza passata rimasta sulla riga
+        Reservation.objects.filter(pk=hold.pk).update(expires_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(sweep_expired_holds(), (0, 0))
+        self.assertTrue(Reservation.objects.filter(pk=hold.pk).exists())
+        self.assertEqual(self._available(), 7)
+        # La conferma è idempotente
+        self.assertTrue(confirm_hold(hold))
+
+
+class BatchReservationTests(TestCase):
+    """Modalità all_or_nothing e best_effort di POST /api/reservations/batch/"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.buyer = User.objects.create_user('batch-buyer', 'batch-buyer@example.com')
+        organizer = User.objects.create_user('batch-org', 'batch-org@example.com')
+        self.first = make_event(organizer, seats=5)
+        self.second = make_event(organizer, seats=5)
+        self.past = make_event(organizer, seats=5, date=timezone.now() - timedelta(days=1))
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def _post(self, mode, *items):
+        return self.client.post(reverse('reservation-batch'), {
+            'mode': mode, 'items': [{'event': event.pk, 'seats': seats} for event, seats in items],
+        }, format='json')
+
+    def _available(self, event):
+        return Event.objects.get(pk=event.pk).available_seats
+
+    def _assert_nothing_allocated(self):
+        self.assertFalse(Reservation.objects.exists())
+        self.assertEqual([self._available(self.first), self._available(self.second)], [5, 5])
+
+    def test_all_or_nothing_invalid_item(self):
+        response = self._post('all_or_nothing', (self.first, 2), (self.past, 1))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()['items']), ['1'])
+        self._assert_nothing_allocated()
+
+    def test_all_or_nothing_oversold_item(self):
+        response = self._post('all_or_nothing', (self.first, 2), (self.second, 6))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result['status'] for result in response.json()['results']], ['rejected', 'rejected'])
+        self.assertIn('seats', response.json()['results'][1]['errors'])
+        self._assert_nothing_allocated()
+
+    def test_best_effort_commits_valid_items(self):
+        response = self._post('best_effort', (self.first, 2), (self.past, 1), (self.second, 6), (self.second, 3))
+        self.assertEqual(response.status_code, 201)
+        results = response.json()['results']
+        self.assertEqual([(result['index'], result['status']) for result in results],
+                         [(0, 'created'), (1, 'rejected'), (2, 'rejected'), (3, 'created')])
+        self.assertIn('event', results[1]['errors'])
+        self.assertIn('seats', results[2]['errors'])
+        self.assertEqual(Reservation.objects.filter(user=self.buyer, is_confirmed=False).count(), 2)
+        self.assertEqual([self._available(self.first), self._available(self.second)], [3, 2])
+
+    def test_best_effort_nothing_valid(self):
+        response = self._post('best_effort', (self.past, 1), (self.first, 6))
+        self.assertEqual(response.status_code, 400)
+        self._assert_nothing_allocated()
+
+    def test_duplicate_events_in_batch(self):
+        # Stesso evento più volte: una sola riga bloccata, posti scalati in sequenza
+        response = self._post('all_or_nothing', (self.second, 2), (self.first, 1), (self.second, 3))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([self._available(self.first), self._available(self.second)], [4, 0])
+
+        response = self._post('best_effort', (self.first, 3), (self.first, 3), (self.first, 1))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([result['status'] for result in response.json()['results']],
+                         ['created', 'rejected', 'created'])
+        self.assertEqual(self._available(self.first), 0)
+
+        response = self._post('all_or_nothing', (self.second, 1), (self.second, 1))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Reservation.objects.count(), 5)
+
+
+@override_settings(
+    IDEMPOTENCY={**settings.IDEMPOTENCY, 'WAIT_TIMEOUT': 0.1},
+    PAYMENTS={**settings.PAYMENTS, 'WORKERS_IN_PROCESS': False},
+)
+class IdempotencyKeyTests(TestCase):
+    """POST ripetute con la stessa Idempotency-Key"""
+
+    def setUp(self):
+        # Store delle chiavi e code di ammissione nuovi per ogni test
+        for target, attribute, value in ((idempotency, '_store', None),
+                                         (admission, '_backend', admission.InMemoryBackend())):
+            patcher = mock.patch.object(target, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        User = get_user_model()
+        self.buyer = User.objects.create_user('idem-buyer', 'idem-buyer@example.com')
+        self.other = User.objects.create_user('idem-other', 'idem-other@example.com')
+        self.event = make_event(self.other, seats=10, price='12.50')
+        self.client = self._client(self.buyer)
+
+    @staticmethod
+    def _client(user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def _reserve(self, key, seats=2, client=None, **headers):
+        return (client or self.client).post(
+            reverse('reservation-create'), {'event': self.event.pk, 'seats': seats}, format='json',
+            HTTP_IDEMPOTENCY_KEY=key, **headers
+        )
+
+    def _available(self):
+        return Event.objects.get(pk=self.event.pk).available_seats
+
+    def test_reservation_replayed(self):
+        first = self._reserve('res-1')
+        second = self._reserve('res-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second['Content-Type'], 'application/json')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(Reservation.objects.count(), 1)
+        self.assertEqual(self._available(), 8)
+
+    def test_payment_replay_keeps_location(self):
+        reservation = self._reserve('res-1').json()['id']
+        first, second = (
+            self.client.post(reverse('payment-create'), {'reservation': reservation}, format='json',
+                             HTTP_IDEMPOTENCY_KEY='pay-1')
+            for _ in range(2)
+        )
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second['Location'], first['Location'])
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(Payment.objects.filter(reservation_id=reservation).count(), 1)
+
+    def test_rejection_replayed(self):
+        first = self._reserve('res-big', seats=50)
+        second = self._reserve('res-big', seats=50)
+        self.assertEqual((first.status_code, second.status_code), (400, 400))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.content, first.content)
+
+    def test_different_body_rejected(self):
+        self.assertEqual(self._reserve('res-1', seats=2).status_code, 201)
+        response = self._reserve('res-1', seats=3)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_in_flight_duplicate_conflicts(self):
+        payload = {'event': self.event.pk, 'seats': 2}
+        scoped = f'{self.buyer.pk}:reservation-create:res-1'
+        store = idempotency.get_store()
+        self.assertIsNone(store.acquire(scoped, idempotency.fingerprint(SimpleNamespace(data=payload))))
+        self.assertEqual(self._reserve('res-1').status_code, 409)
+        self.assertFalse(Reservation.objects.exists())
+        store.release(scoped)
+        self.assertEqual(self._reserve('res-1').status_code, 201)
+
+    def test_server_error_not_stored(self):
+        with mock.patch('tickets.views.allocate_seats', side_effect=AllocationFailed('locked')):
+            self.assertEqual(self._reserve('res-1').status_code, 503)
+        response = self._reserve('res-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_keys_scoped_per_user(self):
+        self.assertEqual(self._reserve('shared').status_code, 201)
+        response = self._reserve('shared', client=self._client(self.other))
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Reservation.objects.count(), 2)
+
+    def test_used_queue_token_only_replays(self):
+        backend = admission.get_backend()
+        backend.open(self.event.pk, rate=1)
+        token = admission.join(self.event.pk)['token']
+        # Testa della coda oltre il primo numero: token già ammesso
+        backend._queues[self.event.pk]['head'] = 1.0
+        queue = {'HTTP_X_QUEUE_TOKEN': token}
+
+        self.assertEqual(self._reserve('res-1', **queue).status_code, 201)
+        replayed = self._reserve('res-1', **queue)
+        self.assertEqual((replayed.status_code, replayed['Idempotent-Replayed']), (201, 'true'))
+        # Una chiave nuova non permette di riusare il token
+        for _ in range(2):
+            self.assertEqual(self._reserve('res-2', **queue).status_code, 429)
+        # Né la si può usare senza token
+        self.assertEqual(self._reserve('res-3', seats=1).status_code, 429)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+
+class StubGateway(payments.BaseGateway):
+    """Gateway di test: solleva `error` oppure addebita subito"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.charges = []
+
+    def charge(self, reference, amount, method, timeout):
+        self.charges.append(reference)
+        if self.error is not None:
+            raise self.error
+        return f'TX-{reference}'
+
+
+@override_settings(PAYMENTS={
+    **settings.PAYMENTS, 'WORKERS_IN_PROCESS': False, 'MAX_ATTEMPTS': 2, 'CALLBACK_HOSTS': None,
+})
+class PaymentPipelineTests(TestCase):
+    """Stati del pagamento: accodamento, esito del gateway, circuit breaker, callback"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.buyer = User.objects.create_user('pay-buyer', 'pay-buyer@example.com')
+        organizer = User.objects.create_user('pay-org', 'pay-org@example.com')
+        self.event = make_event(organizer, seats=10, price='12.50')
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def _hold(self, seats=2):
+        response = self.client.post(reverse('reservation-create'), {'event': self.event.pk, 'seats': seats},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        return Reservation.objects.get(pk=response.json()['id'])
+
+    def _pay(self, reservation, **data):
+        return self.client.post(reverse('payment-create'), {'reservation': reservation.pk, **data}, format='json')
+
+    def _process(self, gateway, breaker=None):
+        """Reclama i pagamenti dovuti e li passa al gateway: gli esiti in ordine"""
+        breaker = breaker or payments.CircuitBreaker(threshold=5)
+        return [payments.process_payment(payment, gateway, breaker) for payment in payments.claim_payments(10)]
+
+    def test_post_confirms_reservation(self):
+        reservation = self._hold()
+        response = self._pay(reservation)
+        self.assertEqual(response.status_code, 202)
+        payment = Payment.objects.get(reservation=reservation)
+        self.assertEqual(response['Location'], reverse('payment-detail', args=[payment.pk]))
+        self.assertEqual((response.json()['status'], response.json()['amount']), ('pending', '25.00'))
+        reservation.refresh_from_db()
+        self.assertEqual((reservation.is_confirmed, reservation.expires_at), (True, None))
+
+        self.assertEqual(self._process(StubGateway()), ['completed'])
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.transaction_id), ('completed', f'TX-PAY{payment.pk}'))
+        self.assertEqual(self.client.get(response['Location']).json()['status'], 'completed')
+
+    def test_expired_hold_not_paid(self):
+        reservation = self._hold()
+        Reservation.objects.filter(pk=reservation.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self._pay(reservation).status_code, 400)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_gateway_failure_reverts_to_hold(self):
+        reservation = self._hold()
+        self._pay(reservation)
+        gateway = StubGateway(payments.GatewayError("down"))
+        # Primo errore: ritentato più tardi; al secondo (MAX_ATTEMPTS) fallisce
+        self.assertEqual(self._process(gateway), ['retried'])
+        Payment.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(self._process(gateway), ['failed'])
+
+        payment = Payment.objects.get(reservation=reservation)
+        self.assertEqual((payment.status, payment.last_error), ('failed', 'down'))
+        reservation.refresh_from_db()
+        self.assertFalse(reservation.is_confirmed)
+        self.assertGreater(reservation.expires_at, timezone.now())
+
+        # Il pagamento fallito si ripresenta sulla stessa riga
+        response = self._pay(reservation)
+        self.assertEqual((response.status_code, response.json()['id']), (202, payment.pk))
+        self.assertEqual(self._process(StubGateway()), ['completed'])
+        reservation.refresh_from_db()
+        self.assertTrue(reservation.is_confirmed)
+
+    def test_decline_reverts_to_hold(self):
+        reservation = self._hold()
+        self._pay(reservation)
+        self.assertEqual(self._process(StubGateway(payments.PaymentDeclined("no"))), ['declined'])
+        reservation.refresh_from_db()
+        self.assertFalse(reservation.is_confirmed)
+        self.assertEqual(Payment.objects.get().status, 'failed')
+
+    def test_breaker_opens_after_failures(self):
+        for _ in range(3):
+            self._pay(self._hold(seats=1))
+        breaker = payments.CircuitBreaker(threshold=2, reset_timeout=60)
+        gateway = StubGateway(payments.GatewayError("down"))
+        self.assertEqual(self._process(gateway, breaker), ['retried', 'retried', 'deferred'])
+        self.assertEqual(breaker.state, 'open')
+        self.assertEqual(len(gateway.charges), 2)
+        # Il pagamento rimandato non consuma tentativi
+        self.assertEqual(sorted(Payment.objects.values_list('attempts', flat=True)), [0, 1, 1])
+
+    def test_breaker_half_open_trial(self):
+        breaker = payments.CircuitBreaker(threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'half-open')
+        self.assertTrue(breaker.allow())
+        # Una sola chiamata di prova alla volta
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_callback_url_checked(self):
+        for url in ('http://8.8.8.8/hook', 'https://127.0.0.1/hook', 'https://localhost/hook',
+                    'https://10.0.0.5/hook', 'https://169.254.169.254/latest', 'https://[::1]/hook',
+                    'https://[::ffff:192.168.1.1]/hook'):
+            with self.subTest(url=url), self.assertRaises(ValueError):
+                payments.check_callback_url(url)
+        payments.check_callback_url('https://8.8.8.8/hook')
+        with override_settings(PAYMENTS={**settings.PAYMENTS, 'CALLBACK_HOSTS': ['.example.com']}):
+            payments.check_callback_url('https://hooks.example.com/hook')
+            with self.assertRaises(ValueError):
+                payments.check_callback_url('https://8.8.8.8/hook')
+
+        reservation = self._hold()
+        response = self._pay(reservation, callback_url='https://127.0.0.1/hook')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('callback_url', response.json())
+        reservation.refresh_from_db()
+        self.assertFalse(reservation.is_confirmed)
+
+    def test_concurrent_post_conflicts(self):
+        reservation = self._hold()
+        is_valid = PaymentSerializer.is_valid
+
+        def racing(serializer, **kwargs):
+            valid = is_valid(serializer, **kwargs)
+            # L'altra POST crea il pagamento dopo la validazione di questa
+            Payment.objects.create(reservation=reservation, amount=0, payment_method='card')
+            return valid
+
+        with mock.patch.object(PaymentSerializer, 'is_valid', racing):
+            response = self._pay(reservation)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_concurrent_resubmission_conflicts(self):
+        reservation = self._hold()
+        self._pay(reservation)
+        self._process(StubGateway(payments.PaymentDeclined("no")))
+        confirm_hold_ = confirm_hold
+
+        def racing(hold):
+            # L'altra POST ha già ripresentato il pagamento fallito
+            Payment.objects.filter(reservation=hold).update(status='pending')
+            return confirm_hold_(hold)
+
+        with mock.patch('tickets.views.confirm_hold', side_effect=racing):
+            response = self._pay(reservation)
+        self.assertEqual(response.status_code, 409)
+
+
+@override_settings(REPLICAS={**settings.REPLICAS, 'LAG_FUNCTION': 'tickets.tests.lagging_replica'})
+class InstrumentationTests(TestCase):
+    """Le misure delle richieste non arrivano ai client non autorizzati"""
+
+    def test_server_timing_off_by_default(self):
+        self.assertNotIn('Server-Timing', APIClient().get(reverse('event-list')))
+        with override_settings(INSTRUMENTATION={**settings.INSTRUMENTATION, 'SERVER_TIMING': True}):
+            self.assertIn('db;dur=', APIClient().get(reverse('event-list'))['Server-Timing'])
+
+    @override_settings(INSTRUMENTATION={**settings.INSTRUMENTATION, 'METRICS_TOKEN': 'scraper'})
+    def test_metrics_staff_or_token(self):
+        User = get_user_model()
+        staff = APIClient()
+        staff.force_login(User.objects.create_user('metrics-staff', 'metrics-staff@example.com', is_staff=True))
+        user = APIClient()
+        user.force_login(User.objects.create_user('metrics-user', 'metrics-user@example.com'))
+        self.assertEqual(staff.get(reverse('metrics')).status_code, 200)
+        self.assertEqual(APIClient().get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scraper').status_code, 200)
+        for client in (APIClient(), user):
+            self.assertIn(client.get(reverse('metrics')).status_code, (401, 403))
+        self.assertIn(APIClient().get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, (401, 403))
@@ -1,26 +1,52 @@
 from django.urls import path
+from .async_views import AsyncEventListView, AsyncEventDetailView, AsyncEventSearchView
 from .views import (
-    EventListCreateView,
-    EventRetrieveUpdateDestroyView,
     ReservationCreateView,
     UserReservationsListView,
     ReservationCancelView,
-    EventSearchView, PaymentCreateView
+    PaymentCreateView, PaymentDetailView, PaymentMetricsView,
+    AdmissionQueueView, HoldMetricsView, ReservationBatchCreateView,
+    ResponseCacheMetricsView, ReplicaMetricsView, EventAvailabilityView, OrganizerStatsView,
+    ExportView,
 )
 
 urlpatterns = [
     # Gestione eventi
-    path('events/', EventListCreateView.as_view(), name='event-list'),
-    path('events/<int:pk>/', EventRetrieveUpdateDestroyView.as_view(), name='event-detail'),
+    # GET asincrone (ORM asincrono), gli altri metodi sulle view DRF
+    path('events/', AsyncEventListView.as_view(), name='event-list'),
+    path('events/<int:pk>/', AsyncEventDetailView.as_view(), name='event-detail'),
 
     # Ricerca eventi (aggiuntivo)
-    path('events/search/', EventSearchView.as_view(), name='event-search'),
+    path('events/search/', AsyncEventSearchView.as_view(), name='event-search'),
+
+    # Calendario della disponibilità (aggregati per giorno o per ora)
+    path('events/availability/', EventAvailabilityView.as_view(), name='event-availability'),
+
+    # Contatori della cache delle risposte (solo staff)
+    path('events/cache/metrics/', ResponseCacheMetricsView.as_view(), name='response-cache-metrics'),
+
+    # Coda di ammissione per le vendite ad alta domanda
+    path('events/<int:pk>/queue/', AdmissionQueueView.as_view(), name='event-queue'),
 
     # Prenotazioni
     path('reservations/', ReservationCreateView.as_view(), name='reservation-create'),
+    path('reservations/batch/', ReservationBatchCreateView.as_view(), name='reservation-batch'),
     path('reservations/my/', UserReservationsListView.as_view(), name='my-reservations'),
     path('reservations/<int:pk>/cancel/', ReservationCancelView.as_view(), name='reservation-cancel'),
+    path('reservations/holds/metrics/', HoldMetricsView.as_view(), name='hold-metrics'),
+
+    # Statistiche di vendita dell'organizzatore
+    path('organizer/stats/', OrganizerStatsView.as_view(), name='organizer-stats'),
+
+    # Export in streaming (CSV o NDJSON)
+    path('exports/reservations/', ExportView.as_view(export='reservations'), name='reservation-export'),
+    path('exports/payments/', ExportView.as_view(export='payments'), name='payment-export'),
 
     # Pagamento
     path('payments/', PaymentCreateView.as_view(), name='payment-create'),
+    path('payments/<int:pk>/', PaymentDetailView.as_view(), name='payment-detail'),
+    path('payments/metrics/', PaymentMetricsView.as_view(), name='payment-metrics'),
+
+    # Stato delle repliche di lettura (solo staff)
+    path('replicas/metrics/', ReplicaMetricsView.as_view(), name='replica-metrics'),
 ]
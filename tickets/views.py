@@ -1,40 +1,103 @@
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
-from django.db.models import F
-from . import serializers, models
-from .models import Event, Reservation, Payment
-from .permissions import IsOrganizerOrAdmin
-from .serializers import EventSerializer, ReservationSerializer, PaymentSerializer
+from .models import Event, OrganizerSales, Reservation, Payment
+from .pagination import (
+    EventKeysetPagination, ReservationKeysetPagination, EventSearchPagination
+)
+from .permissions import CanReadMetrics, IsOrganizerOrAdmin
+from .serializers import (
+    EventSerializer, ReservationSerializer, PaymentSerializer, ReservationBatchSerializer,
+    EventAvailabilitySerializer, AvailabilityRollupSerializer, OrganizerEventSalesSerializer,
+    OrganizerSalesSerializer, ExportFilterSerializer,
+)
+from . import admission, availability, exports, instrumentation, payments, replicas, response_cache, sales, search
+from .conditional import ConditionalGetMixin, STAMP_FIELDS
+from .idempotency import IdempotentMixin
+from .replicas import ReplicaReadMixin
+from .response_cache import CachedResponseMixin
+from users.authentication import user_instance
+from .services import (
+    allocate_seats, release_seats, adjust_capacity, SeatsUnavailable, AllocationFailed,
+    hold_expiry, confirm_hold, hold_metrics, allocate_batch, BatchRejected,
+)
+from django.db import IntegrityError, transaction
+from django.core import signing
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.urls import reverse
+from django.db.models import Prefetch
+from django.http import HttpResponse
 
 
-class EventListCreateView(generics.ListCreateAPIView):
+class EventListCreateView(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, generics.ListCreateAPIView):
     """View per listare e creare eventi"""
-    queryset = Event.objects.filter(date__gte=timezone.now())
     serializer_class = EventSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = EventKeysetPagination
     filterset_fields = ['organizer', 'date', 'location']
+    cache_scope = 'event-list'
     search_fields = ['title', 'description', 'location']
+    # Solo ETag: eliminazioni e uscite dal filtro non spostano Last-Modified
+    stamp_last_modified = False
+
+    def get_queryset(self):
+        # organizer serve allo SlugRelatedField di EventSerializer
+        return Event.objects.with_availability().with_version().filter(
+            date__gte=timezone.now()
+        ).select_related('organizer')
+
+    def get_stamp_queryset(self):
+        # Stessa pagina della risposta, ma solo le colonne della versione
+        return Event.objects.with_version().filter(date__gte=timezone.now()).only(*STAMP_FIELDS)
+
+    def get_stamp_rows(self):
+        return self.paginate_queryset(self.get_stamp_queryset())
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        return self.set_stamp(response, self.paginator.page)
 
     def perform_create(self, serializer):
-        serializer.save(organizer=self.request.user)
+        # Con l'evento nasce la sua riga di statistiche di vendita (tickets.sales)
+        with transaction.atomic():
+            serializer.save(organizer=user_instance(self.request.user))
+
 
+from rest_framework.exceptions import ValidationError, APIException, NotFound, PermissionDenied
 
-from rest_framework.exceptions import ValidationError
 
+class SeatAllocationBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Troppe richieste concorrenti per questo evento, riprova."
+    default_code = 'seat_allocation_busy'
 
-class EventRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
+
+class EventRetrieveUpdateDestroyView(ConditionalGetMixin, CachedResponseMixin,
+                                     generics.RetrieveUpdateDestroyAPIView):
     """View per dettaglio, modifica e cancellazione eventi"""
-    queryset = Event.objects.all()
     serializer_class = EventSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    cache_scope = 'event-detail'
+
+    def get_queryset(self):
+        return Event.objects.with_availability().with_version().select_related('organizer')
 
     def get_object(self):
-        event = get_object_or_404(Event, pk=self.kwargs['pk'])
+        event = get_object_or_404(self.get_queryset(), pk=self.kwargs['pk'])
+        self.check_object_permissions(self.request, event)
         return event
 
+    def get_stamp_queryset(self):
+        return Event.objects.with_version().filter(pk=self.kwargs['pk']).only(*STAMP_FIELDS)
+
+    def get_stamp_rows(self):
+        return list(self.get_stamp_queryset()) or None
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        response = Response(self.get_serializer(instance).data)
+        return self.set_stamp(response, [instance])
+
     def get_permissions(self):
         if self.request.method in ['PUT', 'PATCH', 'DELETE']:
             return [IsOrganizerOrAdmin()]
@@ -45,18 +108,13 @@ class EventRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
         new_total_seats = serializer.validated_data.get('total_seats', instance.total_seats)
 
         # Controllo che i nuovi posti totali non siano minori di quelli già prenotati
-        seats_already_reserved = instance.total_seats - instance.available_seats
+        seats_already_reserved = instance.total_seats - instance.remaining_seats
         if new_total_seats < seats_already_reserved:
             raise ValidationError({
                 'total_seats': f'Non puoi impostare meno di {seats_already_reserved} posti totali '
                                f'(già {seats_already_reserved} prenotati)'
             })
 
-        # Calcola la nuova disponibilità
-        if 'total_seats' in serializer.validated_data:
-            difference = new_total_seats - instance.total_seats
-            serializer.validated_data['available_seats'] = instance.available_seats + difference
-
         # Gestione del prezzo
         new_price = serializer.validated_data.get('price', instance.price)
         if new_price < 0:
@@ -64,44 +122,124 @@ class EventRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
                 'price': 'Il prezzo non può essere negativo'
             })
 
-        serializer.save()
+        # La differenza di capienza si applica con un UPDATE atomico sul contatore
+        # (o sugli shard), senza sovrascrivere le prenotazioni concorrenti
+        difference = new_total_seats - instance.total_seats
+        try:
+            with transaction.atomic():
+                serializer.save()
+                if difference:
+                    adjust_capacity(instance, difference)
+        except SeatsUnavailable:
+            raise ValidationError({
+                'total_seats': 'Posti già prenotati nel frattempo, riprova con un valore maggiore'
+            })
+        serializer.instance = Event.objects.with_availability().select_related(
+            'organizer'
+        ).get(pk=instance.pk)
 
     def perform_destroy(self, instance):
         instance.delete()
 
 
-class ReservationCreateView(generics.CreateAPIView):
+class ReservationCreateView(IdempotentMixin, generics.CreateAPIView):
     """View per creare prenotazioni"""
     queryset = Reservation.objects.all()
     serializer_class = ReservationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    idempotency_scope = 'reservation-create'
 
     def perform_create(self, serializer):
         event = serializer.validated_data['event']
         seats = serializer.validated_data['seats']
 
-        if seats > event.available_seats:
-            raise serializers.ValidationError(
+        def commit():
+            reservation = serializer.save(
+                user=user_instance(self.request.user), is_confirmed=False, expires_at=hold_expiry()
+            )
+            sales.reserved([reservation])
+
+        # Decremento condizionale e salvataggio nella stessa transazione:
+        # è il database a garantire che i posti bastino
+        try:
+            allocate_seats(event, seats, commit=commit)
+        except SeatsUnavailable:
+            raise ValidationError(
                 {"seats": "Non ci sono abbastanza posti disponibili."}
             )
+        except AllocationFailed:
+            raise SeatAllocationBusy()
 
-        # Transazione atomica per evitare race conditions
-        Event.objects.filter(id=event.id).update(
-            available_seats=F('available_seats') - seats
+
+class ReservationBatchCreateView(IdempotentMixin, generics.GenericAPIView):
+    """View per creare più prenotazioni, anche su eventi diversi, in una sola chiamata"""
+    serializer_class = ReservationBatchSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    idempotency_scope = 'reservation-batch'
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        valid = data['valid_items']
+        results = [
+            {'index': index, 'status': 'rejected', 'errors': errors}
+            for index, errors in data['item_errors'].items()
+        ]
+
+        outcome = []
+        if valid:
+            try:
+                outcome = allocate_batch(
+                    user_instance(request.user), [(event, seats) for _, event, seats in valid],
+                    all_or_nothing=data['mode'] == 'all_or_nothing'
+                )
+            except BatchRejected as exc:
+                return Response({'results': [
+                    {'index': index, 'status': 'rejected', 'errors': {"seats": (
+                        "Posti disponibili insufficienti." if reservation is None
+                        else "Batch annullato: un altro elemento non è evadibile."
+                    )}}
+                    for (index, _, _), reservation in zip(valid, exc.outcome)
+                ]}, status=status.HTTP_400_BAD_REQUEST)
+            except AllocationFailed:
+                raise SeatAllocationBusy()
+
+        context = self.get_serializer_context()
+        for (index, _, _), reservation in zip(valid, outcome):
+            if reservation is None:
+                results.append({'index': index, 'status': 'rejected',
+                                'errors': {"seats": "Posti disponibili insufficienti."}})
+            else:
+                results.append({'index': index, 'status': 'created',
+                                'reservation': ReservationSerializer(reservation, context=context).data})
+        results.sort(key=lambda result: result['index'])
+
+        created = any(result['status'] == 'created' for result in results)
+        return Response(
+            {'results': results},
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST
         )
-        serializer.save(user=self.request.user, is_confirmed=True)
 
 
-class UserReservationsListView(generics.ListAPIView):
+class UserReservationsListView(ReplicaReadMixin, generics.ListAPIView):
     """View per listare le prenotazioni dell'utente"""
     serializer_class = ReservationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ReservationKeysetPagination
 
     def get_queryset(self):
+        # Le prenotazioni scadute restano in tabella fino alla sweep successiva.
+        # Gli eventi annidati arrivano con una sola query aggiuntiva, già
+        # annotati con i posti disponibili e con l'organizzatore
         return Reservation.objects.filter(
-            user=self.request.user,
+            user_id=self.request.user.pk,
             event__date__gte=timezone.now()
-        ).select_related('event')
+        ).exclude(
+            is_confirmed=False, expires_at__lte=timezone.now()
+        ).select_related('user').prefetch_related(
+            Prefetch('event', queryset=Event.objects.with_availability().select_related('organizer'))
+        )
 
 
 class ReservationCancelView(generics.DestroyAPIView):
@@ -111,49 +249,137 @@ class ReservationCancelView(generics.DestroyAPIView):
 
     def get_object(self):
         obj = get_object_or_404(Reservation, pk=self.kwargs['pk'])
-        if obj.user != self.request.user and not self.request.user.is_staff:
-            raise permissions.PermissionDenied(
+        if obj.user_id != self.request.user.pk and not self.request.user.is_staff:
+            raise PermissionDenied(
                 "Non hai i permessi per cancellare questa prenotazione."
             )
         return obj
 
     def perform_destroy(self, instance):
+        def delete():
+            # DELETE condizionale: se la sweep ha già rilasciato la prenotazione
+            # i posti non vanno restituiti una seconda volta
+            sales.released([instance.pk])
+            deleted, _ = Reservation.objects.filter(pk=instance.pk).delete()
+            if not deleted:
+                raise NotFound("Prenotazione già cancellata o scaduta.")
+
         # Ripristina i posti disponibili
-        Event.objects.filter(id=instance.event.id).update(
-            available_seats=F('available_seats') + instance.seats
-        )
-        instance.delete()
+        try:
+            release_seats(instance.event, instance.seats, commit=delete)
+        except AllocationFailed:
+            raise SeatAllocationBusy()
 
 
-class EventSearchView(generics.ListAPIView):
-    """View aggiuntiva per ricerca eventi"""
+class EventSearchView(ReplicaReadMixin, CachedResponseMixin, generics.ListAPIView):
+    """View aggiuntiva per ricerca eventi (full-text, ordinata per rilevanza)"""
     serializer_class = EventSerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = EventSearchPagination
+    cache_scope = 'event-search'
 
     def get_queryset(self):
-        queryset = Event.objects.filter(date__gte=timezone.now())
+        now = timezone.now()
+        queryset = Event.objects.with_availability().filter(
+            date__gte=now
+        ).select_related('organizer')
 
         search_term = self.request.query_params.get('search', None)
         if search_term:
-            queryset = queryset.filter(
-                Q(title__icontains=search_term) |
-                Q(description__icontains=search_term) |
-                Q(location__icontains=search_term)
-            )
+            return search.get_backend().search(queryset, search_term, since=now)
 
         return queryset
 
 
-class PaymentCreateView(generics.CreateAPIView):
+class EventAvailabilityView(ReplicaReadMixin, generics.GenericAPIView):
+    """View del calendario della disponibilità: eventi, posti totali e residui
+    per giorno o per ora tra `date_from` e `date_to` (tabella AvailabilityRollup)"""
+    serializer_class = EventAvailabilitySerializer
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        rows = availability.calendar(**serializer.validated_data)
+        return Response({
+            'granularity': serializer.validated_data['granularity'],
+            'results': AvailabilityRollupSerializer(rows, many=True).data,
+        })
+
+
+class OrganizerStatsView(generics.ListAPIView):
+    """View delle statistiche di vendita dell'organizzatore: totali in `totals`
+    e per evento nella lista paginata (contatori di tickets.sales).
+
+    Lo staff può vedere un altro organizzatore con ``?organizer=<id>``.
+    """
+    serializer_class = OrganizerEventSalesSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = EventKeysetPagination
+
+    def get_organizer_id(self):
+        organizer = self.request.query_params.get('organizer')
+        if organizer is None or organizer == str(self.request.user.pk):
+            return self.request.user.pk
+        if not self.request.user.is_staff:
+            raise PermissionDenied("Puoi vedere solo le statistiche dei tuoi eventi.")
+        try:
+            return int(organizer)
+        except ValueError:
+            raise ValidationError({'organizer': "Id dell'organizzatore non valido."})
+
+    def get_queryset(self):
+        return Event.objects.filter(organizer_id=self.get_organizer_id()).select_related('sales')
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        totals = OrganizerSales.objects.filter(organizer_id=self.get_organizer_id()).first()
+        response.data['totals'] = OrganizerSalesSerializer(totals or OrganizerSales()).data
+        return response
+
+
+class ExportView(generics.GenericAPIView):
+    """View per l'export in streaming (CSV o NDJSON) di prenotazioni o pagamenti.
+
+    Filtri: `event`, `organizer`, `date_from`/`date_to` (creazione della
+    prenotazione o data del pagamento). Lo staff esporta tutto, un
+    organizzatore solo le righe dei propri eventi.
+    """
+    serializer_class = ExportFilterSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    export = None
+
+    def get(self, request):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        filters = dict(serializer.validated_data)
+        output = filters.pop('output')
+        if not request.user.is_staff:
+            if filters.get('organizer', request.user.pk) != request.user.pk:
+                raise PermissionDenied("Puoi esportare solo le righe dei tuoi eventi.")
+            filters['organizer'] = request.user.pk
+        return exports.stream(request, self.export, output, **filters)
+
+
+class PaymentCreateView(IdempotentMixin, generics.CreateAPIView):
+    """View per accodare il pagamento di una prenotazione.
+
+    Risponde 202 con il pagamento 'pending': l'addebito lo esegue la pipeline
+    di ``tickets.payments``. Un pagamento fallito si può ripresentare sulla
+    stessa prenotazione finché questa non scade.
+    """
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    idempotency_scope = 'payment-create'
 
     def create(self, request, *args, **kwargs):
         reservation_id = request.data.get('reservation')
         try:
-            reservation = Reservation.objects.get(id=reservation_id, user=request.user)
-        except Reservation.DoesNotExist:
+            reservation = Reservation.objects.select_related('event').get(
+                id=reservation_id, user_id=request.user.pk
+            )
+        except (Reservation.DoesNotExist, ValueError, TypeError):
             return Response(
                 {"error": "Prenotazione non trovata o non autorizzata"},
                 status=status.HTTP_400_BAD_REQUEST
@@ -166,18 +392,156 @@ class PaymentCreateView(generics.CreateAPIView):
             'reservation': reservation.id,
             'amount': total_amount,
             'payment_method': request.data.get('payment_method', 'card'),
-            'status': 'pending'
+            'callback_url': request.data.get('callback_url', ''),
         }
 
-        serializer = self.get_serializer(data=payment_data)
+        failed = Payment.objects.filter(reservation=reservation, status='failed').first()
+        previous = (failed.status, failed.amount) if failed else None
+        serializer = self.get_serializer(failed, data=payment_data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
 
-        # Qui andrebbe integrato il vero processore di pagamento
-        # Per ora simulo un pagamento riuscito
-        payment = serializer.instance
-        payment.status = 'completed'
-        payment.transaction_id = f"SIM{payment.id:08d}"
-        payment.save()
+        try:
+            with transaction.atomic():
+                # Il pagamento blocca la prenotazione solo se non è già scaduta
+                if not confirm_hold(reservation):
+                    return Response(
+                        {"error": "Prenotazione scaduta: effettua una nuova prenotazione"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                # confirm_hold ha bloccato la prenotazione: una POST concorrente
+                # che ha già ripresentato il pagamento fallito si vede qui
+                if failed and not Payment.objects.filter(pk=failed.pk, status='failed').exists():
+                    return self._conflict()
+                payment = serializer.save(
+                    status='pending', attempts=0, last_error='', transaction_id=None,
+                    next_attempt_at=timezone.now()
+                )
+                changes = [sales.payment_delta(payment.status, payment.amount)]
+                if previous:
+                    changes.append(sales.payment_delta(*previous, sign=-1))
+                sales.record([((reservation.event_id, reservation.event.organizer_id), delta) for delta in changes])
+                payments.enqueued(payment)
+        except IntegrityError:
+            # Il pagamento della prenotazione l'ha creato una POST concorrente
+            return self._conflict()
+
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': reverse('payment-detail', args=[payment.pk])})
+
+    @staticmethod
+    def _conflict():
+        return Response(
+            {"error": "Pagamento già in corso per questa prenotazione"},
+            status=status.HTTP_409_CONFLICT
+        )
+
+
+class PaymentDetailView(generics.RetrieveAPIView):
+    """View per il polling dello stato di un pagamento dell'utente"""
+    serializer_class = PaymentSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Payment.objects.filter(reservation__user_id=self.request.user.pk)
+
+
+class PaymentMetricsView(generics.GenericAPIView):
+    """View per i contatori della pipeline dei pagamenti (solo staff)"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(payments.metrics())
+
+
+class HoldMetricsView(generics.GenericAPIView):
+    """View per le metriche delle prenotazioni in attesa di pagamento (solo staff)"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(hold_metrics())
+
 
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+class ResponseCacheMetricsView(generics.GenericAPIView):
+    """View per i contatori della cache delle risposte sugli eventi (solo staff)"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(response_cache.metrics())
+
+
+class ReplicaMetricsView(generics.GenericAPIView):
+    """View per lo stato delle repliche di lettura (solo staff)"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(replicas.metrics())
+
+
+class MetricsView(generics.GenericAPIView):
+    """Metriche del processo in formato Prometheus (token dello scraper o staff)"""
+    # Il token dello scraper non è un JWT: l'autenticazione la fa il permesso
+    authentication_classes = []
+    permission_classes = [CanReadMetrics]
+
+    def perform_authentication(self, request):
+        # Senza autenticatori DRF sostituirebbe l'utente della sessione con
+        # AnonymousUser prima del controllo del permesso
+        pass
+
+    def get(self, request):
+        return HttpResponse(instrumentation.render_metrics(),
+                            content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class AdmissionQueueView(generics.GenericAPIView):
+    """View per entrare nella coda di ammissione di un evento e controllare la posizione.
+
+    GET e POST non autenticano e non interrogano il database: lo stato della
+    coda vive nel backend configurato in ``settings.ADMISSION_QUEUE``.
+    PUT (apertura con `rate`) e DELETE (chiusura) sono riservati allo staff.
+    """
+
+    def get_authenticators(self):
+        if self.request.method in ['PUT', 'DELETE']:
+            return super().get_authenticators()
+        return []
+
+    def get_permissions(self):
+        if self.request.method in ['PUT', 'DELETE']:
+            return [permissions.IsAdminUser()]
+        return [permissions.AllowAny()]
+
+    def put(self, request, pk):
+        try:
+            rate = float(request.data.get('rate', 0))
+        except (TypeError, ValueError):
+            rate = 0
+        if rate <= 0:
+            raise ValidationError({'rate': 'La tariffa di ammissione deve essere positiva'})
+        admission.get_backend().open(pk, rate)
+        return Response({'active': True, 'rate': rate})
+
+    def delete(self, request, pk):
+        admission.get_backend().close(pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def post(self, request, pk):
+        ticket = admission.join(pk)
+        if ticket is None:
+            return Response({'active': False})
+        return Response(ticket, status=status.HTTP_201_CREATED)
+
+    def get(self, request, pk):
+        token = request.headers.get('X-Queue-Token') or request.query_params.get('token')
+        if not token:
+            return Response({'active': admission.is_active(pk)})
+        try:
+            event_id, seq = admission.read_token(token)
+        except signing.BadSignature:
+            event_id = None
+        if event_id != pk:
+            return Response(
+                {"error": "Token di coda non valido o scaduto"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(admission.position(pk, seq))
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+        from django.db.models.signals import post_save, post_delete
+        from .authentication import user_changed
+
+        # Invalida la cache di stato dell'autenticazione stateless
+        User = get_user_model()
+        post_save.connect(user_changed, sender=User, dispatch_uid='users.authentication.saved')
+        post_delete.connect(user_changed, sender=User, dispatch_uid='users.authentication.deleted')
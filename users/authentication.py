@@ -0,0 +1,134 @@
+"""Autenticazione JWT stateless, attivabile con ``JWT_STATELESS_AUTH=1``.
+
+``JWTAuthentication`` di simplejwt carica l'utente dal database a ogni
+richiesta. ``StatelessJWTAuthentication`` costruisce invece un ``ClaimsUser``
+dai claim firmati del token (id, username). Lo stato che può cambiare dopo
+l'emissione del token (utente disattivato, staff revocato, password cambiata
+con ``CHECK_REVOKE_TOKEN``) si legge con una query su tre colonne e resta in
+una cache LRU per ``STATELESS_AUTH['CACHE_TTL']`` secondi: è il ritardo
+massimo con cui una revoca ha effetto negli altri processi; nel processo che
+salva l'utente la voce viene invalidata subito.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+def _config(key, default=None):
+    return getattr(settings, 'STATELESS_AUTH', {}).get(key, default)
+
+
+class UserStateCache:
+    """Cache LRU thread-safe con scadenza: id utente -> (is_active, is_staff, md5 della password)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def set(self, user_id, state):
+        expires = time.monotonic() + _config('CACHE_TTL', 30)
+        with self._lock:
+            self._entries[user_id] = (expires, state)
+            self._entries.move_to_end(user_id)
+            if len(self._entries) > _config('CACHE_SIZE', 10000):
+                self._entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_states = UserStateCache()
+
+
+def user_state(user_id):
+    """(is_active, is_staff, md5 della password) dell'utente, None se non esiste"""
+    state = user_states.get(user_id)
+    if state is None:
+        row = get_user_model().objects.filter(
+            **{api_settings.USER_ID_FIELD: user_id}
+        ).values_list('is_active', 'is_staff', 'password').first()
+        if row is None:
+            return None
+        state = (row[0], row[1], get_md5_hash_password(row[2]))
+        user_states.set(user_id, state)
+    return state
+
+
+def user_changed(sender, instance, **kwargs):
+    """Ricevitore di post_save/post_delete sul modello utente"""
+    user_states.discard(getattr(instance, api_settings.USER_ID_FIELD))
+
+
+class ClaimsUser(TokenUser):
+    """Utente costruito dai claim del token; `is_staff` viene dallo stato in cache"""
+
+    def __init__(self, token, is_staff):
+        super().__init__(token)
+        self.is_staff = is_staff
+
+    @cached_property
+    def id(self):
+        # Il claim è una stringa: stesso tipo della chiave primaria, così i
+        # confronti con le FK (organizer_id, user_id) funzionano
+        return get_user_model()._meta.pk.to_python(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def instance(self):
+        """Istanza del modello utente, non letta dal database, per le FK"""
+        user = get_user_model()(pk=self.pk, username=self.username, is_staff=self.is_staff, is_active=True)
+        user._state.adding = False
+        return user
+
+
+def user_instance(user):
+    """Utente da assegnare alle FK (``serializer.save(user=...)``): il modello con
+    l'autenticazione classica, l'istanza costruita dai claim con ``ClaimsUser``"""
+    return user.instance if isinstance(user, ClaimsUser) else user
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """JWT senza caricare l'utente: al più una query per utente ogni CACHE_TTL secondi"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = get_user_model()._meta.pk.to_python(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, ValidationError):
+            raise InvalidToken("Il token non contiene l'identificativo dell'utente")
+
+        state = user_state(user_id)
+        if state is None:
+            raise AuthenticationFailed("Utente non trovato", code='user_not_found')
+        is_active, is_staff, password = state
+        if api_settings.CHECK_USER_IS_ACTIVE and not is_active:
+            raise AuthenticationFailed("Utente disattivato", code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password:
+            raise AuthenticationFailed("La password è stata cambiata", code='password_changed')
+        return ClaimsUser(validated_token, is_staff)
@@ -0,0 +1,122 @@
+"""Hasher delle password eseguiti su un pool di thread limitato.
+
+Sono gli hasher di Django con lo stesso nome di algoritmo (gli hash
+esistenti restano validi), ma ``encode`` e ``verify`` girano su
+``HASHING['WORKERS']`` thread dedicati: PBKDF2, scrypt e argon2 rilasciano
+il GIL, quindi il pool limita i core occupati dagli hash e lascia spazio
+alle altre richieste. Con più di ``MAX_PENDING`` richieste in attesa di un
+thread il login o la registrazione rispondono subito 503 (``HashingBusy``)
+invece di accodarsi. ``WORKERS = 0`` esegue gli hash sul thread della
+richiesta.
+
+Il primo hasher di ``PASSWORD_HASHERS`` è quello preferito: al primo login
+riuscito Django riscrive con quello gli hash di un altro algoritmo o con
+parametri diversi.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+def _config(key, default=None):
+    return getattr(settings, 'HASHING', {}).get(key, default)
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Troppi login o registrazioni in corso, riprova tra qualche secondo."
+    default_code = 'hashing_busy'
+
+
+_worker = threading.local()
+
+
+def _mark_worker():
+    _worker.active = True
+
+
+class HashingPool:
+    """Al più `workers` hash in parallelo e `max_pending` in attesa"""
+
+    def __init__(self, workers, max_pending):
+        self._executor = ThreadPoolExecutor(
+            workers, thread_name_prefix='password-hasher', initializer=_mark_worker
+        )
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def run(self, fn, *args):
+        if getattr(_worker, 'active', False):
+            # verify() di PBKDF2 e scrypt richiama encode(): è già su un thread del pool
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Pool del processo, None se gli hash girano sul thread della richiesta"""
+    global _pool
+    if _pool is None and _config('WORKERS'):
+        with _pool_lock:
+            if _pool is None:
+                _pool = HashingPool(_config('WORKERS'), _config('MAX_PENDING', 32))
+    return _pool
+
+
+def reset_pool():
+    """Ricrea il pool alla prossima richiesta (dopo una modifica di HASHING)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = None
+
+
+class OffloadedHasherMixin:
+    def encode(self, password, salt, *args):
+        pool = get_pool()
+        if pool is None:
+            return super().encode(password, salt, *args)
+        return pool.run(super().encode, password, salt, *args)
+
+    def verify(self, password, encoded):
+        pool = get_pool()
+        if pool is None:
+            return super().verify(password, encoded)
+        return pool.run(super().verify, password, encoded)
+
+
+def _argon2(name):
+    default = getattr(hashers.Argon2PasswordHasher, name)
+    return property(lambda self: _config('ARGON2', {}).get(name, default))
+
+
+class Argon2PasswordHasher(OffloadedHasherMixin, hashers.Argon2PasswordHasher):
+    # Parametri da HASHING['ARGON2'], di default quelli di Django: must_update()
+    # li confronta con quelli di ogni hash, quindi cambiarli riscrive al login
+    # tutti gli hash argon2 esistenti
+    time_cost = _argon2('time_cost')
+    memory_cost = _argon2('memory_cost')
+    parallelism = _argon2('parallelism')
+
+
+class ScryptPasswordHasher(OffloadedHasherMixin, hashers.ScryptPasswordHasher):
+    pass
+
+
+class PBKDF2PasswordHasher(OffloadedHasherMixin, hashers.PBKDF2PasswordHasher):
+    pass
@@ -0,0 +1,64 @@
+import json
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from tickets.bench import percentile
+from tickets.views import UserReservationsListView
+from users.authentication import StatelessJWTAuthentication, user_states
+from users.serializers import CustomTokenObtainPairSerializer
+
+
+class Command(BaseCommand):
+    help = ("Costo dell'autenticazione JWT per richiesta: JWTAuthentication (utente "
+            "caricato dal database) contro StatelessJWTAuthentication (claim + cache), "
+            "sia sulla sola autenticazione sia su GET /api/reservations/my/")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        user, _ = User.objects.get_or_create(
+            username='bench-auth', defaults={'email': 'bench-auth@example.com'}
+        )
+        token = CustomTokenObtainPairSerializer.get_token(user).access_token
+        header = f'Bearer {token}'
+        factory = APIRequestFactory()
+
+        rows = []
+        for auth_class in (JWTAuthentication, StatelessJWTAuthentication):
+            user_states.clear()
+            view = UserReservationsListView.as_view(authentication_classes=[auth_class])
+            authenticator = auth_class()
+
+            def authenticate():
+                authenticator.authenticate(factory.get('/', HTTP_AUTHORIZATION=header))
+
+            def request():
+                response = view(factory.get('/api/reservations/my/', HTTP_AUTHORIZATION=header))
+                assert response.status_code == 200, response.data
+
+            for name, call in (('authenticate', authenticate), ('reservations_my', request)):
+                call()  # riscaldamento (cache di stato compresa)
+                with CaptureQueriesContext(connection) as queries:
+                    call()
+                latencies = []
+                for _ in range(options['requests']):
+                    start = time.perf_counter()
+                    call()
+                    latencies.append(time.perf_counter() - start)
+                rows.append({
+                    'auth': auth_class.__name__,
+                    'path': name,
+                    'queries': len(queries),
+                    'mean_us': round(sum(latencies) / len(latencies) * 1e6, 1),
+                    'p50_us': round(percentile(latencies, 50) * 1e6, 1),
+                    'p99_us': round(percentile(latencies, 99) * 1e6, 1),
+                })
+        self.stdout.write(json.dumps(rows, indent=2))
@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from tickets.bench import percentile, run_concurrently, summarize
+from users import hashers
+
+PASSWORD = 'Bench-login-123'
+HASHERS = {
+    'argon2': 'users.hashers.Argon2PasswordHasher',
+    'scrypt': 'users.hashers.ScryptPasswordHasher',
+    'pbkdf2': 'users.hashers.PBKDF2PasswordHasher',
+}
+
+
+class Command(BaseCommand):
+    help = ("Login al secondo per core con hasher e pool di hashing diversi, e latenza "
+            "di un endpoint leggero (lista eventi) misurata durante i login")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--configs', default=f'pbkdf2:0,argon2:0,argon2:{os.cpu_count() or 1}',
+                            help="Elenco hasher:thread del pool (0 = hash sul thread della richiesta)")
+
+    def handle(self, *args, **options):
+        rows = []
+        for config in options['configs'].split(','):
+            name, workers = config.split(':')
+            rows.append(self._run(name, int(workers), options))
+        self.stdout.write(json.dumps(rows, indent=2))
+
+    def _run(self, name, workers, options):
+        preferred = HASHERS[name]
+        with override_settings(
+            PASSWORD_HASHERS=[preferred, *(path for path in HASHERS.values() if path != preferred)],
+            HASHING={'WORKERS': workers, 'MAX_PENDING': options['concurrency']},
+        ):
+            hashers.reset_pool()
+            User = get_user_model()
+            user, _ = User.objects.get_or_create(
+                username=f'bench-login-{name}', defaults={'email': f'bench-login-{name}@example.com'}
+            )
+            user.set_password(PASSWORD)
+            user.save()
+
+            local = threading.local()
+
+            def login(i):
+                client = getattr(local, 'client', None) or APIClient()
+                local.client = client
+                response = client.post('/api/auth/login/', {'username': user.username, 'password': PASSWORD},
+                                       format='json')
+                return response.status_code
+
+            probes, stop = [], threading.Event()
+
+            def probe():
+                client = APIClient()
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    client.get('/api/events/?page_size=1')
+                    probes.append(time.perf_counter() - start)
+                    time.sleep(0.01)
+
+            prober = threading.Thread(target=probe)
+            prober.start()
+            cpu = time.process_time()
+            try:
+                statuses, latencies, elapsed = run_concurrently(login, options['logins'], options['concurrency'])
+            finally:
+                stop.set()
+                prober.join()
+            cpu = time.process_time() - cpu
+            hashers.reset_pool()
+
+        report = {'hasher': name, 'pool_workers': workers, 'concurrency': options['concurrency']}
+        report.update(summarize(latencies, elapsed))
+        report.update({
+            'cpu_s': round(cpu, 2),
+            'logins_per_cpu_s': round(len(latencies) / cpu, 1) if cpu else None,
+            'rejected_503': statuses.count(503),
+            'errors': sum(1 for code in statuses if code not in (200, 503)),
+            'probe_p50_ms': round(percentile(probes, 50) * 1000, 2),
+            'probe_p99_ms': round(percentile(probes, 99) * 1000, 2),
+        })
+        return report
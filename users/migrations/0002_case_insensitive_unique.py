@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:59
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+# Gruppi di duplicati elencati al massimo nel messaggio d'errore
+MAX_REPORTED = 50
+
+
+def check_case_duplicates(apps, schema_editor):
+    # I vincoli su LOWER() falliscono se esistono già utenti che differiscono
+    # solo per maiuscole: vanno risolti a mano (hanno prenotazioni, eventi...)
+    CustomUser = apps.get_model('users', 'CustomUser')
+    conflicts = []
+    for field in ('email', 'username'):
+        users = CustomUser.objects.annotate(folded=Lower(field))
+        duplicated = users.values('folded').annotate(count=Count('pk')).filter(count__gt=1)
+        for folded in duplicated.values_list('folded', flat=True).order_by('folded'):
+            rows = users.filter(folded=folded).order_by('pk').values_list('pk', field)
+            conflicts.append(f"{field} {folded!r}: " + ', '.join(f"id={pk} {value!r}" for pk, value in rows))
+    if conflicts:
+        listed = '\n'.join(conflicts[:MAX_REPORTED])
+        if len(conflicts) > MAX_REPORTED:
+            listed += f"\n... e altri {len(conflicts) - MAX_REPORTED} gruppi"
+        raise RuntimeError(
+            "Impossibile aggiungere l'unicità senza distinzione di maiuscole: "
+            f"{len(conflicts)} gruppi di utenti differiscono solo per maiuscole. "
+            "Unirli o rinominarli prima di migrare.\n" + listed
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_case_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='customuser',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), name='user_email_ci_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='customuser',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('username'), name='user_username_ci_unique'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 # users/models.py
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Lower
 
 
 class CustomUser(AbstractUser):
@@ -16,4 +17,10 @@ class CustomUser(AbstractUser):
 
     class Meta:
         verbose_name = 'Utente'
-        verbose_name_plural = 'Utenti'
\ No newline at end of file
+        verbose_name_plural = 'Utenti'
+        constraints = [
+            # Unicità senza distinzione di maiuscole: indici su LOWER(), usati
+            # anche dalle ricerche per email/username normalizzati
+            models.UniqueConstraint(Lower('email'), name='user_email_ci_unique'),
+            models.UniqueConstraint(Lower('username'), name='user_username_ci_unique'),
+        ]
\ No newline at end of file
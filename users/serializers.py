@@ -2,11 +2,46 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib.auth.password_validation import validate_password
+from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.core import exceptions
+from django.db import IntegrityError, transaction
 
 CustomUser = get_user_model()
 
 
+# Vincolo di unicità -> campo: quelli su LOWER() di CustomUser.Meta.constraints e
+# gli unique=True delle colonne, che un duplicato identico può violare per primi
+# (PostgreSQL li chiama <tabella>_<colonna>_key, SQLite li cita come tabella.colonna)
+UNIQUE_CONSTRAINTS = {'user_email_ci_unique': 'email', 'user_username_ci_unique': 'username'}
+for _field in ('email', 'username'):
+    UNIQUE_CONSTRAINTS[f'{CustomUser._meta.db_table}_{_field}_key'] = _field
+    UNIQUE_CONSTRAINTS[f'{CustomUser._meta.db_table}.{_field}'] = _field
+UNIQUE_MESSAGES = {
+    'email': "Un utente con questa email esiste già.",
+    'username': "Un utente con questo username esiste già.",
+}
+
+
+def _constraint_name(exc):
+    # psycopg espone il nome del vincolo; gli altri backend solo il messaggio,
+    # che su SQLite lo contiene ("UNIQUE constraint failed: index '...'" o
+    # "UNIQUE constraint failed: tabella.colonna") senza ripetere i valori
+    diag = getattr(exc.__cause__, 'diag', None)
+    if diag is not None:
+        return diag.constraint_name
+    message = str(exc)
+    return next((name for name in UNIQUE_CONSTRAINTS if name in message), None)
+
+
+def unique_violation(exc):
+    """Errore di validazione per un IntegrityError sui vincoli di unicità di email o
+    username (riconosciuti dal nome, vedi UNIQUE_CONSTRAINTS), None per gli altri"""
+    field = UNIQUE_CONSTRAINTS.get(_constraint_name(exc))
+    if field is None:
+        return None
+    return serializers.ValidationError({field: UNIQUE_MESSAGES[field]})
+
+
 class CustomUserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(
         write_only=True,
@@ -28,13 +63,18 @@ class CustomUserSerializer(serializers.ModelSerializer):
         fields = ('id', 'username', 'email', 'password', 'password2', 'phone', 'birth_date', 'is_staff', 'date_joined')
         read_only_fields = ('is_staff', 'date_joined')
         extra_kwargs = {
+            # Niente UniqueValidator (una query per campo, senza distinzione di
+            # maiuscole): l'unicità la garantiscono i vincoli su LOWER() e
+            # create()/update() ne traducono la violazione
             'email': {
                 'required': True,
-                'help_text': "Indirizzo email valido"
+                'help_text': "Indirizzo email valido",
+                'validators': [],
             },
             'username': {
                 'required': False,  # Modificato da True a False
-                'help_text': "Obbligatorio. 150 caratteri o meno."
+                'help_text': "Obbligatorio. 150 caratteri o meno.",
+                'validators': [UnicodeUsernameValidator()],
             },
             'phone': {
                 'required': False,
@@ -55,15 +95,7 @@ class CustomUserSerializer(serializers.ModelSerializer):
             self.fields['password2'].required = True
 
     def validate_email(self, value):
-        value = value.lower()
-        if self.instance and CustomUser.objects.filter(email__iexact=value).exclude(pk=self.instance.pk).exists():
-            raise serializers.ValidationError("Un utente con questa email esiste già.")
-        return value
-
-    def validate_username(self, value):
-        if self.instance and CustomUser.objects.filter(username__iexact=value).exclude(pk=self.instance.pk).exists():
-            raise serializers.ValidationError("Un utente con questo username esiste già.")
-        return value
+        return value.lower()
 
     def validate(self, attrs):
         # Validazione password solo durante la creazione
@@ -88,13 +120,17 @@ class CustomUserSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         validated_data.pop('password2')
-        user = CustomUser.objects.create_user(
-            username=validated_data['username'],
-            email=validated_data['email'],
-            password=validated_data['password'],
-            phone=validated_data.get('phone', ''),
-            birth_date=validated_data.get('birth_date')
-        )
+        try:
+            with transaction.atomic():
+                user = CustomUser.objects.create_user(
+                    username=validated_data['username'],
+                    email=validated_data['email'],
+                    password=validated_data['password'],
+                    phone=validated_data.get('phone', ''),
+                    birth_date=validated_data.get('birth_date')
+                )
+        except IntegrityError as exc:
+            raise unique_violation(exc) or exc
         return user
 
     def update(self, instance, validated_data):
@@ -102,7 +138,11 @@ class CustomUserSerializer(serializers.ModelSerializer):
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
 
-        instance.save()
+        try:
+            with transaction.atomic():
+                instance.save()
+        except IntegrityError as exc:
+            raise unique_violation(exc) or exc
         return instance
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -110,6 +150,7 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     def get_token(cls, user):
         token = super().get_token(user)
         token['username'] = user.username
+        token['is_staff'] = user.is_staff
         return token
 
     def validate(self, attrs):
@@ -1,3 +1,98 @@
-from django.test import TestCase
+import os
+import tempfile
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import Argon2PasswordHasher as DjangoArgon2PasswordHasher
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from users.hashers import Argon2PasswordHasher
+
+PASSWORD = 'Biglietto-Sicuro-42'
+
+
+class RegistrationUniquenessTests(TestCase):
+    """Username ed email sono unici senza distinzione di maiuscole: 400, non 500"""
+
+    def _register(self, username, email):
+        return APIClient().post(reverse('user-register'), {
+            'username': username, 'email': email, 'password': PASSWORD, 'password2': PASSWORD,
+        }, format='json')
+
+    def test_case_variant_username_rejected(self):
+        self.assertEqual(self._register('Mario', 'mario@example.com').status_code, 201)
+        for username in ('mario', 'Mario'):
+            with self.subTest(username=username):
+                response = self._register(username, f'{username}-2@example.com')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('username', response.json())
+        self.assertEqual(get_user_model().objects.count(), 1)
+
+    def test_case_variant_email_rejected(self):
+        self.assertEqual(self._register('anna', 'Anna@Example.com').status_code, 201)
+        response = self._register('anna2', 'anna@example.COM')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('email', response.json())
+
+    def test_profile_update_to_taken_username_rejected(self):
+        get_user_model().objects.create_user('Mario', 'mario@example.com')
+        other = get_user_model().objects.create_user('luca', 'luca@example.com')
+        client = APIClient()
+        client.force_authenticate(other)
+        response = client.patch(reverse('user-detail'), {'username': 'MARIO'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('username', response.json())
+
+
+class ImportUsersTests(TestCase):
+
+    def test_duplicates_reported(self):
+        get_user_model().objects.create_user('Anna', 'anna@example.com')
+        rows = [
+            'username,email,password',
+            'mario,mario@example.com,',
+            'MARIO,mario2@example.com,',   # username già nel file, con maiuscole diverse
+            'luca,Mario@Example.com,',     # email già nel file
+            'anna,anna2@example.com,',     # username già nel database
+            'senza-email,,',               # scartata
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as source:
+            source.write('\n'.join(rows) + '\n')
+        self.addCleanup(os.unlink, source.name)
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_users', source.name, stdout=stdout, stderr=stderr)
+
+        self.assertIn('Righe lette 5: inserite 1, duplicati saltati 3, scartate 1', stdout.getvalue())
+        self.assertIn('Riga 6 scartata', stderr.getvalue())
+        self.assertEqual(
+            sorted(get_user_model().objects.values_list('username', flat=True)), ['Anna', 'mario']
+        )
+
+
+class Argon2ParametersTests(TestCase):
+    """I parametri di argon2 cambiano solo con HASHING['ARGON2']"""
+
+    def setUp(self):
+        django_hasher = DjangoArgon2PasswordHasher()
+        self.django_hash = django_hasher.encode(PASSWORD, django_hasher.salt())
+
+    @override_settings(HASHING={**settings.HASHING, 'ARGON2': {}})
+    def test_defaults_keep_existing_hashes(self):
+        hasher = Argon2PasswordHasher()
+        self.assertTrue(hasher.verify(PASSWORD, self.django_hash))
+        self.assertFalse(hasher.must_update(self.django_hash))
+
+    @override_settings(HASHING={
+        **settings.HASHING, 'ARGON2': {'time_cost': 2, 'memory_cost': 19456, 'parallelism': 1},
+    })
+    def test_configured_parameters(self):
+        hasher = Argon2PasswordHasher()
+        encoded = hasher.encode(PASSWORD, hasher.salt())
+        self.assertIn('$m=19456,t=2,p=1$', encoded)
+        self.assertFalse(hasher.must_update(encoded))
+        # Scelta esplicita: gli hash con i valori di Django vengono riscritti
+        self.assertTrue(hasher.must_update(self.django_hash))
@@ -3,6 +3,7 @@ from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth import get_user_model
+from django.shortcuts import get_object_or_404
 from .serializers import (
     CustomUserSerializer,
     CustomTokenObtainPairSerializer,
@@ -28,7 +29,11 @@ class UserDetailView(generics.RetrieveUpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
+        user = self.request.user
+        if isinstance(user, CustomUser):
+            return user
+        # Utente stateless costruito dal token (users.authentication)
+        return get_object_or_404(CustomUser, pk=user.pk)
 
 
 class CustomTokenObtainPairView(TokenObtainPairView):